@@ -0,0 +1,103 @@
+import math
+import time
+
+
+class Estimate:
+    """When a batch of queued videos should start and finish, in seconds from now"""
+
+    __slots__ = ('start', 'finish', 'rate')
+
+    def __init__(self, start: float, finish: float, rate: float):
+        self.start = start
+        self.finish = finish
+        self.rate = rate        # Videos per second the workers are finishing
+
+    def to_dict(self) -> dict:
+        now = time.time()
+        return {
+            'estimated_start': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now + self.start)),
+            'estimated_finish': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(now + self.finish)),
+            'estimated_start_seconds': math.ceil(self.start),
+            'estimated_finish_seconds': math.ceil(self.finish)
+        }
+
+
+class Rejected(Exception):
+    """Raised by AdmissionController.admit when the backlog would take too long to drain"""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Admits download requests by how long the backlog will take to drain, not by a fixed
+    queue length. Workers report how long each job took; the moving average and the
+    number of workers give the throughput, so provisioning more workers (or faster
+    ones) raises capacity on its own. A batch is rejected when it would finish later
+    than `max_wait`, with a Retry-After for when the backlog will have drained enough.
+    """
+
+    def __init__(self, workers: int, max_wait: float = 900, initial_job_seconds: float = 10,
+                 smoothing: float = 0.2):
+        self.workers = workers
+        self.max_wait = max_wait
+        self.smoothing = smoothing
+        self.job_seconds = initial_job_seconds  # Prior until the first jobs finish
+        self.completed = 0
+        self.in_progress = 0
+
+    @property
+    def rate(self) -> float:
+        """Videos per second the workers finish when they are all busy"""
+        return self.workers / max(self.job_seconds, 0.001)
+
+    def started(self):
+        self.in_progress += 1
+
+    def finished(self, duration: float):
+        """A worker finished a job that took `duration` seconds, successfully or not"""
+        self.in_progress = max(0, self.in_progress - 1)
+        self.completed += 1
+        self.job_seconds += self.smoothing * (duration - self.job_seconds)
+
+    def backlog(self, queued: int) -> int:
+        return queued + self.in_progress
+
+    def drain_time(self, videos: int, flows: int = 1) -> float:
+        """Seconds for `videos` of one user's videos to be done while `flows` users share the workers"""
+        return videos * max(1, flows) / self.rate
+
+    def estimate(self, queued: int, count: int, user_queued: int = 0, active_users: int = 0) -> Estimate:
+        """
+        ETA for `count` more videos from a user with `user_queued` already waiting. The
+        scheduler takes turns between the `active_users` with queued videos, so a user's
+        videos wait for their own earlier ones plus one turn of everyone else's each,
+        but never longer than the whole backlog takes to drain.
+        """
+        flows = active_users + (0 if user_queued else 1)
+        # Videos that have to be picked up before a worker is free for this batch
+        waiting = max(0, self.backlog(queued) - self.workers + 1)
+        ahead = min(waiting, user_queued * flows + flows - 1)
+        start = ahead / self.rate
+        rest = min((count - 1) * flows, waiting - ahead + count - 1)
+        return Estimate(start, start + self.job_seconds + rest / self.rate, self.rate)
+
+    def admit(self, queued: int, count: int, user_queued: int = 0, active_users: int = 0) -> Estimate:
+        """Estimate for the batch, or Rejected when it would not finish within max_wait"""
+        estimate = self.estimate(queued, count, user_queued, active_users)
+        if estimate.finish > self.max_wait:
+            # Estimates shrink in step with the clock while the workers drain the backlog
+            raise Rejected("Download queue is backed up", retry_after=max(1, math.ceil(estimate.finish - self.max_wait)))
+        return estimate
+
+    def stats(self) -> dict:
+        return {
+            'workers': self.workers,
+            'job_seconds': round(self.job_seconds, 2),
+            'videos_per_minute': round(self.rate * 60, 1),
+            'in_progress': self.in_progress,
+            'completed': self.completed,
+            'max_wait_seconds': self.max_wait
+        }
@@ -0,0 +1,74 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+from typing import Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+class StaticAsset:
+    """A static file held in memory together with its pre-compressed variants"""
+
+    def __init__(self, name: str, content: bytes):
+        self.name = name
+        self.content = content
+        self.digest = hashlib.sha256(content).hexdigest()
+        self.etag = self.digest[:16]
+        self.mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        self.variants: Dict[str, bytes] = {}
+
+        if self.mimetype.startswith('text/') or self.mimetype in ('application/javascript', 'application/json'):
+            self.variants['gzip'] = gzip.compress(content, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.variants['br'] = brotli.compress(content, quality=11)
+
+    @property
+    def fingerprinted_name(self) -> str:
+        root, ext = os.path.splitext(self.name)
+        return f"{root}.{self.digest[:10]}{ext}"
+
+    def negotiate(self, accept_encoding: str):
+        """Pick the smallest encoding the client accepts, returning (body, encoding)"""
+        accepted = {part.split(';')[0].strip() for part in (accept_encoding or '').split(',')}
+        for encoding in ('br', 'gzip'):
+            if encoding in accepted and encoding in self.variants:
+                return self.variants[encoding], encoding
+        return self.content, None
+
+
+class AssetManifest:
+    """
+    Fingerprints every file under the static folder once at startup.
+    Templates reference assets through url(), which returns a content-addressed
+    path that can be cached by browsers forever.
+    """
+
+    def __init__(self, static_dir: str, url_prefix: str = '/assets'):
+        self.static_dir = static_dir
+        self.url_prefix = url_prefix.rstrip('/')
+        self._by_name: Dict[str, StaticAsset] = {}
+        self._by_fingerprint: Dict[str, StaticAsset] = {}
+        self.load()
+
+    def load(self):
+        for root, _, files in os.walk(self.static_dir):
+            for filename in files:
+                path = os.path.join(root, filename)
+                name = os.path.relpath(path, self.static_dir).replace(os.sep, '/')
+                with open(path, 'rb') as f:
+                    asset = StaticAsset(name, f.read())
+                self._by_name[name] = asset
+                self._by_fingerprint[asset.fingerprinted_name] = asset
+
+    def url(self, name: str) -> str:
+        asset = self._by_name.get(name)
+        if asset is None:
+            raise KeyError(f"Unknown static asset: {name}")
+        return f"{self.url_prefix}/{asset.fingerprinted_name}"
+
+    def lookup(self, fingerprinted_name: str) -> Optional[StaticAsset]:
+        return self._by_fingerprint.get(fingerprinted_name)
@@ -1,10 +1,12 @@
 import os
-from rich.console import Console
 import aiohttp
 import time
-import asyncio
 from typing import Optional, Dict
 from urllib.parse import urlencode, urlparse
+from resilience import upstream, CircuitOpenError
+from log import get_logger
+
+logger = get_logger('auth')
 
 class TikTokAuth:
     def __init__(self):
@@ -12,26 +14,24 @@ class TikTokAuth:
         self.client_secret = os.getenv('TIKTOK_CLIENT_SECRET')
         self.bypass_auth = os.getenv('BYPASS_AUTH', 'false').lower() == 'true'
         self.is_development = os.getenv('DEVELOPMENT_MODE', 'true').lower() == 'true'
-        self.retry_count = 0
-        self.max_retries = 3
-        self.base_delay = 2
         self._access_token = None
         self._token_expiry = None
-        self.console = Console()
 
         # Set domain based on environment
         self.base_domain = os.getenv('TIKTOK_BASE_DOMAIN', 'app.tiktokrescue.online')
 
         # Construct redirect URI based on environment
         self.redirect_uri = f"https://{self.base_domain}/auth/tiktok/callback"
-        self.console.print(f"[green]Using callback URL: {self.redirect_uri}[/green]")
+        logger.info("Using callback URL: %s", self.redirect_uri)
 
         self.auth_base_url = "https://www.tiktok.com/v2/auth/authorize/"
-        self.token_url = "https://open-api.tiktok.com/oauth/access_token/"
+        oauth_base_url = os.getenv('TIKTOK_OAUTH_BASE_URL', "https://open-api.tiktok.com/oauth")
+        self.token_url = f"{oauth_base_url}/access_token/"
+        self.refresh_url = f"{oauth_base_url}/refresh_token/"
 
         if not self.client_key or not self.client_secret:
             if not self.bypass_auth:
-                self.console.print("[red]Warning: TikTok credentials not found[/red]")
+                logger.error("TikTok credentials not found")
                 raise ValueError("TikTok API credentials are required")
 
     def verify_request_domain(self, request_host):
@@ -40,7 +40,7 @@ class TikTokAuth:
             return True
 
         if request_host != self.base_domain:
-            self.console.print(f"[red]Domain mismatch: {request_host} != {self.base_domain}[/red]")
+            logger.warning("Domain mismatch: %s != %s", request_host, self.base_domain)
             return False
         return True
 
@@ -60,7 +60,7 @@ class TikTokAuth:
     def get_auth_url(self, csrf_state: Optional[str] = None) -> str:
         """Generate TikTok OAuth URL with updated parameters"""
         if self.bypass_auth:
-            self.console.print("[yellow]Auth bypass mode active - authentication URLs disabled[/yellow]")
+            logger.warning("Auth bypass mode active - authentication URLs disabled")
             return "#"
 
         try:
@@ -73,72 +73,95 @@ class TikTokAuth:
             }
 
             auth_url = f"{self.auth_base_url}?{urlencode(params)}"
-            self.console.print(f"[green]Generated auth URL: {auth_url}[/green]")
+            logger.debug("Generated auth URL")
             return auth_url
         except Exception as e:
-            self.console.print(f"[red]Error generating auth URL: {str(e)}[/red]")
+            logger.error("Error generating auth URL: %s", e)
             raise
 
-    async def _exponential_backoff(self):
-        """Implement exponential backoff for rate limits"""
-        if self.retry_count >= self.max_retries:
-            raise Exception("Maximum retry attempts reached. Please try again later.")
-
-        delay = self.base_delay * (2 ** self.retry_count)
-        self.console.print(f"[yellow]Rate limit reached. Waiting {delay} seconds before retry...[/yellow]")
-        await asyncio.sleep(delay)
-        self.retry_count += 1
-
     async def get_access_token(self, code: str) -> Optional[Dict]:
         """Exchange authorization code for access token with retry logic"""
         if not code:
-            self.console.print("[red]Authorization code is required[/red]")
+            logger.warning("Authorization code is required")
             return None
 
-        self.console.print(f"[blue]Attempting to get access token with code: {code[:10]}...[/blue]")
+        logger.info("Exchanging authorization code for access token")
 
-        while self.retry_count < self.max_retries:
-            try:
-                async with aiohttp.ClientSession() as session:
-                    payload = {
-                        'client_key': self.client_key,
-                        'client_secret': self.client_secret,
-                        'code': code,
-                        'grant_type': 'authorization_code',
-                        'redirect_uri': self.redirect_uri
-                    }
+        try:
+            async with aiohttp.ClientSession() as session:
+                payload = {
+                    'client_key': self.client_key,
+                    'client_secret': self.client_secret,
+                    'code': code,
+                    'grant_type': 'authorization_code',
+                    'redirect_uri': self.redirect_uri
+                }
+
+                logger.debug("Requesting token", extra={'token_url': self.token_url, 'redirect_uri': self.redirect_uri})
+
+                # Authorization codes are single use, so only rate limits (429) are retried
+                response = await upstream.request(session, 'POST', self.token_url, endpoint='oauth_token', data=payload, retry_statuses=(429,))
+                async with response:
+                    logger.debug("Token response status %s", response.status)
+
+                    if response.status == 200:
+                        data = await response.json()
+                        if 'data' in data and 'access_token' in data['data']:
+                            token_data = data['data']
+                            self._access_token = token_data['access_token']
+                            self._token_expiry = time.time() + token_data.get('expires_in', 3600)
+                            logger.info("Successfully obtained access token")
+                            return token_data
+                        logger.error("Invalid response format from TikTok API")
+                    elif response.status == 429:
+                        logger.error("Rate limit persisted after retries")
+                    else:
+                        # Error bodies carry no tokens, keep only the start of them
+                        response_text = await response.text()
+                        logger.error("Auth failed: %s - %s", response.status, response_text[:200])
+                    return None
 
-                    self.console.print(f"[blue]Using token URL: {self.token_url}[/blue]")
-                    self.console.print(f"[blue]Payload (masked): {{'client_key': '***', 'client_secret': '***', 'code': '{code[:10]}...', 'grant_type': '{payload['grant_type']}', 'redirect_uri': '{payload['redirect_uri']}' }}[/blue]")
+        except CircuitOpenError as e:
+            logger.error("TikTok auth is unavailable: %s", e)
+            return None
+        except aiohttp.ClientError as e:
+            logger.error("Network error during authentication: %s", e)
+            return None
+        except Exception:
+            logger.exception("Unexpected error during authentication")
+            return None
 
-                    async with session.post(self.token_url, data=payload) as response:
-                        response_text = await response.text()
-                        self.console.print(f"[blue]Response status: {response.status}[/blue]")
-                        self.console.print(f"[blue]Response body: {response_text}[/blue]")
-
-                        if response.status == 200:
-                            data = await response.json()
-                            if 'data' in data and 'access_token' in data['data']:
-                                token_data = data['data']
-                                self._access_token = token_data['access_token']
-                                self._token_expiry = time.time() + token_data.get('expires_in', 3600)
-                                self.retry_count = 0  # Reset retry count on success
-                                self.console.print("[green]Successfully obtained access token[/green]")
-                                return token_data
-                            self.console.print("[red]Invalid response format from TikTok API[/red]")
-                        elif response.status == 429:  # Rate limit
-                            await self._exponential_backoff()
-                            continue
-                        else:
-                            self.console.print(f"[red]Auth failed: {response.status} - {response_text}[/red]")
-                        return None
-
-            except aiohttp.ClientError as e:
-                self.console.print(f"[red]Network error during authentication: {str(e)}[/red]")
-                return None
-            except Exception as e:
-                self.console.print(f"[red]Unexpected error during authentication: {str(e)}[/red]")
-                return None
-
-        self.console.print("[red]Maximum retry attempts reached. Please try again later.[/red]")
-        return None
\ No newline at end of file
+    async def refresh_access_token(self, refresh_token: str) -> Optional[Dict]:
+        """Exchange a refresh token for a new access token"""
+        if not refresh_token:
+            return None
+
+        try:
+            async with aiohttp.ClientSession() as session:
+                payload = {
+                    'client_key': self.client_key,
+                    'grant_type': 'refresh_token',
+                    'refresh_token': refresh_token
+                }
+
+                response = await upstream.request(session, 'POST', self.refresh_url, endpoint='oauth_refresh', data=payload)
+                async with response:
+                    if response.status == 200:
+                        data = await response.json()
+                        if 'data' in data and 'access_token' in data['data']:
+                            logger.info("Successfully refreshed access token")
+                            return data['data']
+                        logger.error("Invalid refresh response format from TikTok API")
+                    else:
+                        logger.error("Token refresh failed: %s", response.status)
+                    return None
+
+        except CircuitOpenError as e:
+            logger.error("TikTok auth is unavailable: %s", e)
+            return None
+        except aiohttp.ClientError as e:
+            logger.error("Network error during token refresh: %s", e)
+            return None
+        except Exception:
+            logger.exception("Unexpected error during token refresh")
+            return None
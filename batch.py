@@ -0,0 +1,359 @@
+"""
+Headless batch downloads for cron jobs and large URL lists.
+
+    python main.py batch --input urls.txt --concurrency 8 --rate 2 --output-dir downloads --results results.jsonl
+    cat urls.txt | python main.py batch --input - > results.jsonl
+    python main.py batch --input urls.txt --resume
+
+Input is read line by line (TikTok URLs or bare video ids, blank lines and # comments
+skipped) so lists of any length run in constant memory. One JSON line is written per
+input line as soon as it finishes, and a compact aggregate progress line goes to stderr.
+Job states are journaled next to the downloads; --resume skips finished jobs and
+continues partial files after a crash or restart.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+import time
+from typing import IO, AsyncIterator, Dict, Optional
+
+from downloader import TikTokDownloader
+from journal import Journal
+from log import get_logger
+from manifest import HASH_ALGORITHM
+from utils import is_valid_tiktok_url
+from variants import VariantPolicy
+
+logger = get_logger('batch')
+
+EXIT_OK = 0            # every input line downloaded
+EXIT_FAILED = 1        # at least one download failed or a line was invalid
+EXIT_USAGE = 2         # bad arguments or unreadable input
+EXIT_AUTH = 3          # tokens were given but could not be set up
+EXIT_INTERRUPTED = 130
+
+
+class BatchStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.completed = 0
+        self.failed = 0
+        self.invalid = 0
+        self.skipped = 0
+        self.in_flight = 0
+        self.bytes = 0
+
+    def add(self, result: Dict):
+        status = result['status']
+        if status == 'completed':
+            self.completed += 1
+        elif status == 'skipped':
+            self.skipped += 1
+        elif status == 'invalid':
+            self.invalid += 1
+        else:
+            self.failed += 1
+
+    @property
+    def done(self) -> int:
+        return self.completed + self.failed + self.invalid + self.skipped
+
+    def line(self) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        return (f"done {self.done} ok {self.completed} skipped {self.skipped} failed {self.failed} invalid {self.invalid} "
+                f"active {self.in_flight} | {self.completed / elapsed:.2f} videos/s "
+                f"{self.bytes / elapsed / 1e6:.2f} MB/s | {elapsed:.0f}s")
+
+
+class BatchProgress:
+    """Progress adapter for TikTokDownloader that only feeds the aggregate byte count"""
+
+    def __init__(self, stats: BatchStats):
+        self.stats = stats
+
+    def add_task(self, description, total=None):
+        return None
+
+    def update(self, task_id, total=None, advance=None, description=None):
+        if advance:
+            self.stats.bytes += advance
+
+
+class ResultWriter:
+    """Appends one JSON object per finished input line and flushes it straight away"""
+
+    def __init__(self, path: str):
+        self._file: IO = sys.stdout if path == '-' else open(path, 'a')
+
+    def write(self, result: Dict):
+        try:
+            self._file.write(json.dumps(result) + '\n')
+            self._file.flush()
+        except BrokenPipeError:
+            # The reader went away (e.g. `| head`); keep downloading and drop further results
+            devnull = os.open(os.devnull, os.O_WRONLY)
+            os.dup2(devnull, self._file.fileno())
+            os.close(devnull)
+
+    def close(self):
+        if self._file is not sys.stdout:
+            self._file.close()
+
+
+async def read_items(stream: IO) -> AsyncIterator[str]:
+    """Yield input lines without blocking the event loop on a slow pipe"""
+    while True:
+        line = await asyncio.to_thread(stream.readline)
+        if not line:
+            return
+        line = line.strip()
+        if line and not line.startswith('#'):
+            yield line
+
+
+def check_item(item: str, has_token: bool, skip_validation: bool) -> Optional[str]:
+    """Reason the input line can't be downloaded, or None"""
+    if item.isdigit():
+        return None if has_token else "Bare video ids need ACCESS_TOKEN to look up the share URL"
+    if skip_validation:
+        return None if TikTokDownloader._is_url(item) else "Not an http(s) URL"
+    return None if is_valid_tiktok_url(item) else "Invalid TikTok URL format"
+
+
+async def _report_progress(stats: BatchStats, interval: float, interactive: bool):
+    while True:
+        await asyncio.sleep(interval)
+        if interactive:
+            sys.stderr.write('\r\033[K' + stats.line())
+        else:
+            sys.stderr.write(stats.line() + '\n')
+        sys.stderr.flush()
+
+
+def _token_provider(access_token: Optional[str]):
+    """Renewing token provider when REFRESH_TOKEN is set, as in deployment mode"""
+    refresh_token = os.environ.get('REFRESH_TOKEN')
+    if not access_token or not refresh_token:
+        return None
+    from auth import TikTokAuth
+    from token_store import TokenStore
+
+    token_store = TokenStore(TikTokAuth())
+    account_id = token_store.save({
+        'access_token': access_token,
+        'refresh_token': refresh_token,
+        'expires_in': 0
+    })
+    return token_store.provider(account_id)
+
+
+def invalid_result(item: str, problem: str) -> Dict:
+    return {'input': item, 'status': 'invalid', 'bytes': 0, 'duration': 0, 'retries': 0, 'error': problem}
+
+
+async def download_item(downloader: TikTokDownloader, item: str, stats: BatchStats, progress: BatchProgress) -> Dict:
+    """Download one input line and build its result record"""
+    stats.in_flight += 1
+    try:
+        trace = await downloader._download_single_video(item, progress)
+    finally:
+        stats.in_flight -= 1
+    result = {
+        'input': item,
+        'status': trace.status,
+        'bytes': trace.bytes,
+        'duration': round(trace.elapsed, 3),
+        'retries': trace.retries,
+        'error': trace.error
+    }
+    if trace.status in ('completed', 'skipped'):
+        result['file'] = downloader._job_filename(item)
+    if trace.checksum:
+        result[HASH_ALGORITHM] = trace.checksum
+    return result
+
+
+def rate_limit_delay(args: argparse.Namespace) -> float:
+    return 1 / args.rate if args.rate > 0 else 0
+
+
+class LocalExecutor:
+    """Runs every download on this process's event loop"""
+
+    def __init__(self, downloader: TikTokDownloader, concurrency: int, stats: BatchStats, results: ResultWriter):
+        self.downloader = downloader
+        self.concurrency = concurrency
+        self.stats = stats
+        self.results = results
+        self.progress = BatchProgress(stats)
+        # A small bounded queue keeps memory flat no matter how long the input is
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=concurrency * 2)
+        self.workers = []
+
+    async def _worker(self):
+        while True:
+            item = await self.queue.get()
+            if item is None:
+                return
+            result = await download_item(self.downloader, item, self.stats, self.progress)
+            self.stats.add(result)
+            self.results.write(result)
+
+    async def start(self):
+        await self.downloader.init_session()
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    async def submit(self, item: str, key: str):
+        await self.queue.put(item)
+
+    async def finish(self):
+        for _ in self.workers:
+            await self.queue.put(None)
+        await asyncio.gather(*self.workers)
+
+    async def close(self):
+        for task in self.workers:
+            task.cancel()
+        await self.downloader.cleanup()
+
+
+async def run_batch(args: argparse.Namespace) -> int:
+    try:
+        stream = sys.stdin if args.input == '-' else open(args.input)
+    except OSError as e:
+        logger.error("Cannot read input: %s", e)
+        return EXIT_USAGE
+
+    access_token = os.environ.get('ACCESS_TOKEN')
+    try:
+        token_provider = _token_provider(access_token)
+    except ValueError as e:
+        logger.error("Could not set up token refresh: %s", e)
+        return EXIT_AUTH
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    journal = Journal(args.journal or os.path.join(args.output_dir, '.journal.jsonl'), resume=args.resume)
+    journal.start()
+
+    # A deployment restart sends SIGTERM; unwind like Ctrl-C so the journal gets flushed
+    main_task = asyncio.current_task()
+    loop = asyncio.get_running_loop()
+    try:
+        loop.add_signal_handler(signal.SIGTERM, main_task.cancel)
+    except (NotImplementedError, RuntimeError):
+        pass
+
+    stats = BatchStats()
+    results = ResultWriter(args.results)
+    if args.processes > 1:
+        from batch_pool import ShardPool
+        executor = ShardPool(args, access_token, token_provider, journal, stats, results)
+    else:
+        downloader = TikTokDownloader(
+            access_token=access_token,
+            token_provider=token_provider,
+            output_dir=args.output_dir,
+            concurrent_downloads=args.concurrency,
+            rate_limit_delay=rate_limit_delay(args),
+            journal=journal,
+            resume_partial=args.resume,
+            variant_policy=VariantPolicy.parse(args.quality)
+        )
+        executor = LocalExecutor(downloader, args.concurrency, stats, results)
+    await executor.start()
+
+    reporter = None
+    if not args.quiet:
+        interactive = sys.stderr.isatty()
+        interval = args.progress_interval or (1.0 if interactive else 30.0)
+        reporter = asyncio.create_task(_report_progress(stats, interval, interactive))
+
+    try:
+        async for item in read_items(stream):
+            problem = check_item(item, bool(access_token), args.skip_validation)
+            if problem:
+                result = invalid_result(item, problem)
+                stats.add(result)
+                results.write(result)
+                continue
+            key = TikTokDownloader._job_key(item)
+            if not journal.is_done(key):
+                journal.record(key, 'queued', input=item)
+            await executor.submit(item, key)
+        await executor.finish()
+    finally:
+        await executor.close()
+        if reporter:
+            reporter.cancel()
+        await journal.close()
+        results.close()
+        if stream is not sys.stdin:
+            stream.close()
+
+    if not args.quiet:
+        sys.stderr.write(('\r\033[K' if sys.stderr.isatty() else '') + stats.line() + '\n')
+    if stats.done == 0:
+        logger.warning("No input lines to download")
+    return EXIT_OK if stats.failed == 0 and stats.invalid == 0 else EXIT_FAILED
+
+
+async def _run(args: argparse.Namespace) -> int:
+    try:
+        return await run_batch(args)
+    except asyncio.CancelledError:
+        # SIGTERM cancels the run once the journal is flushed
+        sys.stderr.write("\nTerminated, rerun with --resume to continue\n")
+        return EXIT_INTERRUPTED
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='main.py batch',
+        description="Download TikTok videos listed in a file or on stdin without interaction.",
+        epilog="Exit codes: 0 all downloaded, 1 some failed or were invalid, 2 usage error, "
+               "3 token setup failed, 130 interrupted. ACCESS_TOKEN (and optionally REFRESH_TOKEN) "
+               "are read from the environment; they are only needed for bare video ids.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--input', '-i', default='-', help="file with one URL or video id per line, - for stdin")
+    parser.add_argument('--results', '-r', default='-', help="JSON-lines results file (appended), - for stdout")
+    parser.add_argument('--output-dir', '-o', default='downloads', help="directory the videos are saved to")
+    parser.add_argument('--concurrency', '-c', type=int, default=4, help="simultaneous downloads per process")
+    parser.add_argument('--processes', '-p', type=int, default=1,
+                        help="worker processes; input is sharded across them by video id")
+    parser.add_argument('--rate', type=float, default=0.4,
+                        help="max page requests per second to TikTok across all processes, 0 for no limit")
+    parser.add_argument('--progress-interval', type=float, default=None,
+                        help="seconds between progress lines (default 1 on a terminal, 30 otherwise)")
+    parser.add_argument('--quiet', '-q', action='store_true', help="no progress output")
+    parser.add_argument('--journal', default=None,
+                        help="job-state journal (default OUTPUT_DIR/.journal.jsonl)")
+    parser.add_argument('--resume', action='store_true',
+                        help="replay the journal: skip finished jobs and continue partial files")
+    parser.add_argument('--quality', default=os.getenv('VIDEO_QUALITY', 'max'),
+                        help="variant to fetch when a page lists several: max, bitrate:800k (cheapest at or above) "
+                             "or size:25M (best that fits)")
+    parser.add_argument('--skip-validation', action='store_true',
+                        help="accept any http(s) URL, e.g. pages served by benchmarks/mock_upstream.py")
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    if args.processes < 1:
+        parser.error("--processes must be at least 1")
+    try:
+        VariantPolicy.parse(args.quality)
+    except ValueError as e:
+        parser.error(f"--quality: {e}")
+    try:
+        return asyncio.run(_run(args))
+    except KeyboardInterrupt:
+        sys.stderr.write("\nInterrupted, rerun with --resume to continue\n")
+        return EXIT_INTERRUPTED
@@ -0,0 +1,290 @@
+"""
+Multi-process execution for `main.py batch --processes N`.
+
+The parent streams the input and shards it by a hash of each job's key: the video id
+for bare ids and full URLs, so a given video always lands on the same shard. Short
+links (vm./vt.tiktok.com) are keyed by their link code, which isn't resolved to a
+video id before sharding, so they may land on a different shard than the same video
+given by id. Each shard is a spawned process running
+its own event loop and TikTokDownloader. Page requests draw from one rate budget
+kept in shared memory, and results and journal records flow back over a queue to
+the parent, which owns the single results file and journal. With REFRESH_TOKEN set
+the parent also owns token refresh, and shards ask it for access tokens.
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import queue
+import signal
+import time
+import zlib
+from collections import Counter
+from typing import Dict, List, Optional, Set, Tuple
+
+from batch import BatchProgress, BatchStats, ResultWriter, download_item, rate_limit_delay
+from downloader import RateLimiter, TikTokDownloader
+from journal import Journal
+from log import get_logger
+from variants import VariantPolicy
+
+logger = get_logger('batch_pool')
+
+TOKEN_REUSE = 60    # Seconds a shard reuses a token from the parent, which renews them well before expiry
+
+
+def shard_for(key: str, shards: int) -> int:
+    # crc32 rather than hash(): str hashes are salted per process
+    return zlib.crc32(key.encode()) % shards
+
+
+class SharedRateLimiter(RateLimiter):
+    """RateLimiter whose last slot lives in shared memory, so every shard draws from one budget"""
+
+    def __init__(self, context):
+        self._last = context.Value('d', 0.0)
+
+    @property
+    def last_request_time(self) -> float:
+        return self._last.value
+
+    @last_request_time.setter
+    def last_request_time(self, value: float):
+        self._last.value = value
+
+    def claim(self, now: float, delay: float) -> float:
+        with self._last.get_lock():
+            return super().claim(now, delay)
+
+
+class _ForwardingJournal:
+    """Journal stand-in for shard processes; records are applied by the parent's Journal"""
+
+    def __init__(self, outbox):
+        self.outbox = outbox
+
+    def record(self, key: str, state: str, **fields):
+        self.outbox.put(('journal', key, (state, fields)))
+
+    def is_done(self, key: str) -> bool:
+        # The parent already skipped finished jobs before dispatching
+        return False
+
+
+class _ParentTokens:
+    """
+    Token provider for shard processes. Only the parent refreshes, with its TokenStore, so
+    a refresh token that TikTok rotates is spent once rather than by every shard at once.
+    """
+
+    def __init__(self, shard: int, access_token: str, outbox, replies):
+        self.shard = shard
+        self.access_token = access_token
+        self.outbox = outbox
+        self.replies = replies
+        self.fetched_at = None      # The token from the environment may already have expired
+        self._lock = asyncio.Lock()
+
+    async def __call__(self, force_refresh: bool = False) -> Optional[str]:
+        stale = self.access_token
+        async with self._lock:
+            if self.access_token != stale:
+                # Another download already fetched a newer token while this one waited
+                return self.access_token
+            if not force_refresh and self.fetched_at is not None and time.monotonic() - self.fetched_at < TOKEN_REUSE:
+                return self.access_token
+            self.outbox.put(('token', self.shard, stale if force_refresh else None))
+            self.access_token = await asyncio.to_thread(self.replies.get)
+            self.fetched_at = time.monotonic()
+            return self.access_token
+
+
+async def _run_shard(shard: int, options: Dict, inbox, outbox, limiter: SharedRateLimiter, token_replies):
+    access_token = options['access_token']
+    downloader = TikTokDownloader(
+        access_token=access_token,
+        token_provider=_ParentTokens(shard, access_token, outbox, token_replies) if token_replies else None,
+        output_dir=options['output_dir'],
+        concurrent_downloads=options['concurrency'],
+        rate_limit_delay=options['rate_limit_delay'],
+        journal=_ForwardingJournal(outbox),
+        resume_partial=options['resume'],
+        rate_limiter=limiter,
+        variant_policy=VariantPolicy.parse(options['quality'])
+    )
+    await downloader.init_session()
+    stats = BatchStats()
+    progress = BatchProgress(stats)
+    pending: asyncio.Queue = asyncio.Queue(maxsize=options['concurrency'])
+
+    async def worker():
+        while True:
+            item = await pending.get()
+            if item is None:
+                return
+            outbox.put(('result', await download_item(downloader, item, stats, progress), None))
+
+    workers = [asyncio.create_task(worker()) for _ in range(options['concurrency'])]
+    try:
+        while True:
+            item = await asyncio.to_thread(inbox.get)
+            if item is None:
+                break
+            await pending.put(item)
+        for _ in workers:
+            await pending.put(None)
+        await asyncio.gather(*workers)
+    finally:
+        await downloader.cleanup()
+        outbox.put(('exit', shard, None))
+
+
+def _shard_main(shard: int, options: Dict, inbox, outbox, limiter: SharedRateLimiter, token_replies):
+    # Ctrl-C reaches the whole process group; the parent decides how shards shut down
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_run_shard(shard, options, inbox, outbox, limiter, token_replies))
+
+
+class ShardPool:
+    """Batch executor that fans jobs out to worker processes, see LocalExecutor in batch.py"""
+
+    def __init__(self, args: argparse.Namespace, access_token, token_provider, journal: Journal,
+                 stats: BatchStats, results: ResultWriter):
+        self.access_token = access_token     # Latest token handed to the shards
+        self.token_provider = token_provider
+        self.token_tasks: Set[asyncio.Task] = set()
+        self.journal = journal
+        self.stats = stats
+        self.results = results
+        self.output_dir = args.output_dir
+        self.shards = args.processes
+
+        # spawn, not fork: the parent already has a running event loop and threads
+        context = multiprocessing.get_context('spawn')
+        self.limiter = SharedRateLimiter(context)
+        self.outbox = context.Queue()
+        self.inboxes = [context.Queue(maxsize=args.concurrency * 2) for _ in range(self.shards)]
+        # Items sent to each shard that have no result yet, reported as failed if the shard dies
+        self.dispatched: List[Counter] = [Counter() for _ in range(self.shards)]
+        self.token_replies = [context.Queue() if token_provider else None for _ in range(self.shards)]
+        options = {
+            'access_token': access_token,
+            'output_dir': args.output_dir,
+            'concurrency': args.concurrency,
+            'rate_limit_delay': rate_limit_delay(args),
+            'resume': args.resume,
+            'quality': args.quality
+        }
+        self.processes = [
+            context.Process(target=_shard_main,
+                            args=(shard, options, inbox, self.outbox, self.limiter, self.token_replies[shard]),
+                            name=f"batch-shard-{shard}", daemon=True)
+            for shard, inbox in enumerate(self.inboxes)
+        ]
+        self.running = 0
+        self.drainer = None
+
+    async def start(self):
+        for process in self.processes:
+            process.start()
+        self.running = len(self.processes)
+        self.drainer = asyncio.create_task(self._drain())
+
+    def _put(self, shard: int, item):
+        """Blocking put that gives up if the shard process has died"""
+        while True:
+            try:
+                self.inboxes[shard].put(item, timeout=1)
+                return
+            except queue.Full:
+                if not self.processes[shard].is_alive():
+                    raise RuntimeError(f"Shard {shard} exited with code {self.processes[shard].exitcode}")
+
+    async def submit(self, item: str, key: str):
+        filename = os.path.join(self.output_dir, f"tiktok_{key}.mp4")
+        if self.journal.is_done(key) and os.path.exists(filename):
+            result = {'input': item, 'status': 'skipped', 'bytes': 0, 'duration': 0, 'retries': 0,
+                      'error': None, 'file': filename}
+            self.stats.add(result)
+            self.results.write(result)
+            return
+        shard = shard_for(key, self.shards)
+        self.stats.in_flight += 1
+        self.dispatched[shard][item] += 1
+        await asyncio.to_thread(self._put, shard, item)
+
+    def _handle(self, message: Tuple):
+        kind, payload, extra = message
+        if kind == 'result':
+            dispatched = self.dispatched[shard_for(TikTokDownloader._job_key(payload['input']), self.shards)]
+            dispatched[payload['input']] -= 1
+            if dispatched[payload['input']] <= 0:
+                del dispatched[payload['input']]
+            self.stats.in_flight -= 1
+            self.stats.bytes += payload['bytes']
+            self.stats.add(payload)
+            self.results.write(payload)
+        elif kind == 'journal':
+            state, fields = extra
+            self.journal.record(payload, state, **fields)
+        elif kind == 'token':
+            task = asyncio.create_task(self._send_token(payload, extra))
+            self.token_tasks.add(task)
+            task.add_done_callback(self.token_tasks.discard)
+        elif kind == 'exit':
+            self.running -= 1
+
+    async def _send_token(self, shard: int, stale: Optional[str]):
+        """
+        Reply to a shard's token request. A shard that got a 401 sends the token it used, which
+        forces a refresh only if no other shard's request has replaced that token already;
+        the TokenStore joins refreshes that are already in flight.
+        """
+        try:
+            token = await self.token_provider(force_refresh=stale is not None and stale == self.access_token)
+            if token:
+                self.access_token = token
+        except Exception as e:
+            logger.error("Could not get an access token for shard %d: %s", shard, e)
+        finally:
+            self.token_replies[shard].put(self.access_token)
+
+    async def _drain(self):
+        while self.running > 0:
+            try:
+                message = await asyncio.to_thread(self.outbox.get, True, 0.5)
+            except queue.Empty:
+                if not any(process.is_alive() for process in self.processes):
+                    break
+                continue
+            self._handle(message)
+
+    async def finish(self):
+        for shard in range(self.shards):
+            await asyncio.to_thread(self._put, shard, None)
+        await self.drainer
+        if self.stats.in_flight:
+            logger.error("%d jobs were lost with a crashed shard process", self.stats.in_flight)
+        # Every input line still gets a result line and a journal record
+        for shard, dispatched in enumerate(self.dispatched):
+            error = f"Shard {shard} exited with code {self.processes[shard].exitcode} before finishing"
+            for item, count in dispatched.items():
+                for _ in range(count):
+                    result = {'input': item, 'status': 'failed', 'bytes': 0, 'duration': 0, 'retries': 0,
+                              'error': error}
+                    self.stats.add(result)
+                    self.results.write(result)
+                self.journal.record(TikTokDownloader._job_key(item), 'failed', error=error)
+            dispatched.clear()
+        self.stats.in_flight = 0
+
+    async def close(self):
+        if self.drainer and not self.drainer.done():
+            self.drainer.cancel()
+        for task in list(self.token_tasks):
+            task.cancel()
+        for process in self.processes:
+            if process.is_alive():
+                process.terminate()
+        for process in self.processes:
+            await asyncio.to_thread(process.join, 5)
@@ -0,0 +1,195 @@
+"""
+Download-engine benchmark against the local mock upstream.
+
+    python -m benchmarks.download_engine --videos 40 --concurrency 1,2,4,8 --bandwidth 5000000
+
+Starts benchmarks/mock_upstream.py in its own process, then runs TikTokDownloader once
+per concurrency setting, each in a fresh process so peak RSS is measured per run.
+Reports videos/s, MB/s, p50/p99 job latency from the job traces and peak RSS.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.mock_upstream import MockSettings, page_url, video_id
+from downloader import TikTokDownloader
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Nearest-rank percentile, 0 for an empty list"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[rank]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class _NullProgress:
+    """Stands in for rich's Progress so rendering doesn't skew the numbers"""
+
+    def add_task(self, description, **kwargs):
+        return 0
+
+    def update(self, task_id, **kwargs):
+        pass
+
+
+def start_mock(mock_args: List[str]) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'benchmarks.mock_upstream', *mock_args],
+        cwd=ROOT, stdout=subprocess.PIPE, text=True
+    )
+    line = process.stdout.readline()
+    if not line:
+        process.kill()
+        raise RuntimeError("Mock upstream failed to start")
+    process.base_url = line.rsplit(' ', 1)[-1].strip()
+    return process
+
+
+async def run_downloads(base_url: str, videos: int, concurrency: int, mode: str,
+                        rate_limit_delay: float) -> Dict:
+    if mode == 'id':
+        items = [video_id(index) for index in range(videos)]
+    else:
+        items = [page_url(base_url, video_id(index)) for index in range(videos)]
+
+    downloader = TikTokDownloader(access_token='bench-token', concurrent_downloads=concurrency,
+                                  rate_limit_delay=rate_limit_delay)
+    downloader.api_base_url = f"{base_url}/v2"
+    await downloader.init_session()
+    os.makedirs('downloads', exist_ok=True)
+
+    progress = _NullProgress()
+    started = time.monotonic()
+    try:
+        traces = await asyncio.gather(*(downloader._download_single_video(item, progress) for item in items))
+    finally:
+        await downloader.cleanup()
+    wall = time.monotonic() - started
+
+    completed = [trace for trace in traces if trace.status == 'completed']
+    latencies = [trace.elapsed for trace in completed]
+    total_bytes = sum(trace.bytes for trace in completed)
+    phases: Dict[str, float] = {}
+    for trace in completed:
+        for name, seconds in trace.phases.items():
+            phases[name] = phases.get(name, 0.0) + seconds
+
+    return {
+        'concurrency': concurrency,
+        'videos': len(items),
+        'completed': len(completed),
+        'failed': len(items) - len(completed),
+        'retries': sum(trace.retries for trace in traces),
+        'wall_seconds': round(wall, 3),
+        'videos_per_second': round(len(completed) / wall, 3) if wall else 0,
+        'mb_per_second': round(total_bytes / wall / 1e6, 3) if wall else 0,
+        'p50_seconds': round(percentile(latencies, 50), 4),
+        'p99_seconds': round(percentile(latencies, 99), 4),
+        'mean_phase_seconds': {name: round(total / len(completed), 4) for name, total in sorted(phases.items())} if completed else {},
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+
+
+def run_worker(args: argparse.Namespace):
+    """One measurement in this process; prints a single JSON line"""
+    workdir = tempfile.mkdtemp(prefix='tiktok-bench-')
+    os.chdir(workdir)
+    try:
+        result = asyncio.run(run_downloads(args.mock_url, args.videos, args.concurrency[0],
+                                           args.mode, args.rate_limit_delay))
+    finally:
+        os.chdir(ROOT)
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(result), flush=True)
+
+
+def run_suite(args: argparse.Namespace, mock_args: List[str]) -> List[Dict]:
+    mock: Optional[subprocess.Popen] = None
+    base_url = args.mock_url
+    if not base_url:
+        mock = start_mock(mock_args)
+        base_url = mock.base_url
+
+    env = dict(os.environ, LOG_FORMAT='json', LOG_LEVEL=os.getenv('LOG_LEVEL', 'ERROR'))
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            command = [
+                sys.executable, '-m', 'benchmarks.download_engine', '--worker',
+                '--mock-url', base_url, '--videos', str(args.videos), '--concurrency', str(concurrency),
+                '--mode', args.mode, '--rate-limit-delay', str(args.rate_limit_delay)
+            ]
+            output = subprocess.run(command, cwd=ROOT, env=env, stdout=subprocess.PIPE, text=True, check=True).stdout
+            results.append(json.loads(output.strip().splitlines()[-1]))
+    finally:
+        if mock is not None:
+            mock.terminate()
+            mock.wait()
+    return results
+
+
+def print_table(results: List[Dict]):
+    header = f"{'conc':>5} {'ok':>5} {'fail':>5} {'retry':>6} {'videos/s':>9} {'MB/s':>8} {'p50 s':>8} {'p99 s':>8} {'RSS MB':>8}"
+    print(header)
+    print('-' * len(header))
+    for r in results:
+        print(f"{r['concurrency']:>5} {r['completed']:>5} {r['failed']:>5} {r['retries']:>6} "
+              f"{r['videos_per_second']:>9.2f} {r['mb_per_second']:>8.2f} {r['p50_seconds']:>8.3f} "
+              f"{r['p99_seconds']:>8.3f} {r['peak_rss_mb']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark TikTokDownloader against the mock upstream")
+    parser.add_argument('--concurrency', default='1,2,4,8',
+                        type=lambda value: [int(part) for part in value.split(',') if part],
+                        help='comma-separated concurrency settings')
+    parser.add_argument('--mode', choices=('page', 'id'), default='page',
+                        help='queue page URLs, or bare ids that need a video/query lookup')
+    parser.add_argument('--rate-limit-delay', type=float, default=0.0,
+                        help="downloader's minimum spacing between page requests")
+    parser.add_argument('--mock-url', help='use an already running mock instead of starting one')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    MockSettings.add_arguments(parser)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    # Everything except the benchmark's own flags is passed through to the mock
+    defaults = MockSettings()
+    mock_args = []
+    for name in vars(defaults):
+        value = getattr(args, name)
+        if value is not None and value != getattr(defaults, name):
+            flag = f"--{name.replace('_', '-')}"
+            mock_args += [flag] if value is True else [flag, str(value)]
+
+    results = run_suite(args, mock_args)
+    print_table(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'mock': mock_args, 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
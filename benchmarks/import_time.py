@@ -0,0 +1,81 @@
+"""
+Cold-start benchmark: time to import server.py and build the app.
+
+    python -m benchmarks.import_time --runs 5
+    python -m benchmarks.import_time --budget-ms 400
+
+Runs `import server; server.create_app()` in fresh interpreters under -X importtime and
+reports the median wall time and the modules with the largest cumulative import time.
+Exits non-zero when the median exceeds --budget-ms, or when a module that should only be
+imported once serving starts (aiohttp, rich, the downloader, the auth client) is pulled
+in eagerly again.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+from benchmarks.download_engine import ROOT
+
+PROBE = (
+    "import time; started = time.perf_counter(); "
+    "import server; server.create_app(); "
+    "print((time.perf_counter() - started) * 1000)"
+)
+# Imported when serving starts or on first use, never by importing the server
+DEFERRED = ('aiohttp', 'rich', 'downloader', 'auth', 'token_store', 'cover_cache', 'resilience')
+
+
+def run_once() -> Tuple[float, Dict[str, Tuple[int, int]]]:
+    """One cold start: (wall ms, {module: (self us, cumulative us)})"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1')
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE],
+        cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules[name.strip()] = (int(own), int(cumulative))
+    return float(result.stdout.strip().splitlines()[-1]), modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure server import and app-construction time")
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters to start')
+    parser.add_argument('--top', type=int, default=15, help='slowest modules to list')
+    parser.add_argument('--budget-ms', type=float, help='fail when the median exceeds this')
+    args = parser.parse_args()
+
+    walls: List[float] = []
+    cumulative: Dict[str, List[int]] = {}
+    for _ in range(args.runs):
+        wall, modules = run_once()
+        walls.append(wall)
+        for name, (_, total) in modules.items():
+            cumulative.setdefault(name, []).append(total)
+
+    median = statistics.median(walls)
+    print(f"import server + create_app(): median {median:.1f} ms, min {min(walls):.1f} ms over {args.runs} runs")
+    print(f"{'module':<40}{'cumulative ms':>14}")
+    slowest = sorted(cumulative.items(), key=lambda item: statistics.median(item[1]), reverse=True)
+    for name, totals in slowest[:args.top]:
+        print(f"{name:<40}{statistics.median(totals) / 1000:>14.1f}")
+
+    failed = False
+    eager = [name for name in DEFERRED if name in cumulative]
+    if eager:
+        print(f"FAIL: imported eagerly: {', '.join(eager)}")
+        failed = True
+    if args.budget_ms is not None and median > args.budget_ms:
+        print(f"FAIL: median {median:.1f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,382 @@
+"""
+Local stand-in for the TikTok endpoints the app talks to, for offline benchmarks.
+
+    python -m benchmarks.mock_upstream --port 8081 --latency 0.05 --bandwidth 2000000
+
+Serves video/list paging, video/query, the oauth token endpoints, video pages with
+embedded playAddr/downloadAddr and a bitrateInfo list of 540p/720p/1080p encodes,
+short-link redirects, covers and a range-capable MP4 CDN. Point the app at it with TIKTOK_API_BASE_URL=<url>/v2 and
+TIKTOK_OAUTH_BASE_URL=<url>/oauth; page and CDN URLs are absolute mock URLs.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import re
+import time
+from typing import Optional, Tuple
+
+from aiohttp import web
+
+VIDEO_ID_BASE = 7300000000000000000
+TAGS = ('dance', 'cooking', 'travel', 'music', 'comedy', 'pets', 'fitness', 'diy', 'fashion', 'gaming')
+CHUNK_SIZE = 64 * 1024
+DURATION = 15  # seconds, nominal length of every mock video
+# bitrateInfo encodes: (name, width, height, share of --video-size); playAddr/downloadAddr are full size
+VARIANTS = (('540p', 576, 1024, 0.25), ('720p', 720, 1280, 0.5), ('1080p', 1080, 1920, 1.0))
+
+
+class MockSettings:
+    """
+    Knobs for the mock upstream. Rates are probabilities per request, `latency` and
+    `jitter` are seconds added before every response, `bandwidth` caps each CDN
+    transfer in bytes per second (0 = unlimited).
+    """
+
+    def __init__(self, videos: int = 200, page_size: int = 20, video_size: int = 1_000_000,
+                 latency: float = 0.0, jitter: float = 0.0, bandwidth: int = 0,
+                 rate_limit: float = 0.0, retry_after: int = 1, error_rate: float = 0.0,
+                 truncate_rate: float = 0.0, url_ttl: int = 3600, seed: Optional[int] = None,
+                 chunked: bool = False):
+        self.videos = videos
+        self.page_size = page_size
+        self.video_size = video_size
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.error_rate = error_rate
+        self.truncate_rate = truncate_rate
+        self.url_ttl = url_ttl
+        self.seed = seed
+        self.chunked = chunked
+
+    @classmethod
+    def add_arguments(cls, parser: argparse.ArgumentParser):
+        defaults = cls()
+        parser.add_argument('--videos', type=int, default=defaults.videos, help='videos in the mock account')
+        parser.add_argument('--page-size', type=int, default=defaults.page_size, help='max videos per video/list page')
+        parser.add_argument('--video-size', type=int, default=defaults.video_size, help='bytes per MP4')
+        parser.add_argument('--latency', type=float, default=defaults.latency, help='seconds added to every response')
+        parser.add_argument('--jitter', type=float, default=defaults.jitter, help='random extra latency, up to this many seconds')
+        parser.add_argument('--bandwidth', type=int, default=defaults.bandwidth, help='bytes/s per CDN transfer, 0 for unlimited')
+        parser.add_argument('--rate-limit', type=float, default=defaults.rate_limit, help='fraction of requests answered with 429')
+        parser.add_argument('--retry-after', type=int, default=defaults.retry_after, help='Retry-After seconds sent with 429s')
+        parser.add_argument('--error-rate', type=float, default=defaults.error_rate, help='fraction of requests answered with 503')
+        parser.add_argument('--truncate-rate', type=float, default=defaults.truncate_rate, help='fraction of CDN transfers cut off halfway')
+        parser.add_argument('--url-ttl', type=int, default=defaults.url_ttl, help='seconds until signed CDN URLs expire')
+        parser.add_argument('--seed', type=int, default=None, help='seed for the fault injection RNG')
+        parser.add_argument('--chunked', action='store_true', help='send CDN bodies chunked, without Content-Length')
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "MockSettings":
+        return cls(args.videos, args.page_size, args.video_size, args.latency, args.jitter, args.bandwidth,
+                   args.rate_limit, args.retry_after, args.error_rate, args.truncate_rate, args.url_ttl, args.seed,
+                   args.chunked)
+
+
+SETTINGS = web.AppKey('settings', MockSettings)
+PAYLOAD = web.AppKey('payload', bytes)
+RNG = web.AppKey('rng', random.Random)
+
+
+def video_id(index: int) -> str:
+    return str(VIDEO_ID_BASE + index)
+
+
+def _index(vid: str) -> Optional[int]:
+    if not vid.isdigit():
+        return None
+    index = int(vid) - VIDEO_ID_BASE
+    return index if 0 <= index else None
+
+
+def _base_url(request: web.Request) -> str:
+    return f"{request.scheme}://{request.host}"
+
+
+def page_url(base_url: str, vid: str) -> str:
+    return f"{base_url}/@mock_user/video/{vid}"
+
+
+def _payload(size: int, seed: int = 0) -> bytes:
+    """Deterministic MP4-looking bytes: an ftyp box followed by repeated noise"""
+    header = b'\x00\x00\x00\x20ftypisom\x00\x00\x02\x00isomiso2avc1mp41'
+    block = random.Random(seed).randbytes(CHUNK_SIZE)
+    repeats = size // len(block) + 1
+    return (header + block * repeats)[:size]
+
+
+def _video(base_url: str, index: int) -> dict:
+    vid = video_id(index)
+    tags = [TAGS[index % len(TAGS)], TAGS[(index * 7 + 3) % len(TAGS)]]
+    return {
+        'id': vid,
+        'title': f"Mock video {index} " + ' '.join(f"#{tag}" for tag in tags),
+        'cover_url': f"{base_url}/cover/{vid}.jpg",
+        'share_url': page_url(base_url, vid),
+        'create_time': 1_700_000_000 - index * 3600,
+        'statistics': {
+            'like_count': (index * 7919) % 100_000,
+            'view_count': (index * 104_729) % 5_000_000,
+            'share_count': (index * 31) % 5_000
+        },
+        'hashtags': [{'name': tag} for tag in tags]
+    }
+
+
+def _signed_cdn_url(base_url: str, kind: str, vid: str, ttl: int) -> str:
+    expire = int(time.time()) + ttl
+    signature = hashlib.sha256(f"{vid}:{expire}".encode()).hexdigest()[:16]
+    return f"{base_url}/cdn/{kind}/{vid}.mp4?expire={expire}&signature={signature}"
+
+
+@web.middleware
+async def inject_faults(request: web.Request, handler):
+    """Latency, 429s and 503s applied uniformly to every endpoint"""
+    settings = request.app[SETTINGS]
+    rng = request.app[RNG]
+    delay = settings.latency + (rng.uniform(0, settings.jitter) if settings.jitter else 0)
+    if delay:
+        await asyncio.sleep(delay)
+    roll = rng.random()
+    if roll < settings.rate_limit:
+        return web.json_response({'error': 'rate_limit_exceeded'}, status=429,
+                                 headers={'Retry-After': str(settings.retry_after)})
+    if roll < settings.rate_limit + settings.error_rate:
+        return web.json_response({'error': 'service_unavailable'}, status=503)
+    return await handler(request)
+
+
+def _require_token(request: web.Request) -> Optional[web.Response]:
+    if not request.headers.get('Authorization', '').startswith('Bearer '):
+        return web.json_response({'error': 'access_token_invalid'}, status=401)
+    return None
+
+
+async def video_list(request: web.Request) -> web.Response:
+    denied = _require_token(request)
+    if denied:
+        return denied
+    settings = request.app[SETTINGS]
+    params = dict(request.query)
+    if request.method == 'POST' and request.can_read_body:
+        params.update(await request.json())
+    cursor = max(0, int(params.get('cursor', 0)))
+    count = max(1, min(settings.page_size, int(params.get('max_count', settings.page_size))))
+
+    base_url = _base_url(request)
+    end = min(settings.videos, cursor + count)
+    return web.json_response({
+        'videos': [_video(base_url, index) for index in range(cursor, end)],
+        'cursor': end,
+        'has_more': end < settings.videos
+    })
+
+
+async def video_query(request: web.Request) -> web.Response:
+    denied = _require_token(request)
+    if denied:
+        return denied
+    body = await request.json() if request.can_read_body else {}
+    ids = body.get('filters', {}).get('video_ids', [])
+    base_url = _base_url(request)
+    videos = [{'id': vid, 'share_url': page_url(base_url, vid)}
+              for vid in ids if _index(vid) is not None and _index(vid) < request.app[SETTINGS].videos]
+    return web.json_response({'data': {'videos': videos}, 'error': {'code': 'ok'}})
+
+
+async def oauth_token(request: web.Request) -> web.Response:
+    form = await request.post()
+    if not form.get('code') and not form.get('refresh_token'):
+        return web.json_response({'data': {'error_code': 10007, 'description': 'missing code'}}, status=400)
+    stamp = int(time.time() * 1000)
+    return web.json_response({'data': {
+        'open_id': 'mock_user',
+        'access_token': f"act.mock.{stamp}",
+        'refresh_token': f"rft.mock.{stamp}",
+        'expires_in': 86400,
+        'refresh_expires_in': 31536000,
+        'scope': 'user.info.basic,video.list'
+    }})
+
+
+async def video_page(request: web.Request) -> web.Response:
+    vid = request.match_info['video_id']
+    index = _index(vid)
+    if index is None or index >= request.app[SETTINGS].videos:
+        return web.Response(status=404, text='Video not found')
+
+    base_url = _base_url(request)
+    ttl = request.app[SETTINGS].url_ttl
+    video_size = request.app[SETTINGS].video_size
+    bitrate_info = []
+    for name, width, height, share in VARIANTS:
+        size = int(video_size * share)
+        bitrate_info.append({
+            'GearName': f"normal_{name}_0",
+            'Bitrate': size * 8 // DURATION,
+            'CodecType': 'h264',
+            'PlayAddr': {
+                'UrlList': [_signed_cdn_url(base_url, name, vid, ttl)],
+                'DataSize': size,
+                'Width': width,
+                'Height': height
+            }
+        })
+    state = {'ItemModule': {vid: {'id': vid, 'video': {
+        'playAddr': _signed_cdn_url(base_url, 'play', vid, ttl),
+        'downloadAddr': _signed_cdn_url(base_url, 'download', vid, ttl),
+        'duration': DURATION,
+        'bitrateInfo': bitrate_info
+    }}}}
+    # Escape slashes the way TikTok's inline JSON does
+    script = json.dumps(state, separators=(',', ':')).replace('/', '\\u002F')
+    html = (
+        '<!DOCTYPE html><html><head><title>Mock TikTok</title></head><body>'
+        f'<script id="SIGI_STATE" type="application/json">{script}</script>'
+        '</body></html>'
+    )
+    return web.Response(text=html, content_type='text/html')
+
+
+async def short_link(request: web.Request) -> web.Response:
+    code = request.match_info['code']
+    raise web.HTTPFound(page_url(_base_url(request), code))
+
+
+async def cover(request: web.Request) -> web.Response:
+    vid = request.match_info['video_id']
+    etag = f'"{hashlib.md5(vid.encode()).hexdigest()}"'
+    headers = {'ETag': etag, 'Last-Modified': 'Tue, 14 Nov 2023 22:13:20 GMT', 'Cache-Control': 'max-age=3600'}
+    if request.headers.get('If-None-Match') == etag:
+        return web.Response(status=304, headers=headers)
+    body = b'\xff\xd8\xff\xe0' + hashlib.sha256(vid.encode()).digest() * 64 + b'\xff\xd9'
+    return web.Response(body=body, content_type='image/jpeg', headers=headers)
+
+
+def _parse_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Single `bytes=a-b` / `bytes=a-` / `bytes=-n` range, None for the whole body"""
+    match = re.fullmatch(r'bytes=(\d*)-(\d*)', (header or '').strip())
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    first, last = match.groups()
+    if first == '':
+        start, end = max(0, size - int(last)), size - 1
+    else:
+        start = int(first)
+        end = min(size - 1, int(last)) if last else size - 1
+    if start > end:
+        raise web.HTTPRequestRangeNotSatisfiable(headers={'Content-Range': f"bytes */{size}"})
+    return start, end
+
+
+async def cdn(request: web.Request) -> web.StreamResponse:
+    settings = request.app[SETTINGS]
+    vid = request.match_info['video_id']
+    index = _index(vid)
+    if index is None or index >= settings.videos:
+        raise web.HTTPNotFound()
+    if int(request.query.get('expire', 0)) < time.time():
+        raise web.HTTPForbidden(text='URL expired')
+
+    body = request.app[PAYLOAD]
+    kind = request.match_info['kind']
+    share = {name: share for name, _, _, share in VARIANTS}.get(kind, 1.0)
+    size = int(len(body) * share)
+    byte_range = _parse_range(request.headers.get('Range'), size)
+    start, end = byte_range or (0, size - 1)
+    headers = {
+        'Content-Type': 'video/mp4',
+        'Accept-Ranges': 'bytes',
+        'Content-Length': str(end - start + 1),
+        'ETag': f'"{vid}-{kind}-{size}"'
+    }
+    if byte_range:
+        headers['Content-Range'] = f"bytes {start}-{end}/{size}"
+    if settings.chunked:
+        del headers['Content-Length']
+    response = web.StreamResponse(status=206 if byte_range else 200, headers=headers)
+    await response.prepare(request)
+    if request.method == 'HEAD':
+        return response
+
+    # Cut the connection halfway through to simulate a dropped transfer
+    cutoff = end + 1
+    if settings.truncate_rate and request.app[RNG].random() < settings.truncate_rate:
+        cutoff = start + (end - start + 1) // 2
+
+    view = memoryview(body)
+    started = time.monotonic()
+    sent = 0
+    position = start
+    while position < cutoff:
+        chunk = view[position:min(cutoff, position + CHUNK_SIZE)]
+        await response.write(chunk)
+        position += len(chunk)
+        sent += len(chunk)
+        if settings.bandwidth:
+            ahead = sent / settings.bandwidth - (time.monotonic() - started)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+
+    if cutoff <= end:
+        request.transport.close()
+        return response
+    await response.write_eof()
+    return response
+
+
+def create_app(settings: Optional[MockSettings] = None) -> web.Application:
+    settings = settings or MockSettings()
+    app = web.Application(middlewares=[inject_faults])
+    app[SETTINGS] = settings
+    app[PAYLOAD] = _payload(settings.video_size)
+    app[RNG] = random.Random(settings.seed)
+    app.router.add_route('*', '/v2/video/list/', video_list)
+    app.router.add_post('/v2/video/query/', video_query)
+    app.router.add_post('/oauth/access_token/', oauth_token)
+    app.router.add_post('/oauth/refresh_token/', oauth_token)
+    app.router.add_get('/@{user}/video/{video_id}', video_page)
+    app.router.add_get('/t/{code}', short_link)
+    app.router.add_get('/cover/{video_id}.jpg', cover)
+    app.router.add_get('/cdn/{kind}/{video_id}.mp4', cdn)
+    return app
+
+
+async def start(settings: Optional[MockSettings] = None, host: str = '127.0.0.1', port: int = 0) -> Tuple[web.AppRunner, str]:
+    """Serve the mock on the running loop, returning the runner and its base URL"""
+    runner = web.AppRunner(create_app(settings), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_host, bound_port = runner.addresses[0][:2]
+    return runner, f"http://{bound_host}:{bound_port}"
+
+
+async def _serve(settings: MockSettings, host: str, port: int):
+    runner, base_url = await start(settings, host, port)
+    # The first stdout line is parsed by the benchmark scripts
+    print(f"Mock TikTok upstream listening on {base_url}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='0 picks a free port')
+    MockSettings.add_arguments(parser)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(MockSettings.from_args(args), args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+"""
+Video-metadata benchmark: memory and /videos encode time for a cached library.
+
+    python -m benchmarks.video_records --videos 50000
+
+Builds the library from mock upstream list items twice, once as the nested dicts
+get_user_videos used to return (create time formatted up front, encoded with the
+stdlib like jsonify) and once as VideoRecords encoded by fast_json, and reports
+decode time, retained memory and the time to encode pages of 30.
+"""
+import argparse
+import gc
+import json
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import fast_json
+from benchmarks.mock_upstream import _video
+from video_record import VideoRecord
+
+PAGE_SIZE = 30
+
+
+def legacy_record(video: Dict) -> Dict:
+    return {
+        "id": video["id"],
+        "title": video.get("title", ""),
+        "cover_url": video.get("cover_url", ""),
+        "share_url": video.get("share_url", ""),
+        "create_time": datetime.fromtimestamp(video.get("create_time", 0)).strftime("%Y-%m-%d %H:%M:%S"),
+        "stats": {
+            "likes": video.get("statistics", {}).get("like_count", 0),
+            "views": video.get("statistics", {}).get("view_count", 0),
+            "shares": video.get("statistics", {}).get("share_count", 0)
+        },
+        "hashtags": [tag["name"] for tag in video.get("hashtags", [])]
+    }
+
+
+def legacy_encode(page: List) -> bytes:
+    return json.dumps({"videos": page, "cursor": 0, "has_more": True}).encode()
+
+
+def fast_encode(page: List) -> bytes:
+    return fast_json.dumps({"videos": page, "cursor": 0, "has_more": True})
+
+
+def measure(raw: bytes, loads: Callable, build: Callable, encode: Callable) -> Dict:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    library = [build(video) for video in loads(raw)["videos"]]
+    decode_time = time.perf_counter() - started
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    encoded = 0
+    for offset in range(0, len(library), PAGE_SIZE):
+        encoded += len(encode(library[offset:offset + PAGE_SIZE]))
+    encode_time = time.perf_counter() - started
+    return {
+        'decode_s': round(decode_time, 3),
+        'memory_mb': round(retained / 1e6, 1),
+        'encode_s': round(encode_time, 3),
+        'encode_us_per_page': round(encode_time / max(1, len(library) / PAGE_SIZE) * 1e6, 1),
+        'bytes': encoded
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the video-metadata model and JSON paths")
+    parser.add_argument('--videos', type=int, default=50000, help='videos in the simulated library')
+    args = parser.parse_args()
+
+    raw = json.dumps({"videos": [_video('https://example.com', i) for i in range(args.videos)]}).encode()
+    results = {
+        'dict+json': measure(raw, json.loads, legacy_record, legacy_encode),
+        f'record+{fast_json.BACKEND}': measure(raw, fast_json.loads, VideoRecord.from_api, fast_encode)
+    }
+    print(f"{args.videos} videos, pages of {PAGE_SIZE}")
+    print(f"{'model':<16}{'decode s':>10}{'memory MB':>11}{'encode s':>10}{'us/page':>10}")
+    for name, result in results.items():
+        print(f"{name:<16}{result['decode_s']:>10}{result['memory_mb']:>11}{result['encode_s']:>10}"
+              f"{result['encode_us_per_page']:>10}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+"""
+Load generator for the web tier: /, /videos, /download and /status.
+
+    python -m benchmarks.web_load --users 20 --duration 30 --save-baseline web-baseline.json
+    python -m benchmarks.web_load --users 20 --duration 30 --compare web-baseline.json
+
+Starts benchmarks/mock_upstream.py and server.py under hypercorn in separate processes
+(or targets a running server with --target). Each virtual user logs in through the OAuth
+callback against the mock, then loops over a weighted mix of requests. Reports request
+rate, latency percentiles and a status breakdown per endpoint; --compare exits non-zero
+when throughput or latency regress past --tolerance relative to a saved baseline.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import aiohttp
+
+from benchmarks.download_engine import ROOT, percentile, start_mock
+from benchmarks.mock_upstream import video_id
+
+# (name, weight); every virtual user picks its next request from this mix
+SCENARIOS = (
+    ('index', 3),
+    ('videos', 4),
+    ('videos_filtered', 1),
+    ('download', 1),
+    ('status', 2),
+)
+FILTER_TAGS = ('dance', 'cook*', 'travel music', 'pets,diy')
+
+
+class EndpointStats:
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+
+    def record(self, status: str, latency: float):
+        self.latencies.append(latency)
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self, duration: float) -> Dict:
+        count = len(self.latencies)
+        server_errors = sum(n for status, n in self.statuses.items() if status.startswith('5'))
+        other_errors = sum(n for status, n in self.statuses.items()
+                           if status.startswith('4') and status != '429') + self.statuses.get('error', 0)
+        return {
+            'requests': count,
+            'rps': round(count / duration, 2) if duration else 0,
+            'p50_ms': round(percentile(self.latencies, 50) * 1000, 2),
+            'p95_ms': round(percentile(self.latencies, 95) * 1000, 2),
+            'p99_ms': round(percentile(self.latencies, 99) * 1000, 2),
+            'max_ms': round(max(self.latencies, default=0) * 1000, 2),
+            'rate_limited': self.statuses.get('429', 0),
+            'server_errors': server_errors,
+            'other_errors': other_errors,
+            'statuses': dict(sorted(self.statuses.items()))
+        }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(mock_url: str, workdir: str) -> subprocess.Popen:
+    """Run the server app factory under hypercorn, pointed at the mock, with downloads landing in workdir"""
+    port = _free_port()
+    env = dict(
+        os.environ,
+        PYTHONPATH=ROOT,
+        TIKTOK_CLIENT_KEY='bench-client',
+        TIKTOK_CLIENT_SECRET='bench-secret',
+        TIKTOK_API_BASE_URL=f"{mock_url}/v2",
+        TIKTOK_OAUTH_BASE_URL=f"{mock_url}/oauth",
+        DEVELOPMENT_MODE='true',
+        LOG_FORMAT='json',
+        LOG_LEVEL=os.getenv('LOG_LEVEL', 'ERROR')
+    )
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'hypercorn', 'server:create_app()', '--bind', f"127.0.0.1:{port}", '--log-level', 'WARNING'],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL
+    )
+    process.base_url = f"http://127.0.0.1:{port}"
+    return process
+
+
+async def wait_until_ready(base_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as session:
+        while time.monotonic() < deadline:
+            try:
+                async with session.get(f"{base_url}/metrics") as response:
+                    if response.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"Server at {base_url} did not come up within {timeout:.0f}s")
+
+
+async def _request(session: aiohttp.ClientSession, stats: Dict[str, EndpointStats], name: str,
+                   method: str, url: str, **kwargs):
+    started = time.perf_counter()
+    try:
+        async with session.request(method, url, **kwargs) as response:
+            await response.read()
+            status = str(response.status)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        status = 'error'
+    stats.setdefault(name, EndpointStats()).record(status, time.perf_counter() - started)
+
+
+async def virtual_user(base_url: str, deadline: float, stats: Dict[str, EndpointStats],
+                       think_time: float, videos: int, rng: random.Random):
+    names = [name for name, _ in SCENARIOS]
+    weights = [weight for _, weight in SCENARIOS]
+    timeout = aiohttp.ClientTimeout(total=60)
+    # Each user keeps its own cookie jar, and so its own server-side account
+    async with aiohttp.ClientSession(timeout=timeout, cookie_jar=aiohttp.CookieJar(unsafe=True)) as session:
+        await _request(session, stats, 'login', 'GET', f"{base_url}/auth/tiktok/callback",
+                       params={'code': f"bench-{rng.random()}", 'state': 'bench'})
+
+        while time.monotonic() < deadline:
+            name = rng.choices(names, weights)[0]
+            if name == 'index':
+                await _request(session, stats, name, 'GET', f"{base_url}/")
+            elif name == 'videos':
+                cursor = rng.randrange(0, max(1, videos), 20)
+                await _request(session, stats, name, 'GET', f"{base_url}/videos",
+                               params={'cursor': cursor, 'max_count': 20})
+            elif name == 'videos_filtered':
+                await _request(session, stats, name, 'GET', f"{base_url}/videos",
+                               params={'hashtag': rng.choice(FILTER_TAGS), 'max_count': 20})
+            elif name == 'download':
+                ids = [video_id(rng.randrange(videos)) for _ in range(rng.randint(1, 3))]
+                await _request(session, stats, name, 'POST', f"{base_url}/download", json={'video_ids': ids})
+            else:
+                await _request(session, stats, name, 'GET', f"{base_url}/status")
+            if think_time:
+                await asyncio.sleep(rng.uniform(0, 2 * think_time))
+
+
+async def run_load(base_url: str, users: int, duration: float, think_time: float,
+                   videos: int, seed: Optional[int]) -> Dict:
+    await wait_until_ready(base_url)
+    stats: Dict[str, EndpointStats] = {}
+    rng = random.Random(seed)
+    started = time.monotonic()
+    deadline = started + duration
+    await asyncio.gather(*(
+        virtual_user(base_url, deadline, stats, think_time, videos, random.Random(rng.random()))
+        for _ in range(users)
+    ))
+    elapsed = time.monotonic() - started
+
+    combined = EndpointStats()
+    for name, endpoint in stats.items():
+        if name == 'login':
+            continue
+        for status, count in endpoint.statuses.items():
+            combined.statuses[status] = combined.statuses.get(status, 0) + count
+        combined.latencies.extend(endpoint.latencies)
+
+    return {
+        'users': users,
+        'duration': round(elapsed, 2),
+        'think_time': think_time,
+        'total': combined.summary(elapsed),
+        'endpoints': {name: endpoint.summary(elapsed) for name, endpoint in sorted(stats.items())}
+    }
+
+
+def print_report(result: Dict):
+    header = (f"{'endpoint':<16} {'reqs':>7} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+              f"{'max ms':>8} {'429':>6} {'5xx':>6} {'other':>6}")
+    print(f"{result['users']} users for {result['duration']}s")
+    print(header)
+    print('-' * len(header))
+    rows = list(result['endpoints'].items()) + [('TOTAL', result['total'])]
+    for name, s in rows:
+        print(f"{name:<16} {s['requests']:>7} {s['rps']:>8.1f} {s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} "
+              f"{s['p99_ms']:>8.1f} {s['max_ms']:>8.1f} {s['rate_limited']:>6} {s['server_errors']:>6} "
+              f"{s['other_errors']:>6}")
+
+
+def compare(baseline: Dict, result: Dict, tolerance: float) -> List[str]:
+    """Regressions of the current run against the baseline, empty when within tolerance"""
+    regressions = []
+    for name, current in list(result['endpoints'].items()) + [('TOTAL', result['total'])]:
+        before = baseline['total'] if name == 'TOTAL' else baseline['endpoints'].get(name)
+        if not before or not before['requests']:
+            continue
+        if current['rps'] < before['rps'] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {current['rps']} req/s < baseline {before['rps']}")
+        for key in ('p50_ms', 'p95_ms'):
+            # Ignore sub-millisecond noise on very fast endpoints
+            if current[key] > before[key] * (1 + tolerance) and current[key] - before[key] > 1:
+                regressions.append(f"{name}: {key} {current[key]} > baseline {before[key]}")
+        if current['server_errors'] > before['server_errors'] * (1 + tolerance) + 1:
+            regressions.append(f"{name}: {current['server_errors']} 5xx > baseline {before['server_errors']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the web tier against the mock upstream")
+    parser.add_argument('--users', type=int, default=10, help='concurrent virtual users')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load')
+    parser.add_argument('--think-time', type=float, default=0.0, help='mean pause between a user\'s requests')
+    parser.add_argument('--videos', type=int, default=200, help='videos in the mock account')
+    parser.add_argument('--latency', type=float, default=0.02, help='mock upstream latency per request')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--target', help='load an already running server instead of starting one')
+    parser.add_argument('--save-baseline', metavar='PATH', help='write the results as a baseline')
+    parser.add_argument('--compare', metavar='PATH', help='fail if results regress against this baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='allowed relative regression')
+    args = parser.parse_args()
+
+    processes = []
+    workdir = tempfile.mkdtemp(prefix='tiktok-load-')
+    try:
+        base_url = args.target
+        if not base_url:
+            mock = start_mock(['--videos', str(args.videos), '--latency', str(args.latency)])
+            processes.append(mock)
+            server = start_server(mock.base_url, workdir)
+            processes.append(server)
+            base_url = server.base_url
+        result = asyncio.run(run_load(base_url, args.users, args.duration, args.think_time, args.videos, args.seed))
+    finally:
+        for process in reversed(processes):
+            process.terminate()
+            process.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(result)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline, result, args.tolerance)
+        if regressions:
+            print('\nRegressions against baseline:')
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print('\nNo regressions against baseline')
+
+
+if __name__ == '__main__':
+    main()
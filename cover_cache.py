@@ -0,0 +1,232 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Set
+
+import aiohttp
+
+from resilience import upstream
+from metrics import CACHE_REQUESTS
+from log import get_logger
+
+logger = get_logger('cover_cache')
+
+
+class CoverEntry:
+    """A cover image stored on disk"""
+
+    def __init__(self, path: str, size: int, etag: str, content_type: str, fetched_at: float,
+                 upstream_etag: Optional[str] = None, last_modified: Optional[str] = None):
+        self.path = path
+        self.size = size
+        self.etag = etag
+        self.content_type = content_type
+        self.fetched_at = fetched_at
+        self.upstream_etag = upstream_etag
+        self.last_modified = last_modified
+
+    def read(self) -> bytes:
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def to_meta(self) -> Dict:
+        return {
+            'etag': self.etag,
+            'content_type': self.content_type,
+            'fetched_at': self.fetched_at,
+            'upstream_etag': self.upstream_etag,
+            'last_modified': self.last_modified
+        }
+
+
+class CoverCache:
+    """
+    Size-bounded on-disk LRU cache for video cover images.
+    Signed cover URLs expire, so the latest known URL for each video is remembered
+    and used to fill misses and to refresh stale entries in the background. The cache
+    is shared by every account, so it also remembers which accounts listed each video.
+    """
+
+    def __init__(self, directory: str = "cache/covers", max_bytes: int = 200 * 1024 * 1024,
+                 ttl: float = 6 * 3600, max_sources: int = 50000):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_sources = max_sources
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, CoverEntry]" = OrderedDict()
+        self._sources: "OrderedDict[str, str]" = OrderedDict()
+        self._owners: Dict[str, Set[str]] = {}     # Kept for the videos in _sources
+        self._inflight: Dict[str, asyncio.Event] = {}
+        self._background: Set[asyncio.Task] = set()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Rebuild the index from disk, oldest files first so LRU order survives restarts"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.meta'):
+                continue
+            video_id = name[:-5]
+            path = os.path.join(self.directory, video_id)
+            try:
+                with open(os.path.join(self.directory, name)) as f:
+                    meta = json.load(f)
+                stat = os.stat(path)
+            except (OSError, ValueError):
+                continue
+            entries.append((stat.st_mtime, video_id, CoverEntry(path, stat.st_size, **meta)))
+
+        for _, video_id, entry in sorted(entries, key=lambda item: item[0]):
+            self._entries[video_id] = entry
+            self.total_bytes += entry.size
+
+    def remember(self, video_id: str, cover_url: str, account_id: Optional[str] = None):
+        """Record the latest signed cover URL for a video, and the account whose library listed it"""
+        if not cover_url or not re.fullmatch(r'[\w-]+', video_id):
+            return
+        with self._lock:
+            self._sources[video_id] = cover_url
+            self._sources.move_to_end(video_id)
+            if account_id:
+                self._owners.setdefault(video_id, set()).add(account_id)
+            while len(self._sources) > self.max_sources:
+                evicted, _ = self._sources.popitem(last=False)
+                self._owners.pop(evicted, None)
+
+    def owns(self, video_id: str, account_id: Optional[str]) -> bool:
+        """Whether the account has listed the video since the cover URL was remembered"""
+        with self._lock:
+            return account_id in self._owners.get(video_id, ())
+
+    async def get(self, video_id: str, session: aiohttp.ClientSession) -> Optional[CoverEntry]:
+        """Return the cached cover, fetching it on a miss and refreshing it in the background when stale"""
+        if not re.fullmatch(r'[\w-]+', video_id):
+            return None
+
+        with self._lock:
+            entry = self._entries.get(video_id)
+            if entry is not None:
+                self._entries.move_to_end(video_id)
+                stale = time.time() - entry.fetched_at > self.ttl
+                CACHE_REQUESTS.inc(cache='cover', result='stale' if stale else 'hit')
+                if stale and video_id not in self._inflight:
+                    self._inflight[video_id] = asyncio.Event()
+                    task = asyncio.create_task(self._refresh(video_id, session))
+                    self._background.add(task)
+                    task.add_done_callback(self._background.discard)
+                return entry
+
+            CACHE_REQUESTS.inc(cache='cover', result='miss')
+            event = self._inflight.get(video_id)
+            leader = event is None
+            if leader:
+                if video_id not in self._sources:
+                    return None
+                event = self._inflight[video_id] = asyncio.Event()
+
+        if not leader:
+            # Another request is already fetching this cover
+            try:
+                await asyncio.wait_for(event.wait(), timeout=30)
+            except asyncio.TimeoutError:
+                return None
+            with self._lock:
+                return self._entries.get(video_id)
+
+        await self._refresh(video_id, session)
+        with self._lock:
+            return self._entries.get(video_id)
+
+    async def _refresh(self, video_id: str, session: aiohttp.ClientSession):
+        try:
+            with self._lock:
+                url = self._sources.get(video_id)
+                current = self._entries.get(video_id)
+            if url:
+                await self._fetch(session, video_id, url, current)
+        except Exception as e:
+            logger.warning("Could not fetch cover for %s: %s", video_id, e)
+        finally:
+            with self._lock:
+                event = self._inflight.pop(video_id, None)
+            if event:
+                event.set()
+
+    async def _fetch(self, session: aiohttp.ClientSession, video_id: str, url: str, current: Optional[CoverEntry]):
+        headers = {}
+        if current is not None:
+            if current.upstream_etag:
+                headers['If-None-Match'] = current.upstream_etag
+            if current.last_modified:
+                headers['If-Modified-Since'] = current.last_modified
+
+        timeout = aiohttp.ClientTimeout(total=15)
+        response = await upstream.request(session, 'GET', url, endpoint='cover', headers=headers, timeout=timeout)
+        async with response:
+            if response.status == 304 and current is not None:
+                current.fetched_at = time.time()
+                await asyncio.to_thread(self._write_meta, video_id, current)
+                return
+            if response.status != 200:
+                raise aiohttp.ClientError(f"HTTP {response.status}")
+            data = await response.read()
+
+        await asyncio.to_thread(
+            self._store,
+            video_id,
+            data,
+            response.headers.get('Content-Type', 'image/jpeg'),
+            response.headers.get('ETag'),
+            response.headers.get('Last-Modified')
+        )
+
+    def _write_meta(self, video_id: str, entry: CoverEntry):
+        meta_path = os.path.join(self.directory, f"{video_id}.meta")
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump(entry.to_meta(), f)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def _store(self, video_id: str, data: bytes, content_type: str,
+               upstream_etag: Optional[str], last_modified: Optional[str]):
+        path = os.path.join(self.directory, video_id)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.replace(path + '.tmp', path)
+
+        entry = CoverEntry(
+            path,
+            len(data),
+            hashlib.sha1(data).hexdigest(),
+            content_type,
+            time.time(),
+            upstream_etag,
+            last_modified
+        )
+        self._write_meta(video_id, entry)
+
+        with self._lock:
+            previous = self._entries.pop(video_id, None)
+            if previous is not None:
+                self.total_bytes -= previous.size
+            self._entries[video_id] = entry
+            self.total_bytes += entry.size
+            self._evict()
+
+    def _evict(self):
+        """Drop least recently used covers until the cache fits its byte budget"""
+        while self.total_bytes > self.max_bytes and len(self._entries) > 1:
+            video_id, entry = self._entries.popitem(last=False)
+            self.total_bytes -= entry.size
+            for path in (entry.path, entry.path + '.meta'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
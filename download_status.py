@@ -0,0 +1,39 @@
+from collections import OrderedDict
+from typing import Dict, Optional
+
+FINISHED = ('completed', 'failed', 'skipped')
+
+
+class DownloadStatusTable:
+    """
+    Status entries for /status, per account and video id, so two accounts downloading the
+    same video each see their own job. Entries are dicts the download updates in place;
+    only the last `keep_finished` finished ones of each account are kept.
+    """
+
+    def __init__(self, keep_finished: int = 50):
+        self.keep_finished = keep_finished
+        self._accounts: Dict[str, "OrderedDict[str, dict]"] = {}
+
+    def set(self, account_id: str, video_id: str, status: dict) -> dict:
+        entries = self._accounts.setdefault(account_id, OrderedDict())
+        entries.pop(video_id, None)
+        entries[video_id] = status
+        self._trim(entries)
+        return status
+
+    def get(self, account_id: str, video_id: str) -> Optional[dict]:
+        return self._accounts.get(account_id, {}).get(video_id)
+
+    def for_account(self, account_id: str) -> "OrderedDict[str, dict]":
+        """The account's entries, oldest first"""
+        entries = self._accounts.get(account_id)
+        if entries is None:
+            return OrderedDict()
+        self._trim(entries)
+        return entries
+
+    def _trim(self, entries: "OrderedDict[str, dict]"):
+        finished = [video_id for video_id, status in entries.items() if status.get('status') in FINISHED]
+        for video_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del entries[video_id]
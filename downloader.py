@@ -1,40 +1,91 @@
 import asyncio
 import aiohttp
+import hashlib
 import os
 import re
 import json
 import time
 import random # Added for jitter in rate limiting
-from rich.progress import Progress, TextColumn, BarColumn, DownloadColumn, TransferSpeedColumn
-from rich.console import Console
-from typing import List, Optional, Dict, Any
-from datetime import datetime
+from typing import List, Optional, Dict, Any, Callable, Awaitable, Iterator, Tuple
+from resilience import upstream, CircuitOpenError
+from metrics import DOWNLOAD_BYTES, DOWNLOAD_THROUGHPUT, DOWNLOADS, RATE_LIMIT_STALL
+from job_trace import JobTrace, trace_writer
+from journal import Journal
+import fast_json
+from manifest import HASH_ALGORITHM, MANIFEST_NAME, Manifest, hash_prefix
+from media_urls import MediaUrl, media_url_cache
+from variants import VariantPolicy, extract_variants
+from video_record import VideoRecord
+from log import get_logger
+
+logger = get_logger('downloader')
+
+JOURNAL_CHECKPOINT_BYTES = 8 * 1024 * 1024
+
+
+class RateLimiter:
+    """Hands out request start times at least `delay` seconds apart"""
+
+    def __init__(self):
+        self.last_request_time = 0.0
+
+    def claim(self, now: float, delay: float) -> float:
+        slot = now
+        if now - self.last_request_time < delay:
+            jitter = random.uniform(0, min(0.5, delay * 0.2))  # Up to 0.5s at the default delay
+            slot = self.last_request_time + delay + jitter
+        # Claim the slot before sleeping so concurrent callers queue behind it instead of waking together
+        self.last_request_time = slot
+        return slot
+
 
 class TikTokDownloader:
-    def __init__(self, access_token=None):
-        self.session = None
-        self.console = Console()
+    def __init__(self, access_token=None, session: Optional[aiohttp.ClientSession] = None,
+                 token_provider: Optional[Callable[..., Awaitable[Optional[str]]]] = None,
+                 output_dir: str = "downloads", concurrent_downloads: int = 2, rate_limit_delay: float = 2.5,
+                 journal: Optional[Journal] = None, resume_partial: bool = False,
+                 rate_limiter: Optional[RateLimiter] = None, variant_policy: Optional[VariantPolicy] = None):
+        # A session passed in is shared with the caller's event loop and is not closed by cleanup()
+        self.session = session
+        self._owns_session = session is None
         self.max_retries = 3
         self.access_token = access_token
-        self.rate_limit_delay = 2.5  # Increased from 1.0 to 2.5 seconds
-        self.concurrent_downloads = 2  # Reduced from 3 to 2 for better stability
+        # Optional async callback returning a fresh token, called with force_refresh=True after a 401
+        self.token_provider = token_provider
+        self.output_dir = output_dir
+        self.manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME))
+        # Optional job-state journal; resume_partial continues .part files left by an interrupted run
+        self.journal = journal
+        self.resume_partial = resume_partial
+        self.rate_limit_delay = rate_limit_delay  # Minimum spacing between page requests, 2.5s by default
+        self.concurrent_downloads = concurrent_downloads  # 2 by default for better stability
         self.semaphore = asyncio.Semaphore(self.concurrent_downloads)
-        self.last_request_time = 0
-        self.api_base_url = "https://open.tiktokapis.com/v2"
-
-    async def get_user_videos(self, max_count: int = 30, cursor: int = 0, sort_type: str = "latest") -> Dict[str, Any]:
-        """Fetch videos from the user's profile with sorting options"""
-        if not self.access_token:
+        # Shared between processes when running sharded, see batch_pool.py
+        self.rate_limiter = rate_limiter or RateLimiter()
+        # Which encode to fetch when the page lists several, VIDEO_QUALITY by default
+        self.variant_policy = variant_policy or VariantPolicy.from_env()
+        # Overridable so benchmarks can point the client at benchmarks/mock_upstream.py
+        self.api_base_url = os.getenv('TIKTOK_API_BASE_URL', "https://open.tiktokapis.com/v2")
+
+    async def _get_access_token(self, force_refresh: bool = False) -> Optional[str]:
+        if self.token_provider is not None:
+            token = await self.token_provider(force_refresh=force_refresh)
+            if token:
+                self.access_token = token
+        return self.access_token
+
+    async def get_user_videos(self, max_count: int = 30, cursor: int = 0, sort_type: str = "latest",
+                              raise_errors: bool = False) -> Dict[str, Any]:
+        """
+        Fetch videos from the user's profile with sorting options, as VideoRecords.
+        Errors are logged and reported as an empty last page unless raise_errors is set.
+        """
+        if not await self._get_access_token():
             raise ValueError("Access token is required to fetch user videos")
 
         await self.init_session()
 
         try:
-            headers = {
-                "Authorization": f"Bearer {self.access_token}",
-                "Content-Type": "application/json"
-            }
-
             # Map sort type to API parameters
             sort_params = {
                 "latest": {"sort_type": "create_time", "order": "desc"},
@@ -52,23 +103,24 @@ class TikTokDownloader:
             }
 
             url = f"{self.api_base_url}/video/list/"
-            async with self.session.get(url, headers=headers, params=params) as response:
+            for attempt in range(2):
+                headers = {
+                    "Authorization": f"Bearer {self.access_token}",
+                    "Content-Type": "application/json"
+                }
+                response = await upstream.request(self.session, 'GET', url, endpoint='video/list', headers=headers, params=params)
+                if response.status == 401 and attempt == 0 and self.token_provider is not None:
+                    # Token expired mid-run, renew it once instead of failing the job
+                    response.release()
+                    await self._get_access_token(force_refresh=True)
+                    continue
+                break
+
+            async with response:
                 if response.status == 200:
-                    data = await response.json()
+                    data = fast_json.loads(await response.read())
                     return {
-                        "videos": [{
-                            "id": video["id"],
-                            "title": video.get("title", ""),
-                            "cover_url": video.get("cover_url", ""),
-                            "share_url": video.get("share_url", ""),
-                            "create_time": datetime.fromtimestamp(video.get("create_time", 0)).strftime("%Y-%m-%d %H:%M:%S"),
-                            "stats": {
-                                "likes": video.get("statistics", {}).get("like_count", 0),
-                                "views": video.get("statistics", {}).get("view_count", 0),
-                                "shares": video.get("statistics", {}).get("share_count", 0)
-                            },
-                            "hashtags": [tag["name"] for tag in video.get("hashtags", [])]
-                        } for video in data.get("videos", [])],
+                        "videos": [VideoRecord.from_api(video) for video in data.get("videos", [])],
                         "cursor": data.get("cursor", 0),
                         "has_more": data.get("has_more", False)
                     }
@@ -77,86 +129,147 @@ class TikTokDownloader:
                     raise Exception(f"Failed to fetch videos: {error_data.get('error', 'Unknown error')}")
 
         except Exception as e:
-            self.console.print(f"[red]Error fetching user videos: {str(e)}[/red]")
+            if raise_errors:
+                raise
+            logger.error("Error fetching user videos: %s", e)
             return {"videos": [], "cursor": cursor, "has_more": False}
 
     async def init_session(self):
         """Initialize aiohttp session if not already initialized"""
         if self.session is None or self.session.closed:
             self.session = aiohttp.ClientSession(
-                headers=self.mobile_headers,
-                compress=True
+                headers=self.mobile_headers
             )
+            self._owns_session = True
         return self.session
 
     async def cleanup(self):
-        if self.session:
+        if self.session and self._owns_session:
             await self.session.close()
 
-    async def _get_video_url(self, url: str) -> Optional[str]:
-        """Get the actual video URL from TikTok"""
+    async def get_video_share_url(self, video_id: str) -> Optional[str]:
+        """Look up the share URL of one of the user's videos by its id"""
+        if not await self._get_access_token():
+            raise ValueError("Access token is required to look up videos")
+
         session = await self.init_session()
-        try:
-            await self._rate_limit()  # Ensure rate limiting before request
+        url = f"{self.api_base_url}/video/query/"
+        headers = {
+            "Authorization": f"Bearer {self.access_token}",
+            "Content-Type": "application/json"
+        }
+        body = {"filters": {"video_ids": [video_id]}}
+        response = await upstream.request(
+            session, 'POST', url, endpoint='video/query',
+            headers=headers, params={"fields": "id,share_url"}, json=body
+        )
+        async with response:
+            if response.status != 200:
+                raise aiohttp.ClientError(f"Video lookup failed: HTTP {response.status}")
+            data = await response.json()
+
+        videos = data.get("data", data).get("videos", [])
+        for video in videos:
+            if video.get("id") == video_id:
+                return video.get("share_url")
+        return None
 
-            # Try mobile user agent first
-            async with session.get(url, allow_redirects=True, timeout=30) as response:
-                if response.status == 429:  # Rate limit hit
-                    self.console.print("[yellow]Rate limit hit, waiting...[/yellow]")
-                    await asyncio.sleep(5)
+    def _profile_headers(self, profile: str) -> Optional[Dict[str, str]]:
+        # The session is created with the mobile headers
+        return self.desktop_headers if profile == 'desktop' else None
+
+    async def _get_video_url(self, url: str, trace: Optional[JobTrace] = None) -> Optional[Tuple[str, str]]:
+        """Get the actual video URL from TikTok, with the header profile ('mobile' or 'desktop') that found it"""
+        session = await self.init_session()
+        trace = trace or JobTrace(url)
+        try:
+            with trace.phase('rate_limit'):
+                await self._rate_limit()  # Ensure rate limiting before request
+
+            # Try mobile user agent first, 429s and server errors are retried by the resilience layer
+            timeout = aiohttp.ClientTimeout(total=30)
+            profile = 'mobile'
+            with trace.phase('scrape'):
+                response = await upstream.request(session, 'GET', url, endpoint='page', allow_redirects=True, timeout=timeout)
+                async with response:
+                    status = response.status
+                    content = await response.text() if status == 200 else None
+
+                if status == 429:
+                    logger.warning("Rate limit persisted after retries", extra={'url': url})
                     return None
-                elif response.status != 200:
+                elif content is None:
                     # If mobile fails, try desktop user agent
-                    async with aiohttp.ClientSession(headers=self.desktop_headers) as desktop_session:
-                        async with desktop_session.get(url, timeout=30) as desktop_response:
-                            if desktop_response.status != 200:
-                                self.console.print(f"[red]Failed to fetch URL: HTTP {desktop_response.status}[/red]")
-                                return None
-                            content = await desktop_response.text()
-                else:
-                    content = await response.text()
-
-                self.console.print("[yellow]Attempting to extract video URL...[/yellow]")
-
-                # Look for various patterns of video URLs
-                patterns = [
-                    r'{"playAddr":"([^"]+)"',
-                    r'{"downloadAddr":"([^"]+)"',
-                    r'"playAddr":"([^"]+)"',
-                    r'"downloadAddr":"([^"]+)"',
-                    r'"playUrl":"([^"]+)"',
-                    r'<video[^>]+src="([^"]+\.mp4)"',
-                    r'https?://[^\s<>"]+?\.mp4(?:[^"\s<>]*)'
-                ]
-
-                for pattern in patterns:
-                    matches = re.finditer(pattern, content)
-                    for match in matches:
-                        video_url = match.group(1) if not pattern.endswith('mp4(?:[^"\s<>]*)') else match.group(0)
-                        video_url = video_url.replace(r'\u002F', '/').replace('\\/', '/')
-                        if video_url.startswith('//'):
-                            video_url = 'https:' + video_url
-
-                        # Verify if the URL is accessible
-                        try:
-                            async with session.head(video_url) as vid_response:
-                                if vid_response.status == 200:
-                                    self.console.print(f"[green]Found valid video URL[/green]")
-                                    return video_url
-                        except:
-                            continue
-
-                self.console.print("[yellow]Warning: Could not find valid video URL[/yellow]")
-                return None
+                    profile = 'desktop'
+                    desktop_response = await upstream.request(session, 'GET', url, endpoint='page', headers=self.desktop_headers, timeout=timeout)
+                    async with desktop_response:
+                        if desktop_response.status != 200:
+                            logger.warning("Failed to fetch URL: HTTP %s", desktop_response.status, extra={'url': url})
+                            return None
+                        content = await desktop_response.text()
+
+            logger.debug("Attempting to extract video URL from %s", url)
+
+            tried = set()
+            for video_url in self._candidate_urls(content):
+                if video_url in tried:
+                    continue
+                tried.add(video_url)
+
+                # Verify if the URL is accessible, one attempt per candidate
+                try:
+                    with trace.phase('probe'):
+                        vid_response = await upstream.request(session, 'HEAD', video_url, endpoint='cdn_head', max_attempts=1,
+                                                              headers=self._profile_headers(profile))
+                        async with vid_response:
+                            if vid_response.status == 200:
+                                logger.debug("Found valid video URL for %s", url)
+                                return video_url, profile
+                except Exception:
+                    continue
+
+            logger.warning("Could not find valid video URL", extra={'url': url})
+            return None
 
         except Exception as e:
-            self.console.print(f"[red]Error extracting video URL: {str(e)}[/red]")
+            logger.error("Error extracting video URL: %s", e, extra={'url': url})
             return None
 
-    async def download_videos(self, video_ids: List[str]):
-        """Download multiple videos by their IDs"""
+    def _candidate_urls(self, content: str) -> Iterator[str]:
+        """Video URLs found in a page, best match for the quality policy first"""
+        variants = self.variant_policy.order(extract_variants(content))
+        if variants:
+            logger.debug("Variants in policy %s order: %s", self.variant_policy, variants)
+        for variant in variants:
+            yield variant.url
+
+        # Pages without a bitrate list, look for various patterns of video URLs
+        patterns = [
+            r'{"playAddr":"([^"]+)"',
+            r'{"downloadAddr":"([^"]+)"',
+            r'"playAddr":"([^"]+)"',
+            r'"downloadAddr":"([^"]+)"',
+            r'"playUrl":"([^"]+)"',
+            r'<video[^>]+src="([^"]+\.mp4)"',
+            r'https?://[^\s<>"]+?\.mp4(?:[^"\s<>]*)'
+        ]
+
+        for pattern in patterns:
+            matches = re.finditer(pattern, content)
+            for match in matches:
+                video_url = match.group(1) if not pattern.endswith('mp4(?:[^"\s<>]*)') else match.group(0)
+                video_url = video_url.replace(r'\u002F', '/').replace('\\/', '/')
+                if video_url.startswith('//'):
+                    video_url = 'https:' + video_url
+                yield video_url
+
+    async def download_videos(self, video_ids: List[str]) -> List[JobTrace]:
+        """Download multiple videos by their IDs or TikTok URLs"""
+        # The console progress bar is only needed by the CLI, the server and batch runs pass their own
+        from rich.progress import Progress, TextColumn, BarColumn, DownloadColumn, TransferSpeedColumn
+
         await self.init_session()
-        os.makedirs("downloads", exist_ok=True)
+        os.makedirs(self.output_dir, exist_ok=True)
 
         with Progress(
             TextColumn("[bold blue]{task.description}"),
@@ -170,79 +283,233 @@ class TikTokDownloader:
                 tasks.append(task)
 
             results = await asyncio.gather(*tasks, return_exceptions=True)
+            traces = []
             for video_id, result in zip(video_ids, results):
                 if isinstance(result, Exception):
-                    self.console.print(f"[red]Failed to download video {video_id}: {str(result)}[/red]")
+                    logger.error("Failed to download video %s: %s", video_id, result)
+                    failed = JobTrace(video_id)
+                    failed.finish('failed', str(result))
+                    result = failed
+                traces.append(result)
+            return traces
+
+    @staticmethod
+    def _is_url(item: str) -> bool:
+        return item.startswith(('http://', 'https://'))
+
+    @staticmethod
+    def _job_key(item: str) -> str:
+        """Stable key for a queued URL or id, used for file names, the journal and sharding"""
+        if TikTokDownloader._is_url(item):
+            match = re.search(r'(?:video|v)/(\d+)', item)
+            return match.group(1) if match else re.sub(r'[^\w-]+', '_', item.rstrip('/').rsplit('/', 1)[-1])
+        return item
+
+    def _job_filename(self, item: str) -> str:
+        return os.path.join(self.output_dir, f"tiktok_{self._job_key(item)}.mp4")
+
+    @staticmethod
+    def _expected_size(response: aiohttp.ClientResponse, offset: int) -> Optional[int]:
+        """Full file size from Content-Range or Content-Length, None when unknown"""
+        if response.headers.get('Content-Encoding', 'identity').lower() != 'identity':
+            # Content-Length counts encoded bytes, not the decoded ones written to disk
+            return None
+        if response.status == 206:
+            match = re.match(r'bytes \d+-\d+/(\d+)', response.headers.get('Content-Range', ''))
+            if match:
+                return int(match.group(1))
+        if response.content_length is not None:
+            return offset + response.content_length
+        return None
 
-    async def _download_single_video(self, video_id: str, progress):
+    async def _resolve_media_url(self, video_id: str, trace: JobTrace) -> Optional[MediaUrl]:
+        """Signed CDN URL for a queued URL or bare id, from media_url_cache while its signature is valid"""
+
+        async def resolve():
+            # Bare ids need a share URL lookup first. That is an official API call, retried and
+            # backed off by the resilience layer, so only the page scrape waits on the rate limiter
+            page_url = video_id
+            if not self._is_url(video_id):
+                with trace.phase('resolve'):
+                    page_url = await self.get_video_share_url(video_id)
+                if not page_url:
+                    raise Exception("Could not resolve video page URL")
+            return await self._get_video_url(page_url, trace)
+
+        # A different policy picks a different variant, so it gets its own entry
+        return await media_url_cache.resolve(f"{self._job_key(video_id)}:{self.variant_policy}", resolve)
+
+    def _record(self, key: str, state: str, **fields):
+        if self.journal is not None:
+            self.journal.record(key, state, **fields)
+
+    async def _download_single_video(self, video_id: str, progress, trace: Optional[JobTrace] = None,
+                                     observer=None) -> JobTrace:
+        """
+        Download one URL or bare id into the output directory. `observer` (see GrowingDownload in
+        media_stream.py) is told where the bytes land as they are written, so they can be streamed on.
+        """
         session = await self.init_session()
+        trace = trace or JobTrace(video_id)
+        key = self._job_key(video_id)
+        filename = self._job_filename(video_id)
+        if self.journal is not None and self.journal.is_done(key) and os.path.exists(filename):
+            trace.finish('skipped')
+            return trace
+
         async with self.semaphore:
 
-            filename = f"downloads/tiktok_{video_id}.mp4"
+            # Bytes land in a .part file that is renamed once complete, so a partial file is never mistaken for a video
+            part_filename = f"{filename}.part"
             download_task = progress.add_task(
                 f"Downloading {video_id}",
                 total=None
             )
+            trace.status = 'running'
 
+            delay = None
+            hasher, hashed = None, 0
             for retry in range(self.max_retries):
                 try:
-                    await self._rate_limit()
-                    #Now using video_id to fetch the share_url
-                    user_videos = await self.get_user_videos(max_count=1, sort_type="latest") # Adjust as needed
-                    video_url = None
-                    if user_videos and user_videos["videos"]:
-                        video_url = user_videos["videos"][0]["share_url"]
-
-                    if not video_url:
-                        progress.update(download_task, description=f"[red]Failed to get video URL for {video_id}[/red]")
-                        return
-
-                    async with session.get(video_url) as response:
-                        if response.status != 200:
+                    media = await self._resolve_media_url(video_id, trace)
+                    if media is None:
+                        raise Exception("Could not find a playable video URL")
+                    video_url = media.url
+                    self._record(key, 'resolved', url=video_url)
+
+                    # Continue a partial file left by an earlier attempt, or by an interrupted run when resuming
+                    offset = 0
+                    if (retry > 0 or self.resume_partial) and os.path.exists(part_filename):
+                        offset = os.path.getsize(part_filename)
+                    # Signed URLs can be tied to the user agent that scraped them
+                    headers = dict(self._profile_headers(media.profile) or {})
+                    if offset:
+                        headers['Range'] = f"bytes={offset}-"
+
+                    transfer_started = time.monotonic()
+                    with trace.phase('connect'):
+                        response = await upstream.request(session, 'GET', video_url, endpoint='cdn_get', headers=headers or None)
+                    async with response:
+                        if response.status in (401, 403, 404, 410):
+                            # Expired or revoked signature, resolve afresh on the next attempt
+                            media_url_cache.invalidate(f"{key}:{self.variant_policy}")
+                        if response.status == 416 and offset:
+                            # The partial file doesn't match the server's copy, start over on the next attempt
+                            os.remove(part_filename)
+                            raise aiohttp.ClientError("Partial file is out of range")
+                        if response.status == 200:
+                            offset = 0
+                        elif response.status != 206 or not offset:
                             raise aiohttp.ClientError(f"HTTP {response.status}")
 
-                        total_size = int(response.headers.get('content-length', 0))
-                        progress.update(download_task, total=total_size)
-
-                        with open(filename, 'wb') as f:
+                        # None when the server doesn't say; the body is then complete when the stream ends cleanly
+                        total_size = self._expected_size(response, offset)
+                        progress.update(download_task, total=total_size - offset if total_size is not None else None)
+                        self._record(key, 'downloading', offset=offset)
+                        if observer is not None:
+                            observer.on_start(part_filename, filename, offset, total_size)
+
+                        # Hash as the bytes are written so the file never has to be read back.
+                        # A retry carries the hash over; a partial file from an earlier run is hashed once.
+                        if hasher is None or hashed != offset:
+                            if offset:
+                                with trace.phase('disk'):
+                                    hasher, hashed = await asyncio.to_thread(hash_prefix, part_filename, offset)
+                            else:
+                                hasher, hashed = hashlib.new(HASH_ALGORITHM), 0
+
+                        # Time spent writing and hashing is tracked separately from time waiting on the network
+                        disk_time = 0.0
+                        written = offset
+                        next_checkpoint = offset + JOURNAL_CHECKPOINT_BYTES
+                        received_started = time.monotonic()
+                        # Unbuffered when observed, so readers of the growing file see every chunk at once
+                        with open(part_filename, 'ab' if offset else 'wb', buffering=0 if observer is not None else -1) as f:
                             async for chunk in response.content.iter_chunked(8192):
+                                write_started = time.monotonic()
                                 f.write(chunk)
+                                hasher.update(chunk)
+                                disk_time += time.monotonic() - write_started
+                                written += len(chunk)
+                                hashed = written
+                                trace.bytes += len(chunk)
+                                DOWNLOAD_BYTES.inc(len(chunk))
                                 progress.update(download_task, advance=len(chunk))
-
-                        # Verify download
-                        if os.path.getsize(filename) == total_size:
-                            progress.update(download_task, description=f"[green]Completed {video_id}[/green]")
-                            return
-                        else:
-                            raise Exception("Download verification failed")
-
+                                if observer is not None:
+                                    observer.on_data(written)
+                                if written >= next_checkpoint:
+                                    self._record(key, 'downloading', offset=written)
+                                    next_checkpoint = written + JOURNAL_CHECKPOINT_BYTES
+                        trace.add('disk', disk_time)
+                        trace.add('transfer', time.monotonic() - received_started - disk_time)
+                        transfer_time = time.monotonic() - transfer_started
+
+                        # Verify download against the advertised size when there is one
+                        if total_size is not None and written != total_size:
+                            raise Exception(f"Download verification failed: got {written} of {total_size} bytes")
+                        if written == 0:
+                            raise Exception("Download verification failed: empty response")
+
+                        os.replace(part_filename, filename)
+                        checksum = hasher.hexdigest()
+                        hasher = None
+                        self.manifest.append(filename, written, checksum, video_url, video_id)
+                        if transfer_time > 0:
+                            DOWNLOAD_THROUGHPUT.observe((written - offset) / transfer_time)
+                        DOWNLOADS.inc(result='completed')
+                        progress.update(download_task, description=f"[green]Completed {video_id}[/green]")
+                        trace.checksum = checksum
+                        trace.finish('completed')
+                        self._record(key, 'done', bytes=written, file=filename, **{HASH_ALGORITHM: checksum})
+                        trace_writer.write(trace)
+                        if observer is not None:
+                            observer.on_finish()
+                        return trace
+
+                except CircuitOpenError as e:
+                    # Upstream is known to be down, fail fast instead of sleeping through retries
+                    DOWNLOADS.inc(result='circuit_open')
+                    progress.update(download_task, description=f"[red]Failed {video_id}: {str(e)}[/red]")
+                    trace.finish('failed', str(e))
+                    break
                 except Exception as e:
-                    if retry < self.max_retries - 1:
-                        delay = (retry + 1) * 2
-                        progress.update(download_task, description=f"[yellow]Retrying {video_id} in {delay}s ({str(e)})[/yellow]")
-                        await asyncio.sleep(delay)
+                    if retry < self.max_retries - 1 and upstream.can_retry():
+                        delay = upstream.next_delay(delay)
+                        trace.retries += 1
+                        progress.update(download_task, description=f"[yellow]Retrying {video_id} in {delay:.1f}s ({str(e)})[/yellow]")
+                        with trace.phase('backoff'):
+                            await asyncio.sleep(delay)
                     else:
+                        DOWNLOADS.inc(result='failed')
                         progress.update(download_task, description=f"[red]Failed {video_id}: {str(e)}[/red]")
+                        trace.finish('failed', str(e))
+                        break
+
+            self._record(key, 'failed', error=trace.error)
+            if observer is not None:
+                observer.on_finish(trace.error)
+            trace_writer.write(trace)
+            return trace
 
     async def _rate_limit(self):
         """Implement improved rate limiting with jitter"""
         current_time = time.time()
-        time_since_last_request = current_time - self.last_request_time
-        if time_since_last_request < self.rate_limit_delay:
-            jitter = random.uniform(0, 0.5)  # Add random jitter between 0-0.5 seconds
-            await asyncio.sleep(self.rate_limit_delay - time_since_last_request + jitter)
-        self.last_request_time = time.time()
+        stall = self.rate_limiter.claim(current_time, self.rate_limit_delay) - current_time
+        if stall > 0:
+            await asyncio.sleep(stall)
+        RATE_LIMIT_STALL.observe(stall)
 
     async def _extract_video_id(self, url: str) -> Optional[str]:
         session = await self.init_session()
         # First, resolve any shortened URLs
         if 'vm.tiktok.com' in url or 't.tiktok.com' in url:
             try:
-                async with session.get(url, allow_redirects=True) as response:
+                response = await upstream.request(session, 'GET', url, endpoint='short_link', allow_redirects=True)
+                async with response:
                     if response.status == 200:
                         url = str(response.url)
             except Exception as e:
-                self.console.print(f"[yellow]Warning: Could not resolve shortened URL: {str(e)}[/yellow]")
+                logger.warning("Could not resolve shortened URL: %s", e, extra={'url': url})
 
         patterns = [
             r'video/(\d+)',
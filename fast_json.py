@@ -0,0 +1,48 @@
+"""
+JSON for the hot paths (upstream video lists, /videos responses).
+
+Uses orjson or msgspec when one is installed and the stdlib json module otherwise.
+dumps() always returns bytes so a response body needs no second encode, and objects
+with a to_dict() method, such as VideoRecord, are serialized through it.
+"""
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # orjson and msgspec are optional, json is always available
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+
+def _default(obj: Any) -> Any:
+    to_dict = getattr(obj, 'to_dict', None)
+    if to_dict is None:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    return to_dict()
+
+
+if orjson is not None:
+    BACKEND = 'orjson'
+    loads = orjson.loads
+
+    def dumps(obj: Any) -> bytes:
+        return orjson.dumps(obj, default=_default)
+
+elif msgspec is not None:
+    BACKEND = 'msgspec'
+    _encoder = msgspec.json.Encoder(enc_hook=_default)
+    loads = msgspec.json.Decoder().decode
+    dumps = _encoder.encode
+
+else:
+    BACKEND = 'json'
+    loads = json.loads
+    _encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False, default=_default)
+
+    def dumps(obj: Any) -> bytes:
+        return _encoder.encode(obj).encode()
@@ -0,0 +1,141 @@
+import asyncio
+import bisect
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Set, Tuple
+
+from video_record import VideoRecord
+
+
+class TagQuery:
+    """Parsed hashtag filter: a list of exact tags and prefixes joined by AND/OR"""
+
+    def __init__(self, exact: List[str], prefixes: List[str], match_all: bool = False):
+        self.exact = exact
+        self.prefixes = prefixes
+        self.match_all = match_all
+
+    def __bool__(self) -> bool:
+        return bool(self.exact or self.prefixes)
+
+
+def normalize_tag(tag: str) -> str:
+    return tag.strip().lstrip('#').lower()
+
+
+def parse_tag_query(raw: str, mode: str = 'any') -> TagQuery:
+    """
+    Parse a hashtag filter string such as "cats, #dogs fun*"
+    Terms are separated by commas or whitespace, a trailing '*' makes a prefix match
+    and mode 'all' requires every term to match instead of any of them
+    """
+    exact, prefixes = [], []
+    for term in re.split(r'[\s,]+', raw or ''):
+        if term.endswith('*'):
+            term = normalize_tag(term.rstrip('*'))
+            if term and term not in prefixes:
+                prefixes.append(term)
+        else:
+            term = normalize_tag(term)
+            if term and term not in exact:
+                exact.append(term)
+    return TagQuery(exact, prefixes, match_all=(mode or '').lower() == 'all')
+
+
+class HashtagIndex:
+    """
+    Inverted index from hashtag to video ids for one account and sort order.
+    Videos are appended in the order the upstream API returns them, so offsets
+    into a filtered result stay valid while more pages are added.
+    """
+
+    def __init__(self):
+        self.videos: Dict[str, VideoRecord] = {}
+        self.order: List[str] = []
+        self.positions: Dict[str, int] = {}
+        self.tags: Dict[str, Set[str]] = {}
+        self.sorted_tags: List[str] = []
+        self.upstream_cursor = 0
+        self.has_more = True
+        self.created_at = time.time()
+        self.lock = asyncio.Lock()
+
+    def add_page(self, page: Dict[str, Any]) -> int:
+        """Add a page returned by get_user_videos and advance the upstream cursor"""
+        added = 0
+        for video in page.get('videos', []):
+            video_id = video.id
+            if video_id in self.positions:
+                self.videos[video_id] = video
+                continue
+            self.positions[video_id] = len(self.order)
+            self.order.append(video_id)
+            self.videos[video_id] = video
+            for tag in video.hashtags:
+                tag = normalize_tag(tag)
+                if not tag:
+                    continue
+                if tag not in self.tags:
+                    self.tags[tag] = set()
+                    bisect.insort(self.sorted_tags, tag)
+                self.tags[tag].add(video_id)
+            added += 1
+
+        self.upstream_cursor = page.get('cursor', self.upstream_cursor)
+        self.has_more = bool(page.get('has_more', False))
+        return added
+
+    def _prefix_ids(self, prefix: str) -> Set[str]:
+        ids: Set[str] = set()
+        start = bisect.bisect_left(self.sorted_tags, prefix)
+        for tag in self.sorted_tags[start:]:
+            if not tag.startswith(prefix):
+                break
+            ids |= self.tags[tag]
+        return ids
+
+    def match(self, query: TagQuery) -> List[str]:
+        """Return ids of videos matching the query, in upstream order"""
+        term_sets = [self.tags.get(tag, set()) for tag in query.exact]
+        term_sets += [self._prefix_ids(prefix) for prefix in query.prefixes]
+        if not term_sets:
+            return list(self.order)
+
+        if query.match_all:
+            ids = set.intersection(*term_sets)
+        else:
+            ids = set().union(*term_sets)
+        return sorted(ids, key=self.positions.__getitem__)
+
+    def page(self, query: TagQuery, offset: int, limit: int) -> Tuple[List[VideoRecord], int, bool]:
+        """Slice a filtered page, returning (videos, next_cursor, has_more)"""
+        matches = self.match(query)
+        selected = matches[offset:offset + limit]
+        next_cursor = offset + len(selected)
+        has_more = next_cursor < len(matches) or self.has_more
+        return [self.videos[video_id] for video_id in selected], next_cursor, has_more
+
+
+class HashtagIndexRegistry:
+    """Holds one HashtagIndex per (account, sort type), expiring stale ones"""
+
+    def __init__(self, ttl: float = 600, max_indexes: int = 256):
+        self.ttl = ttl
+        self.max_indexes = max_indexes
+        self._indexes: "OrderedDict[Tuple[str, str], HashtagIndex]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, account: str, sort_type: str) -> HashtagIndex:
+        key = (account, sort_type)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None or time.time() - index.created_at > self.ttl:
+                index = HashtagIndex()
+                self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+            return index
+
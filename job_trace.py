@@ -0,0 +1,90 @@
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+
+
+class JobTrace:
+    """
+    Phase timing breakdown for one download job.
+    Durations come from time.monotonic() and accumulate, so a phase that runs
+    again on a retry adds to its earlier time.
+    """
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.created_at = time.time()
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self.phases: Dict[str, float] = {}
+        self.current_phase: Optional[str] = None
+        self.bytes = 0
+        self.retries = 0
+        self.status = 'queued'
+        self.error: Optional[str] = None
+        self.checksum: Optional[str] = None
+
+    def add(self, phase: str, seconds: float):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        previous = self.current_phase
+        self.current_phase = name
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add(name, time.monotonic() - started)
+            self.current_phase = previous
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self.finished = time.monotonic()
+        self.status = status
+        self.error = error
+        self.current_phase = None
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'created_at': self.created_at,
+            'elapsed': round(self.elapsed, 4),
+            'current_phase': self.current_phase,
+            'phases': {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            'bytes': self.bytes,
+            'retries': self.retries,
+            'error': self.error,
+            'checksum': self.checksum
+        }
+
+
+class TraceWriter:
+    """Appends a sample of finished job traces to a JSON-lines file"""
+
+    def __init__(self, path: Optional[str], sample_rate: float = 1.0):
+        self.path = path
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "TraceWriter":
+        return cls(os.getenv('TRACE_FILE'), float(os.getenv('TRACE_SAMPLE_RATE', 1.0)))
+
+    def write(self, trace: JobTrace):
+        if not self.path or random.random() >= self.sample_rate:
+            return
+        line = json.dumps(trace.to_dict()) + '\n'
+        with self._lock:
+            with open(self.path, 'a') as f:
+                f.write(line)
+
+
+trace_writer = TraceWriter.from_env()
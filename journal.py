@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+import time
+from typing import Dict, List, Optional
+
+from log import get_logger
+
+logger = get_logger('journal')
+
+# Job states in the order a download moves through them
+STATES = ('queued', 'resolved', 'downloading', 'done', 'failed')
+
+
+def replay(path: str) -> Dict[str, Dict]:
+    """Latest record per job key; a torn last line from a crash is ignored"""
+    states: Dict[str, Dict] = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                key = record.get('job')
+                if key:
+                    states[key] = {**states.get(key, {}), **record}
+    except FileNotFoundError:
+        pass
+    return states
+
+
+class Journal:
+    """
+    Append-only JSON-lines log of download job states.
+    Records are buffered and written plus fsynced in batches, every `flush_interval`
+    seconds or once `max_pending` records are waiting, so a crash loses at most the
+    last batch. With resume=True the existing journal is replayed and compacted.
+    """
+
+    def __init__(self, path: str, resume: bool = False, flush_interval: float = 1.0, max_pending: int = 256):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.states: Dict[str, Dict] = replay(path) if resume else {}
+        self._pending: List[str] = []
+        self._flush_lock = asyncio.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._file = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if resume:
+            self._compact()
+        self._file = open(path, 'a' if resume else 'w')
+
+    def _compact(self):
+        """Rewrite the journal as one line per job so resumed runs don't grow it forever"""
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w') as f:
+            for record in self.states.values():
+                f.write(json.dumps(record) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+
+    def record(self, key: str, state: str, **fields):
+        record = {'job': key, 'state': state, 'ts': round(time.time(), 3), **fields}
+        self.states[key] = {**self.states.get(key, {}), **record}
+        self._pending.append(json.dumps(record) + '\n')
+        if len(self._pending) >= self.max_pending:
+            asyncio.ensure_future(self.flush())
+
+    def state(self, key: str) -> Optional[str]:
+        record = self.states.get(key)
+        return record['state'] if record else None
+
+    def is_done(self, key: str) -> bool:
+        return self.state(key) == 'done'
+
+    def _write(self, lines: List[str]):
+        self._file.writelines(lines)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            lines, self._pending = self._pending, []
+            await asyncio.to_thread(self._write, lines)
+
+    async def _run_flusher(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except OSError as e:
+                logger.error("Could not write journal %s: %s", self.path, e)
+
+    def start(self):
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._run_flusher())
+
+    async def close(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+        self._file.close()
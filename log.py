@@ -0,0 +1,135 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+# Attributes every LogRecord has; anything else was passed through `extra` and is emitted as a field
+_STANDARD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+_configured = False
+_configure_lock = threading.Lock()
+_listener: Optional[logging.handlers.QueueListener] = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the message, level, logger and any extra fields"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage()
+        }
+        for key, value in vars(record).items():
+            if key not in _STANDARD_ATTRS and not key.startswith('_'):
+                data[key] = value
+        if record.exc_info:
+            data['exc'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a random fraction of records. The rate comes from a `sample_rate` extra
+    on the record, falling back to a per-level default (LOG_DEBUG_SAMPLE_RATE for DEBUG).
+    """
+
+    def __init__(self, level_rates: Optional[Dict[int, float]] = None):
+        super().__init__()
+        self.level_rates = level_rates or {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        rate = getattr(record, 'sample_rate', self.level_rates.get(record.levelno, 1.0))
+        return rate >= 1.0 or random.random() < rate
+
+
+class RepeatFilter(logging.Filter):
+    """
+    Rate-limits repeats of the same message template: at most `burst` records per
+    `interval` seconds per (logger, template), the next one reports how many were dropped.
+    """
+
+    def __init__(self, burst: int = 5, interval: float = 10.0, max_keys: int = 10000):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.max_keys = max_keys
+        self._windows: Dict[Tuple[str, str], list] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = (record.name, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                if len(self._windows) >= self.max_keys:
+                    self._windows.clear()
+                self._windows[key] = [now, 1, 0]
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+            return False
+
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Hands the record over untouched so message formatting happens on the listener thread"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def is_interactive() -> bool:
+    return sys.stderr.isatty() and os.getenv('LOG_FORMAT', '').lower() != 'json'
+
+
+def configure(level: Optional[str] = None, interactive: Optional[bool] = None):
+    """
+    Route the "tiktok" logger hierarchy through a queue drained by a background thread.
+    Interactive terminals get rich output, everything else gets JSON lines on stderr.
+    """
+    global _configured, _listener
+    with _configure_lock:
+        if _configured:
+            return
+        _configured = True
+
+        interactive = is_interactive() if interactive is None else interactive
+        if interactive:
+            from rich.logging import RichHandler
+            target: logging.Handler = RichHandler(markup=False, rich_tracebacks=False, show_path=False)
+        else:
+            target = logging.StreamHandler(sys.stderr)
+            target.setFormatter(JsonFormatter())
+
+        log_queue: queue.SimpleQueue = queue.SimpleQueue()
+        handler = _DeferredQueueHandler(log_queue)
+        handler.addFilter(SamplingFilter({logging.DEBUG: float(os.getenv('LOG_DEBUG_SAMPLE_RATE', 1.0))}))
+        handler.addFilter(RepeatFilter())
+
+        root = logging.getLogger('tiktok')
+        root.setLevel((level or os.getenv('LOG_LEVEL', 'INFO')).upper())
+        root.addHandler(handler)
+        root.propagate = False
+
+        _listener = logging.handlers.QueueListener(log_queue, target, respect_handler_level=True)
+        _listener.start()
+        atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    configure()
+    return logging.getLogger(f'tiktok.{name}')
@@ -5,6 +5,8 @@ from rich.console import Console
 from downloader import TikTokDownloader
 from utils import validate_urls
 from auth import TikTokAuth
+from token_store import TokenStore
+from journal import Journal
 
 console = Console()
 
@@ -14,8 +16,9 @@ async def main():
     # Check if we're in a non-interactive environment (like deployment)
     is_deployed = os.environ.get('REPLIT_DEPLOYMENT') == '1'
 
-    # Initialize auth
+    # Initialize auth, the token store renews tokens during long runs
     auth = TikTokAuth()
+    token_store = TokenStore(auth)
 
     # In deployment, we don't need the CLI interface
     if is_deployed:
@@ -36,7 +39,22 @@ async def main():
             console.print("[red]No valid URLs found. Exiting...[/red]")
             return
 
-        downloader = TikTokDownloader(access_token=access_token)
+        # With a refresh token the run can outlive the access token; its age is unknown, so renew up front
+        refresh_token = os.environ.get('REFRESH_TOKEN')
+        token_provider = None
+        if refresh_token:
+            account_id = token_store.save({
+                'access_token': access_token,
+                'refresh_token': refresh_token,
+                'expires_in': 0
+            })
+            token_provider = token_store.provider(account_id)
+
+        # Deployments restart mid-run, so pick up where the journal says the last run stopped
+        journal = Journal(os.path.join('downloads', '.journal.jsonl'), resume=True)
+        journal.start()
+        downloader = TikTokDownloader(access_token=access_token, token_provider=token_provider,
+                                      journal=journal, resume_partial=True)
         try:
             await downloader.download_videos(valid_urls)
         except KeyboardInterrupt:
@@ -45,6 +63,7 @@ async def main():
             console.print(f"[red]An error occurred: {str(e)}[/red]")
         finally:
             await downloader.cleanup()
+            await journal.close()
         return
 
 
@@ -79,6 +98,7 @@ async def main():
                     return
                 continue
 
+            account_id = token_store.save(token_data)
             break  # Successfully authenticated
 
         except Exception as e:
@@ -110,7 +130,7 @@ async def main():
         console.print("[red]No valid URLs found. Exiting...[/red]")
         return
 
-    downloader = TikTokDownloader(access_token=access_token)
+    downloader = TikTokDownloader(access_token=access_token, token_provider=token_store.provider(account_id))
     try:
         await downloader.download_videos(valid_urls)
     except KeyboardInterrupt:
@@ -121,4 +141,12 @@ async def main():
         await downloader.cleanup()
 
 if __name__ == "__main__":
+    # `python main.py batch ...` runs headless; see batch.py
+    if len(sys.argv) > 1 and sys.argv[1] == 'batch':
+        from batch import main as batch_main
+        sys.exit(batch_main(sys.argv[2:]))
+    # `python main.py export ...` writes the account's video metadata; see metadata_export.py
+    if len(sys.argv) > 1 and sys.argv[1] == 'export':
+        from metadata_export import main as export_main
+        sys.exit(export_main(sys.argv[2:]))
     asyncio.run(main())
\ No newline at end of file
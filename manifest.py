@@ -0,0 +1,60 @@
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterator, Tuple
+
+MANIFEST_NAME = 'manifest.jsonl'
+HASH_ALGORITHM = 'sha256'
+
+
+def hash_prefix(path: str, length: int, chunk_size: int = 1024 * 1024) -> Tuple["hashlib._Hash", int]:
+    """Hash the first `length` bytes of a file, to continue hashing a resumed partial download"""
+    hasher = hashlib.new(HASH_ALGORITHM)
+    hashed = 0
+    with open(path, 'rb') as f:
+        while hashed < length:
+            chunk = f.read(min(chunk_size, length - hashed))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            hashed += len(chunk)
+    return hasher, hashed
+
+
+class Manifest:
+    """
+    Append-only JSON-lines record of finished downloads: file, size, checksum and source URL.
+    Each entry is a single O_APPEND write, so shard processes can share one manifest.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def append(self, file: str, size: int, checksum: str, source_url: str, item: str):
+        entry = {
+            'file': os.path.basename(file),
+            'size': size,
+            HASH_ALGORITHM: checksum,
+            'source_url': source_url,
+            'input': item,
+            'ts': round(time.time(), 3)
+        }
+        line = (json.dumps(entry) + '\n').encode()
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line)
+        finally:
+            os.close(fd)
+
+    def entries(self) -> Iterator[Dict]:
+        """Latest entry per file is the last one; torn lines are skipped"""
+        try:
+            with open(self.path) as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue
+        except FileNotFoundError:
+            return
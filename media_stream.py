@@ -0,0 +1,141 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Optional
+
+READ_CHUNK_SIZE = 256 * 1024
+
+
+class StreamRestarted(Exception):
+    """The download started over from an earlier offset, so bytes already sent are stale"""
+
+
+class GrowingDownload:
+    """
+    A download in progress that HTTP clients can read while it is being written.
+    The downloader reports progress through on_start/on_data/on_finish; readers
+    follow the .part file and wait for more bytes until the download finishes.
+    """
+
+    def __init__(self, video_id: str, owner: Optional[str] = None):
+        self.video_id = video_id
+        self.owner = owner          # Account the download was started for
+        self.part_path: Optional[str] = None
+        self.path: Optional[str] = None
+        self.total_size: Optional[int] = None
+        self.written = 0
+        self.restarts = 0
+        self.done = False
+        self.error: Optional[str] = None
+        self._started = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        # Wake everyone waiting on the current event and hand out a fresh one
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    # Downloader callbacks
+
+    def on_start(self, part_path: str, path: str, offset: int, total_size: Optional[int]):
+        if offset < self.written:
+            self.restarts += 1
+        self.part_path = part_path
+        self.path = path
+        self.total_size = total_size
+        self.written = offset
+        self._started.set()
+        self._notify()
+
+    def on_data(self, written: int):
+        self.written = written
+        self._notify()
+
+    def on_finish(self, error: Optional[str] = None):
+        self.done = True
+        self.error = error
+        self._started.set()
+        self._finished.set()
+        self._notify()
+
+    # Reader side
+
+    async def wait_started(self):
+        """Wait for response headers; raises if the download failed before any bytes arrived"""
+        await self._started.wait()
+        if self.part_path is None:
+            raise RuntimeError(self.error or "Download failed")
+
+    async def wait_finished(self) -> Optional[str]:
+        """Wait for the download to end and return its error, if any"""
+        await self._finished.wait()
+        return self.error
+
+    def _open(self):
+        # The .part file is renamed once complete; an open handle survives the rename
+        try:
+            return open(self.part_path, 'rb')
+        except FileNotFoundError:
+            return open(self.path, 'rb')
+
+    async def read(self) -> AsyncIterator[bytes]:
+        await self.wait_started()
+        restarts = self.restarts
+        f = await asyncio.to_thread(self._open)
+        position = 0
+        try:
+            while True:
+                changed = self._changed
+                if self.restarts != restarts and position > self.written:
+                    raise StreamRestarted(f"Download of {self.video_id} restarted")
+                restarts = self.restarts
+                if position < self.written:
+                    data = await asyncio.to_thread(f.read, min(READ_CHUNK_SIZE, self.written - position))
+                    if data:
+                        position += len(data)
+                        yield data
+                        continue
+                if self.done:
+                    if self.error:
+                        raise RuntimeError(self.error)
+                    return
+                await changed.wait()
+        finally:
+            f.close()
+
+
+class MediaStreams:
+    """Downloads that are currently being streamed, one per video"""
+
+    def __init__(self):
+        self._active: Dict[str, GrowingDownload] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    def get(self, video_id: str) -> Optional[GrowingDownload]:
+        return self._active.get(video_id)
+
+    def start(self, video_id: str, run: Callable[[GrowingDownload], Awaitable],
+              owner: Optional[str] = None) -> GrowingDownload:
+        """Start `run(stream)` in the background unless the video is already streaming"""
+        stream = self._active.get(video_id)
+        if stream is not None:
+            return stream
+        stream = self._active[video_id] = GrowingDownload(video_id, owner)
+
+        async def runner():
+            try:
+                await run(stream)
+            except Exception as e:
+                stream.on_finish(str(e))
+            finally:
+                if not stream.done:
+                    stream.on_finish("Download stopped")
+                self._active.pop(video_id, None)
+                self._tasks.pop(video_id, None)
+
+        # Held here so the download keeps filling the store after the requester disconnects
+        self._tasks[video_id] = asyncio.create_task(runner())
+        return stream
+
+    def cancel_all(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
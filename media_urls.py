@@ -0,0 +1,103 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from metrics import CACHE_REQUESTS
+from log import get_logger
+
+logger = get_logger('media_urls')
+
+# Query parameters TikTok's CDNs use for the signature's expiry, in epoch seconds
+EXPIRY_PARAMS = ('x-expires', 'expire', 'expires')
+
+
+def url_expiry(url: str) -> Optional[float]:
+    """Expiry time embedded in a signed CDN URL, None if it has none"""
+    query = parse_qs(urlsplit(url).query)
+    for name in EXPIRY_PARAMS:
+        for value in query.get(name, ()):
+            try:
+                return float(value)
+            except ValueError:
+                continue
+    return None
+
+
+class MediaUrl:
+    """A resolved, signed video URL and the header profile the page was fetched with"""
+
+    def __init__(self, url: str, profile: str, expires_at: float):
+        self.url = url
+        self.profile = profile
+        self.expires_at = expires_at
+
+
+class MediaUrlCache:
+    """
+    Resolved CDN URLs per video, kept until shortly before their signature expires, so
+    retries and repeat downloads skip the page scrape and HEAD probes.
+    Concurrent lookups for the same video share one resolution.
+    """
+
+    def __init__(self, margin: float = 30, default_ttl: float = 300, max_entries: int = 10000):
+        self.margin = margin                # Evict this long before expiry, a download must start in time
+        self.default_ttl = default_ttl      # For URLs without an expiry parameter
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, MediaUrl]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def get(self, key: str) -> Optional[MediaUrl]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() >= entry.expires_at - self.margin:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: str, url: str, profile: str) -> MediaUrl:
+        expires_at = url_expiry(url) or time.time() + self.default_ttl
+        entry = MediaUrl(url, profile, expires_at)
+        if time.time() < expires_at - self.margin:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, key: str):
+        """Forget a URL the CDN has rejected"""
+        if self._entries.pop(key, None) is not None:
+            logger.debug("Dropped cached media URL for %s", key)
+
+    async def resolve(self, key: str, resolver: Callable[[], Awaitable[Optional[Tuple[str, str]]]]) -> Optional[MediaUrl]:
+        """Cached URL for `key`, or the result of `resolver()` returning (url, profile) or None"""
+        entry = self.get(key)
+        if entry is not None:
+            CACHE_REQUESTS.inc(cache='media_url', result='hit')
+            return entry
+
+        future = self._inflight.get(key)
+        if future is not None:
+            # Another job is already resolving this video
+            CACHE_REQUESTS.inc(cache='media_url', result='shared')
+            return await asyncio.shield(future)
+
+        CACHE_REQUESTS.inc(cache='media_url', result='miss')
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            resolved = await resolver()
+            if resolved:
+                entry = self.put(key, *resolved)
+            return entry
+        finally:
+            # Waiters get None when resolution failed or was cancelled, and retry on their own
+            future.set_result(entry)
+            del self._inflight[key]
+
+
+# Shared by every downloader in the process
+media_url_cache = MediaUrlCache()
@@ -0,0 +1,168 @@
+"""
+Whole-account metadata export, served by /export/metadata and run by `main.py export`.
+
+    python main.py export --format csv --output videos.csv
+    python main.py export --format ndjson --sort-type oldest > videos.ndjson
+
+Pages through get_user_videos with the next page already being fetched while the
+current one is written, and writes one row per video as NDJSON or CSV as each page
+arrives, so memory stays at about two pages however large the account is.
+ACCESS_TOKEN (and optionally REFRESH_TOKEN) are read from the environment.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import os
+import sys
+import time
+from typing import Any, AsyncIterator, Dict, List
+
+import fast_json
+from log import get_logger
+from video_record import VideoRecord
+
+logger = get_logger('metadata_export')
+
+FORMATS = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+CSV_FIELDS = ('id', 'title', 'create_time', 'created_at', 'likes', 'views', 'shares', 'hashtags', 'share_url', 'cover_url')
+PAGE_SIZE = 20      # The most /video/list/ returns per call
+
+EXIT_OK = 0
+EXIT_FAILED = 1     # the export stopped early, the output is incomplete
+EXIT_AUTH = 3
+
+
+def export_row(video: VideoRecord) -> Dict[str, Any]:
+    """Flat export record; create_time stays epoch seconds next to the formatted time"""
+    return {
+        'id': video.id,
+        'title': video.title,
+        'create_time': video.create_time,
+        'created_at': video.created_at,
+        'likes': video.likes,
+        'views': video.views,
+        'shares': video.shares,
+        'hashtags': list(video.hashtags),
+        'share_url': video.share_url,
+        'cover_url': video.cover_url
+    }
+
+
+def header(fmt: str) -> bytes:
+    return encode_rows([], fmt, with_header=True)
+
+
+def encode_rows(videos: List[VideoRecord], fmt: str, with_header: bool = False) -> bytes:
+    """One page of videos as NDJSON lines or CSV rows"""
+    if fmt == 'ndjson':
+        return b''.join(fast_json.dumps(export_row(video)) + b'\n' for video in videos)
+    out = io.StringIO()
+    writer = csv.writer(out)
+    if with_header:
+        writer.writerow(CSV_FIELDS)
+    for video in videos:
+        row = export_row(video)
+        row['hashtags'] = ' '.join(row['hashtags'])
+        writer.writerow([row[field] for field in CSV_FIELDS])
+    return out.getvalue().encode()
+
+
+async def iter_pages(downloader, sort_type: str = 'latest', page_size: int = PAGE_SIZE) -> AsyncIterator[List[VideoRecord]]:
+    """Every page of the account, fetching the next one while the caller handles the current one"""
+    def fetch(cursor):
+        return asyncio.create_task(downloader.get_user_videos(
+            max_count=page_size, cursor=cursor, sort_type=sort_type, raise_errors=True
+        ))
+
+    cursor = 0
+    pending = fetch(cursor)
+    try:
+        while pending is not None:
+            page = await pending
+            pending = None
+            # A cursor that doesn't move would page forever
+            if page['videos'] and page['has_more'] and page['cursor'] != cursor:
+                cursor = page['cursor']
+                pending = fetch(cursor)
+            if page['videos']:
+                yield page['videos']
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+
+async def stream_export(downloader, fmt: str, sort_type: str = 'latest') -> AsyncIterator[bytes]:
+    """Encoded export chunks, the header first and then one chunk per page"""
+    if fmt == 'csv':
+        yield header(fmt)
+    async for videos in iter_pages(downloader, sort_type):
+        yield encode_rows(videos, fmt)
+
+
+async def run_export(args: argparse.Namespace) -> int:
+    from batch import _token_provider
+    from downloader import TikTokDownloader
+
+    access_token = os.environ.get('ACCESS_TOKEN')
+    if not access_token:
+        logger.error("ACCESS_TOKEN is required to list the account's videos")
+        return EXIT_AUTH
+    try:
+        token_provider = _token_provider(access_token)
+    except Exception as e:
+        logger.error("Could not set up token refresh: %s", e)
+        return EXIT_AUTH
+
+    downloader = TikTokDownloader(access_token=access_token, token_provider=token_provider)
+    out = sys.stdout.buffer if args.output == '-' else open(args.output, 'wb')
+    started = time.monotonic()
+    rows = 0
+    try:
+        if args.format == 'csv':
+            out.write(header(args.format))
+        async for videos in iter_pages(downloader, args.sort_type, args.page_size):
+            out.write(encode_rows(videos, args.format))
+            out.flush()
+            rows += len(videos)
+            if not args.quiet:
+                sys.stderr.write(f"\r{rows} videos exported")
+        if not args.quiet:
+            sys.stderr.write(f"\r{rows} videos exported in {time.monotonic() - started:.1f}s\n")
+        return EXIT_OK
+    except Exception as e:
+        logger.error("Export stopped after %d videos: %s", rows, e)
+        return EXIT_FAILED
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+        await downloader.cleanup()
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        prog='main.py export',
+        description="Export the metadata of every video on the account as NDJSON or CSV.",
+        epilog="Exit codes: 0 exported, 1 stopped early (the output is incomplete), 2 usage error, "
+               "3 no ACCESS_TOKEN or token setup failed.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter
+    )
+    parser.add_argument('--format', '-f', choices=sorted(FORMATS), default='ndjson', help="output format")
+    parser.add_argument('--output', '-o', default='-', help="output file, - for stdout")
+    parser.add_argument('--sort-type', default='latest', choices=('latest', 'oldest', 'most_liked', 'most_viewed'),
+                        help="order the videos are listed in")
+    parser.add_argument('--page-size', type=int, default=PAGE_SIZE, help="videos per upstream request")
+    parser.add_argument('--quiet', '-q', action='store_true', help="no progress output")
+    return parser
+
+
+def main(argv=None) -> int:
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.page_size < 1:
+        parser.error("--page-size must be at least 1")
+    try:
+        return asyncio.run(run_export(args))
+    except KeyboardInterrupt:
+        sys.stderr.write("\nInterrupted, the output is incomplete\n")
+        return EXIT_FAILED
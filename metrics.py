@@ -0,0 +1,216 @@
+# Minimal Prometheus-compatible metrics, cheap enough to stay on in production.
+# render() produces the text exposition format served at /metrics.
+import bisect
+import math
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+THROUGHPUT_BUCKETS = (64e3, 256e3, 1e6, 2.5e6, 5e6, 10e6, 25e6, 50e6, 100e6)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Gauge(Counter):
+    type_name = 'gauge'
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(Metric):
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per label set: [count per bucket..., +Inf count], sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+            entry[0][index] += 1
+            entry[1][0] += value
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return sum(entry[0]) if entry else 0
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, list(counts), total[0]) for key, (counts, total) in self._values.items()]
+
+        lines = []
+        for key, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, ('le', _format_value(bound)))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return '\n'.join(metric.render() for metric in self._metrics) + '\n'
+
+
+registry = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Upstream calls, labelled by logical endpoint (video/list, page, cdn_head, cdn_get, oauth_token, ...)
+UPSTREAM_LATENCY = registry.register(Histogram(
+    'tiktok_upstream_request_duration_seconds',
+    'Time until response headers for upstream requests',
+    ('endpoint',)
+))
+UPSTREAM_REQUESTS = registry.register(Counter(
+    'tiktok_upstream_requests_total',
+    'Upstream requests by endpoint and status code',
+    ('endpoint', 'status')
+))
+UPSTREAM_RATE_LIMITED = registry.register(Counter(
+    'tiktok_upstream_429_total',
+    'Upstream responses with status 429',
+    ('endpoint',)
+))
+UPSTREAM_RETRIES = registry.register(Counter(
+    'tiktok_upstream_retries_total',
+    'Retried upstream requests',
+    ('endpoint',)
+))
+CIRCUIT_OPEN = registry.register(Counter(
+    'tiktok_upstream_circuit_open_total',
+    'Requests rejected because the host circuit breaker was open',
+    ('host',)
+))
+
+# Downloads
+DOWNLOAD_BYTES = registry.register(Counter(
+    'tiktok_download_bytes_total',
+    'Video bytes written to disk'
+))
+DOWNLOAD_THROUGHPUT = registry.register(Histogram(
+    'tiktok_download_throughput_bytes_per_second',
+    'Per-video transfer throughput',
+    buckets=THROUGHPUT_BUCKETS
+))
+DOWNLOADS = registry.register(Counter(
+    'tiktok_downloads_total',
+    'Finished video downloads by result',
+    ('result',)
+))
+RATE_LIMIT_STALL = registry.register(Histogram(
+    'tiktok_rate_limiter_stall_seconds',
+    'Time spent waiting in the downloader rate limiter'
+))
+
+# Web tier queue and caches
+QUEUE_DEPTH = registry.register(Gauge(
+    'tiktok_download_queue_depth',
+    'Videos waiting in the download queue by priority class',
+    ('priority',)
+))
+QUEUE_WAIT = registry.register(Histogram(
+    'tiktok_download_queue_wait_seconds',
+    'Time a queued video waited before a worker picked it up, by priority class',
+    ('priority',)
+))
+ADMISSIONS = registry.register(Counter(
+    'tiktok_download_admissions_total',
+    'Download requests by admission result (accepted, backlogged, queue_full, rate_limited)',
+    ('result',)
+))
+STORAGE_BYTES = registry.register(Gauge(
+    'tiktok_storage_used_bytes',
+    'Bytes of finished videos in the downloads directory'
+))
+STORAGE_EVICTIONS = registry.register(Counter(
+    'tiktok_storage_evictions_total',
+    'Videos removed from the downloads directory to stay under the quota'
+))
+CACHE_REQUESTS = registry.register(Counter(
+    'tiktok_cache_requests_total',
+    'Cache lookups by cache and result (hit, miss, stale, shared, prefetch)',
+    ('cache', 'result')
+))
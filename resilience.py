@@ -0,0 +1,201 @@
+import asyncio
+import random
+import time
+from typing import Dict, Iterable, Optional
+from urllib.parse import urlparse
+
+import aiohttp
+
+from metrics import CIRCUIT_OPEN, UPSTREAM_LATENCY, UPSTREAM_RATE_LIMITED, UPSTREAM_REQUESTS, UPSTREAM_RETRIES
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a host whose circuit breaker is open"""
+
+    def __init__(self, host: str, retry_in: float):
+        super().__init__(f"Circuit open for {host}, retry in {retry_in:.0f}s")
+        self.host = host
+        self.retry_in = retry_in
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one upstream host.
+    After failure_threshold failures the circuit opens and calls fail fast; once
+    reset_timeout has passed a single probe is let through to decide whether to close it.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self.probing:
+            self.probing = True
+            return True
+        return False
+
+    def retry_in(self) -> float:
+        if self.opened_at is None:
+            return 0
+        return max(0.0, self.reset_timeout - (time.monotonic() - self.opened_at))
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+
+class RetryBudget:
+    """
+    Token bucket that limits retries to a fraction of all requests.
+    Every request deposits `ratio` tokens and every retry withdraws one, with a small
+    per-second allowance so low-traffic periods can still retry.
+    """
+
+    def __init__(self, ratio: float = 0.2, min_per_second: float = 1.0, max_tokens: float = 100):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.updated_at = time.monotonic()
+
+    def _refill(self, amount: float = 0):
+        now = time.monotonic()
+        self.tokens = min(self.max_tokens, self.tokens + amount + (now - self.updated_at) * self.min_per_second)
+        self.updated_at = now
+
+    def record_request(self):
+        self._refill(self.ratio)
+
+    def try_acquire(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+def _retry_after(response: aiohttp.ClientResponse) -> Optional[float]:
+    value = response.headers.get('Retry-After')
+    if value and value.strip().isdigit():
+        return float(value)
+    return None
+
+
+class Resilience:
+    """
+    Shared policy for outbound requests: decorrelated-jitter backoff,
+    per-host circuit breakers and a global retry budget.
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 30,
+                 failure_threshold: int = 5, reset_timeout: float = 30,
+                 budget: Optional[RetryBudget] = None):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.budget = budget or RetryBudget()
+        self.breakers: Dict[str, CircuitBreaker] = {}
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        host = urlparse(url).hostname or ''
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def next_delay(self, previous: Optional[float] = None) -> float:
+        """Decorrelated jitter: sleep = min(cap, random(base, previous * 3))"""
+        previous = previous or self.base_delay
+        return min(self.max_delay, random.uniform(self.base_delay, previous * 3))
+
+    def can_retry(self) -> bool:
+        return self.budget.try_acquire()
+
+    async def request(self, session: aiohttp.ClientSession, method: str, url: str, *,
+                      endpoint: str = 'other',
+                      max_attempts: Optional[int] = None,
+                      retry_statuses: Iterable[int] = RETRY_STATUSES,
+                      **kwargs) -> aiohttp.ClientResponse:
+        """
+        Send a request through the host's circuit breaker, retrying connection errors
+        and retryable statuses while the retry budget allows.
+        The caller owns the returned response and should use it as `async with response:`
+        `endpoint` labels the request in the upstream latency metrics
+        """
+        max_attempts = max_attempts or self.max_attempts
+        breaker = self.breaker(url)
+        self.budget.record_request()
+        delay = None
+        attempt = 0
+
+        while True:
+            attempt += 1
+            if attempt > 1:
+                UPSTREAM_RETRIES.inc(endpoint=endpoint)
+            if not breaker.allow():
+                host = urlparse(url).hostname or url
+                CIRCUIT_OPEN.inc(host=host)
+                raise CircuitOpenError(host, breaker.retry_in())
+
+            retry_after = None
+            started = time.perf_counter()
+            try:
+                response = await session.request(method, url, **kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                UPSTREAM_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+                UPSTREAM_REQUESTS.inc(endpoint=endpoint, status='error')
+                breaker.record_failure()
+                if attempt >= max_attempts or not self.can_retry():
+                    raise
+            except BaseException:
+                # Cancelled mid-probe, let the next caller probe instead
+                breaker.probing = False
+                raise
+            else:
+                UPSTREAM_LATENCY.observe(time.perf_counter() - started, endpoint=endpoint)
+                UPSTREAM_REQUESTS.inc(endpoint=endpoint, status=response.status)
+                if response.status == 429:
+                    UPSTREAM_RATE_LIMITED.inc(endpoint=endpoint)
+                if response.status not in retry_statuses:
+                    breaker.record_success()
+                    return response
+                breaker.record_failure()
+                if attempt >= max_attempts or not self.can_retry():
+                    return response
+                retry_after = _retry_after(response)
+                response.release()
+
+            delay = self.next_delay(delay)
+            if retry_after is not None:
+                delay = min(self.max_delay, max(delay, retry_after))
+            await asyncio.sleep(delay)
+
+
+# Process-wide instance so every caller shares breakers and the retry budget
+upstream = Resilience()
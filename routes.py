@@ -1,115 +1,100 @@
-from flask import Blueprint, request, redirect, render_template_string, jsonify, session, url_for
+from quart import Blueprint, request, redirect, render_template, jsonify, session, url_for, current_app
 import os
-import time
-import asyncio
-from auth import TikTokAuth
-from rich.console import Console
+from log import get_logger
 
-console = Console()
+logger = get_logger('routes')
 static_pages = Blueprint('static_pages', __name__)
 auth_routes = Blueprint('auth', __name__, url_prefix='/auth')
 
 @auth_routes.route('/tiktok/callback')
-def tiktok_callback():
+async def tiktok_callback():
     """Handle TikTok OAuth2 callback"""
     code = request.args.get('code')
     state = request.args.get('state')
     error = request.args.get('error')
     error_description = request.args.get('error_description')
 
-    console.print(f"[blue]Callback URL accessed[/blue]")
-    console.print(f"[blue]Request host: {request.host}[/blue]")
-    console.print(f"[blue]Full URL: {request.url}[/blue]")
+    # The query string carries the authorization code, so only the host is logged
+    logger.debug("Callback URL accessed on host %s", request.host)
 
     # Don't verify domain in development mode
-    auth = TikTokAuth()
+    services = current_app.extensions['services']
+    auth, token_store = services.auth, services.token_store
     if os.getenv('DEVELOPMENT_MODE', 'true').lower() == 'false':
         if not auth.verify_request_domain(request.host):
-            return render_template_string("""
-                <h1>Domain Error</h1>
-                <p>Please access this application through the correct domain.</p>
-            """)
+            return await render_template(
+                'message.html',
+                title='Domain Error',
+                paragraphs=['Please access this application through the correct domain.']
+            )
 
     if error:
-        console.print(f"[red]OAuth error: {error} - {error_description}[/red]")
-        return render_template_string("""
-            <h1>Authentication Error</h1>
-            <p>Error: {{ error }}</p>
-            <p>Description: {{ error_description }}</p>
-            <p><a href="/">Try Again</a></p>
-        """, error=error, error_description=error_description)
+        logger.warning("OAuth error: %s - %s", error, error_description)
+        return await render_template(
+            'message.html',
+            title='Authentication Error',
+            paragraphs=[f'Error: {error}', f'Description: {error_description}'],
+            link_url='/',
+            link_text='Try Again'
+        )
 
     if not code:
-        console.print("[red]No authorization code provided in callback[/red]")
-        return render_template_string("""
-            <h1>Authentication Error</h1>
-            <p>No authorization code was provided. Please try again.</p>
-            <p><a href="/">Return to Home</a></p>
-        """)
+        logger.warning("No authorization code provided in callback")
+        return await render_template(
+            'message.html',
+            title='Authentication Error',
+            paragraphs=['No authorization code was provided. Please try again.'],
+            link_url='/',
+            link_text='Return to Home'
+        )
 
     try:
-        auth = TikTokAuth()
-        console.print("[blue]Attempting to get access token...[/blue]")
-
         # Get access token
-        token_data = asyncio.run(auth.get_access_token(code))
+        token_data = await auth.get_access_token(code)
 
         if not token_data:
-            console.print("[red]Failed to get access token - token_data is None[/red]")
-            return render_template_string("""
-                <h1>Authentication Failed</h1>
-                <p>Could not get access token. Please try again.</p>
-                <p><a href="/">Return to Home</a></p>
-            """)
+            logger.error("Failed to get access token - token_data is None")
+            return await render_template(
+                'message.html',
+                title='Authentication Failed',
+                paragraphs=['Could not get access token. Please try again.'],
+                link_url='/',
+                link_text='Return to Home'
+            )
 
         if 'access_token' not in token_data:
-            console.print("[red]Failed to get access token - no access_token in response[/red]")
-            return render_template_string("""
-                <h1>Authentication Failed</h1>
-                <p>Invalid token response. Please try again.</p>
-                <p><a href="/">Return to Home</a></p>
-            """)
+            logger.error("Failed to get access token - no access_token in response")
+            return await render_template(
+                'message.html',
+                title='Authentication Failed',
+                paragraphs=['Invalid token response. Please try again.'],
+                link_url='/',
+                link_text='Return to Home'
+            )
 
-        # Store in session
-        session['access_token'] = token_data['access_token']
-        session['token_expiry'] = time.time() + token_data.get('expires_in', 3600)
+        # Tokens stay server-side, the cookie session only identifies the account
+        session['account_id'] = token_store.save(token_data)
 
-        console.print("[green]Successfully obtained and stored access token[/green]")
+        logger.info("Successfully obtained and stored access token")
 
         #Instead of redirecting, return a success message or data.  Consider a JSON response for AJAX.
         return jsonify({"message": "Authentication successful"})
 
 
     except Exception as e:
-        console.print(f"[red]Authentication error: {str(e)}[/red]")
-        return render_template_string("""
-            <h1>Authentication Error</h1>
-            <p>An error occurred during authentication: {{ error }}</p>
-            <p><a href="/">Try Again</a></p>
-        """, error=str(e))
+        logger.exception("Authentication error")
+        return await render_template(
+            'message.html',
+            title='Authentication Error',
+            paragraphs=[f'An error occurred during authentication: {str(e)}'],
+            link_url='/',
+            link_text='Try Again'
+        )
 
 @static_pages.route('/privacy')
-def privacy():
-    return render_template_string("""
-        <h1>Privacy Policy</h1>
-        <p>Your privacy is important to us...</p>
-    """)
+async def privacy():
+    return await render_template('privacy.html')
 
 @static_pages.route('/terms')
-def terms_of_service():
-    return render_template_string("""
-        <h1>Terms of Service for FetchTok</h1>
-        <p>Last updated: February 10, 2025</p>
-
-        <p>By using our service, you agree to these terms:</p>
-
-        <h2>Service Usage</h2>
-        <ul>
-            <li>You may only download videos you have rights to access</li>
-            <li>You agree to comply with TikTok's terms of service</li>
-            <li>You will not use the service for any illegal purposes</li>
-        </ul>
-
-        <h2>Disclaimer</h2>
-        <p>The service is provided "as is" without warranties of any kind.</p>
-    """)
\ No newline at end of file
+async def terms_of_service():
+    return await render_template('terms.html')
@@ -0,0 +1,105 @@
+import asyncio
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+PRIORITIES = ('interactive', 'bulk')
+
+
+class SchedulerFull(Exception):
+    """Raised by FairScheduler.put_nowait when the scheduler or the user's share of it is full"""
+
+    def __init__(self, message: str, user_limited: bool):
+        super().__init__(message)
+        self.user_limited = user_limited
+
+
+class FairScheduler:
+    """
+    Download queue with one sub-queue per (user, priority class), served by deficit
+    round-robin. Each visit to a sub-queue hands out jobs up to its class weight, so a
+    user with one queued video waits for at most one round no matter how long another
+    user's batch is, and interactive selections outpace bulk syncs without starving them.
+    """
+
+    def __init__(self, capacity: int = 1000, per_user_capacity: int = 200,
+                 weights: Optional[Dict[str, int]] = None):
+        self.capacity = capacity
+        self.per_user_capacity = per_user_capacity
+        self.weights = weights or {'interactive': 4, 'bulk': 1}
+        self._flows: Dict[Tuple[str, str], Deque[Any]] = {}
+        self._deficits: Dict[Tuple[str, str], int] = {}
+        self._active: Deque[Tuple[str, str]] = deque()
+        self._user_depth: Dict[str, int] = {}
+        self._class_depth: Dict[str, int] = {priority: 0 for priority in self.weights}
+        self._size = 0
+        self._ready = asyncio.Event()
+
+    def qsize(self, priority: Optional[str] = None) -> int:
+        return self._size if priority is None else self._class_depth.get(priority, 0)
+
+    def user_depth(self, user: str) -> int:
+        return self._user_depth.get(user, 0)
+
+    def active_users(self) -> int:
+        """Users with videos waiting, who take turns at the workers"""
+        return len(self._user_depth)
+
+    def check(self, user: str, count: int = 1):
+        """Raise SchedulerFull unless `count` more jobs from `user` fit"""
+        if self._size + count > self.capacity:
+            raise SchedulerFull("Download queue is full", user_limited=False)
+        if self.user_depth(user) + count > self.per_user_capacity:
+            raise SchedulerFull(f"At most {self.per_user_capacity} videos can be queued per user", user_limited=True)
+
+    def put_nowait(self, user: str, job: Any, priority: str = 'interactive'):
+        if priority not in self.weights:
+            raise ValueError(f"Unknown priority class {priority!r}")
+        self.check(user)
+
+        key = (user, priority)
+        flow = self._flows.get(key)
+        if flow is None:
+            # A newly active sub-queue joins the end of the round with a full quantum
+            flow = self._flows[key] = deque()
+            self._deficits[key] = self.weights[priority]
+            self._active.append(key)
+        flow.append(job)
+        self._user_depth[user] = self.user_depth(user) + 1
+        self._class_depth[priority] += 1
+        self._size += 1
+        self._ready.set()
+
+    def get_nowait(self) -> Any:
+        if not self._size:
+            raise asyncio.QueueEmpty()
+        while True:
+            key = self._active[0]
+            if self._deficits[key] < 1:
+                # Quantum used up, top it up and pass the turn on
+                self._deficits[key] += self.weights[key[1]]
+                self._active.rotate(-1)
+                continue
+
+            self._deficits[key] -= 1
+            flow = self._flows[key]
+            job = flow.popleft()
+            if not flow:
+                # Idle sub-queues leave the round and don't bank credit
+                self._active.popleft()
+                del self._flows[key]
+                del self._deficits[key]
+
+            user, priority = key
+            self._user_depth[user] -= 1
+            if not self._user_depth[user]:
+                del self._user_depth[user]
+            self._class_depth[priority] -= 1
+            self._size -= 1
+            if not self._size:
+                self._ready.clear()
+            return job
+
+    async def get(self) -> Any:
+        while not self._size:
+            await self._ready.wait()
+        return self.get_nowait()
@@ -1,88 +1,265 @@
 import asyncio
+import math
 import os
 from datetime import datetime, timedelta
-from flask import Flask, render_template_string, request, redirect, url_for, jsonify, session, Response
-from flask_cors import CORS
+from quart import Blueprint, Quart, current_app, render_template, request, jsonify, session, Response, send_file
+from quart_cors import cors
+from werkzeug.local import LocalProxy
 from routes import static_pages, auth_routes
-from auth import TikTokAuth
-from downloader import TikTokDownloader
-import threading
-from collections import deque
-from queue import Queue
+from hashtag_index import parse_tag_query
+from assets import AssetManifest
+from job_trace import JobTrace
+import metadata_export
+from admission import Rejected
+from scheduler import PRIORITIES, SchedulerFull
+from services import Services
+from storage import HeldFileBody
+from video_pages import VideoPage
+import fast_json
+import metrics
 import time
-from rich.console import Console
+from log import get_logger
 
-console = Console()
-app = Flask(__name__)
-app.secret_key = os.urandom(24)
+# aiohttp, the downloader and the auth client are imported by Services when serving starts
+# and rich only when a progress message is formatted, so importing this module and building
+# the app stay cheap. benchmarks/import_time.py keeps an eye on that.
+
+logger = get_logger('server')
+web = Blueprint('web', __name__)
 
 # Set domain for production
 PRODUCTION_DOMAIN = os.getenv('TIKTOK_BASE_DOMAIN', 'app.tiktokrescue.online')
 is_development = os.getenv('DEVELOPMENT_MODE', 'true').lower() == 'true'
 
+# Static assets are fingerprinted and compressed once, templates are compiled once
+ASSET_MAX_AGE = 365 * 24 * 3600
+
+# Each app built by create_app() has its own Services: subsystems built on first use plus
+# the download status tables, see services.py. Routes, and the tasks they and startup()
+# create, reach the running app's through this proxy.
+services = LocalProxy(lambda: current_app.extensions['services'])
+UPSTREAM_CONNECTION_LIMIT = int(os.getenv('UPSTREAM_CONNECTION_LIMIT', 1000))
+
+# Rate limiting and queue management. Whether a batch fits is decided by how fast the
+# workers are draining the queue, see admission.py
+MAX_VIDEOS_PER_REQUEST = int(os.getenv('MAX_VIDEOS_PER_REQUEST', 50))
+DOWNLOADS_PER_HOUR = int(os.getenv('DOWNLOADS_PER_HOUR', 200))  # Per account
+INTERACTIVE_MAX_VIDEOS = int(os.getenv('INTERACTIVE_MAX_VIDEOS', 5))  # Larger selections are scheduled as bulk
+
+INDEX_PAGE_SIZE = 20
+MAX_INDEX_FETCHES = 10
+COVER_MAX_AGE = 24 * 3600
+
+
+def create_app() -> Quart:
+    """Build the Quart app. Subsystems are constructed when serving starts, not here"""
+    app = Quart(__name__)
+    app.secret_key = os.urandom(24)
+    app.before_request(verify_domain)
+    app.before_serving(startup)
+    app.after_serving(shutdown)
+
+    asset_manifest = AssetManifest(app.static_folder)
+    app.extensions['asset_manifest'] = asset_manifest
+    app.extensions['services'] = Services()
+    app.jinja_env.globals['asset_url'] = asset_manifest.url
+    app.jinja_env.auto_reload = is_development
+    for template_name in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template_name)
+
+    app.register_blueprint(web)
+    app.register_blueprint(static_pages)
+    app.register_blueprint(auth_routes, url_prefix='/auth')
+
+    # Set up CORS for production domain
+    allowed_origins = [f"https://{PRODUCTION_DOMAIN}"]
+    return cors(app, allow_origin="*" if is_development else allowed_origins)
+
+
+_app = None
+
+
+def __getattr__(name):
+    # Keeps `server:app` working for ASGI servers and scripts, built on first access
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
 # Domain verification middleware
-@app.before_request
-def verify_domain():
+async def verify_domain():
     # Only verify in production mode
     if not is_development:
         if request.path == '/.well-known/tiktok-domain-verification.txt':
             return Response('tiktok-developers-site-verification=Hl2FLqA7XY2ryMlN8E6Fv8vtwqJCflZR', mimetype='text/plain')
 
         if request.host != PRODUCTION_DOMAIN:
-            return render_template_string("""
-                <h1>Domain Error</h1>
-                <p>Please access this application through https://app.tiktokrescue.online</p>
-            """)
+            return await render_template(
+                'message.html',
+                title='Domain Error',
+                paragraphs=['Please access this application through https://app.tiktokrescue.online']
+            )
     return None
 
-# Set up CORS for production domain
-allowed_origins = [f"https://{PRODUCTION_DOMAIN}"]
-if is_development:
-    allowed_origins.append("*")
-
-CORS(app, resources={r"/*": {"origins": allowed_origins}})
-
-# Register blueprints
-app.register_blueprint(static_pages)
-app.register_blueprint(auth_routes, url_prefix='/auth')
-
-# Initialize TikTok Auth
-auth = TikTokAuth()
-
-# Rate limiting and queue management
-download_queue = Queue(maxsize=5)
-user_downloads = {}
-download_status = {}
-
-def process_download_queue():
+@web.route('/assets/<path:filename>')
+async def get_asset(filename):
+    asset = current_app.extensions['asset_manifest'].lookup(filename)
+    if asset is None:
+        return jsonify({"error": "Asset not found"}), 404
+
+    headers = {
+        'Cache-Control': f'public, max-age={ASSET_MAX_AGE}, immutable',
+        'ETag': f'"{asset.etag}"',
+        'Vary': 'Accept-Encoding'
+    }
+    if asset.etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    body, encoding = asset.negotiate(request.headers.get('Accept-Encoding', ''))
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(body, mimetype=asset.mimetype, headers=headers)
+
+class StatusProgress:
+    """Adapts the rich Progress calls made by TikTokDownloader to a download_status entry"""
+
+    def __init__(self, status):
+        self.status = status
+        self.completed = 0
+        self.total = None
+
+    def add_task(self, description, total=None):
+        self.total = total
+        return 0
+
+    def update(self, task_id, total=None, advance=None, description=None):
+        if total is not None:
+            self.total = total
+        if advance:
+            self.completed += advance
+        if self.total:
+            self.status['progress'] = min(100, int(self.completed * 100 / self.total))
+        if description:
+            from rich.text import Text
+            self.status['message'] = Text.from_markup(description).plain
+
+NOT_OWNED = "Video is not in this account's library"
+
+def _media_path(video_id):
+    return os.path.join('downloads', f'tiktok_{video_id}.mp4')
+
+async def _owns_video(account_id, video_id, joinable=True):
+    """
+    Whether the video is in the account's library. All accounts share one store, so files
+    and downloads in progress record the accounts they belong to; anything else is looked
+    up with the account's own token, which only finds the account's own videos.
+    """
+    from downloader import TikTokDownloader
+
+    filename = _media_path(video_id)
+    if services.storage.owns(filename, account_id):
+        return True
+    stream = services.media_streams.get(video_id)
+    if joinable and stream is not None and stream.owner == account_id:
+        return True
+    downloader = TikTokDownloader(session=services.http_session,
+                                  token_provider=services.token_store.provider(account_id))
+    if await downloader.get_video_share_url(video_id) is None:
+        return False
+    services.storage.add_owner(filename, account_id)
+    return True
+
+def start_download(video_id, account_id, trace, verified=False):
+    """
+    Download a video into the store, or join the download already running for it.
+    Unless the caller has `verified` that the account owns the video, that is checked first:
+    resolved media URLs are cached for every account, so resolving alone doesn't prove it.
+    """
+    from downloader import TikTokDownloader
+
+    stream = services.media_streams.get(video_id)
+    if stream is not None:
+        return stream
+    status = services.download_status.set(account_id, video_id, {'status': 'downloading', 'progress': 0, 'trace': trace})
+
+    async def run(stream):
+        # Counted here so downloads started by /media are admitted against the same throughput
+        services.admission.started()
+        started = time.monotonic()
+        try:
+            # This download's own stream already names the account, so it doesn't count
+            if not verified and not await _owns_video(account_id, video_id, joinable=False):
+                trace.finish('failed', NOT_OWNED)
+                status.update({'status': 'failed', 'error': NOT_OWNED})
+                stream.on_finish(NOT_OWNED)
+                return
+            downloader = TikTokDownloader(
+                session=services.http_session,
+                token_provider=services.token_store.provider(account_id),
+                rate_limiter=services.page_rate_limiter
+            )
+            await downloader._download_single_video(video_id, StatusProgress(status), trace, observer=stream)
+            if trace.status == 'completed':
+                filename = downloader._job_filename(video_id)
+                services.storage.add(filename, os.path.getsize(filename), owner=account_id)
+                status.update({'status': 'completed', 'progress': 100})
+            else:
+                status.update({'status': 'failed', 'error': trace.error})
+        except Exception as e:
+            logger.exception("Download worker failed on %s", video_id)
+            trace.finish('failed', str(e))
+            status.update({'status': 'failed', 'error': str(e)})
+            raise
+        finally:
+            services.admission.finished(time.monotonic() - started)
+
+    return services.media_streams.start(video_id, run, owner=account_id)
+
+def _update_queue_depth():
+    for priority in PRIORITIES:
+        metrics.QUEUE_DEPTH.set(services.download_queue.qsize(priority), priority=priority)
+
+async def process_download_queue():
     while True:
-        if not download_queue.empty():
-            user_id, video_url = download_queue.get()
-            try:
-                downloader = TikTokDownloader(access_token=session.get('access_token'))
-                download_status[video_url] = {'status': 'downloading', 'progress': 0}
-
-                # Update progress as download starts
-                download_status[video_url]['progress'] = 25
-                time.sleep(1)  # Simulate download progress
-
-                # Update progress midway
-                download_status[video_url]['progress'] = 50
-                time.sleep(1)
-
-                # Final progress update
-                download_status[video_url] = {'status': 'completed', 'progress': 100}
-            except Exception as e:
-                download_status[video_url] = {'status': 'failed', 'error': str(e)}
-            finally:
-                download_queue.task_done()
-        time.sleep(1)
-
-# Start queue processor
-threading.Thread(target=process_download_queue, daemon=True).start()
-
-@app.route('/')
-def index():
+        # Leave jobs queued while the disk or the quota is nearly full
+        await services.storage.wait_for_headroom()
+        video_id, account_id, trace, priority = await services.download_queue.get()
+        started = time.monotonic()
+        wait = started - trace.started
+        trace.add('queue', wait)
+        _update_queue_depth()
+        metrics.QUEUE_WAIT.observe(wait, priority=priority)
+        try:
+            joined = services.media_streams.get(video_id) is not None
+            stream = start_download(video_id, account_id, trace)
+            error = await stream.wait_finished()
+            if joined:
+                # A /media request had already started this download
+                trace.finish('failed' if error else 'completed', error)
+                services.download_status.set(account_id, video_id, {
+                    'status': trace.status, 'progress': 100 if not error else 0, 'error': error, 'trace': trace
+                })
+        except Exception:
+            logger.exception("Download worker failed on %s", video_id)
+
+async def startup():
+    """Build the subsystems and shared state on the serving event loop, before the first request"""
+    os.makedirs("downloads", exist_ok=True)
+    services.warm_up()
+    services.open_session(UPSTREAM_CONNECTION_LIMIT)
+    for _ in range(services.admission.workers):
+        services.background_tasks.append(asyncio.create_task(process_download_queue()))
+    services.background_tasks.append(asyncio.create_task(services.token_store.run_refresher()))
+    services.background_tasks.append(asyncio.create_task(services.storage.run_evictor()))
+
+async def shutdown():
+    await services.close()
+
+@web.route('/')
+async def index():
     try:
         # Check if we're in bypass mode
         bypass_mode = os.getenv('BYPASS_AUTH', 'false').lower() == 'true'
@@ -94,475 +271,415 @@ def index():
             deployment_url = f"https://{repl_slug}.{repl_owner}.repl.co"
             verification_callback = f"{deployment_url}/auth/tiktok/callback"
 
-            return render_template_string("""
-                <!DOCTYPE html>
-                <html>
-                <head>
-                    <title>TikTok Domain Verification</title>
-                    <meta name="viewport" content="width=device-width, initial-scale=1">
-                    <style>
-                        body {
-                            font-family: system-ui, -apple-system, sans-serif;
-                            max-width: 800px;
-                            margin: 20px auto;
-                            padding: 20px;
-                            line-height: 1.6;
-                        }
-                        .container {
-                            background: #f5f5f5;
-                            padding: 20px;
-                            border-radius: 8px;
-                            margin-top: 20px;
-                        }
-                        code {
-                            background: #e0e0e0;
-                            padding: 2px 6px;
-                            border-radius: 4px;
-                        }
-                        .step {
-                            margin-bottom: 20px;
-                        }
-                    </style>
-                </head>
-                <body>
-                    <h1>TikTok Domain Verification Setup</h1>
-
-                    <div class="container">
-                        <h2>Current Redirect URI</h2>
-                        <code>{{ redirect_uri }}</code>
-                        <p>Use this URL in your TikTok Developer Portal setup.</p>
-                    </div>
-
-                    <h2>Steps for Domain Verification:</h2>
-
-                    <div class="step">
-                        <h3>1. TikTok Developer Portal Setup</h3>
-                        <ul>
-                            <li>Go to the <a href="https://developers.tiktok.com/" target="_blank">TikTok Developer Portal</a></li>
-                            <li>Add the above Redirect URI to your application settings</li>
-                        </ul>
-                    </div>
-
-                    <div class="step">
-                        <h3>2. Domain Configuration</h3>
-                        <ul>
-                            <li>Copy the TXT record provided by TikTok</li>
-                            <li>Go to your domain provider's DNS settings</li>
-                            <li>Add a new TXT record with the value from TikTok</li>
-                            <li>Wait for DNS propagation (can take up to 48 hours)</li>
-                        </ul>
-                    </div>
-
-                    <div class="step">
-                        <h3>3. Complete Verification</h3>
-                        <ul>
-                            <li>Return to TikTok Developer Portal</li>
-                            <li>Click "Verify Domain"</li>
-                            <li>Once verified, set BYPASS_AUTH=false in your environment variables</li>
-                            <li>Add your TikTok API credentials to the environment variables</li>
-                        </ul>
-                    </div>
-                </body>
-                </html>
-            """, redirect_uri=auth.redirect_uri)
+            return await render_template('verify.html', redirect_uri=services.auth.redirect_uri)
 
         # Regular auth flow 
-        is_authenticated = bool(session.get('access_token'))
-        auth_url = None if is_authenticated else auth.get_auth_url()
-
-        return render_template_string("""
-            <!DOCTYPE html>
-            <html>
-            <head>
-                <title>TikTok Video Downloader</title>
-                <meta name="viewport" content="width=device-width, initial-scale=1">
-                <style>
-                    :root {
-                        --primary-color: #00f2ea;
-                        --secondary-color: #ff0050;
-                        --background-color: #f5f5f5;
-                    }
-                    body {
-                        font-family: 'Inter', Arial, sans-serif;
-                        max-width: 800px;
-                        margin: 0 auto;
-                        padding: 20px;
-                        background-color: var(--background-color);
-                    }
-                    .container {
-                        background-color: white;
-                        padding: 2rem;
-                        border-radius: 12px;
-                        box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-                    }
-                    .header {
-                        text-align: center;
-                        margin-bottom: 2rem;
-                    }
-                    .download-form {
-                        display: flex;
-                        flex-direction: column;
-                        gap: 1rem;
-                    }
-                    .url-input {
-                        padding: 0.75rem;
-                        border: 2px solid #ddd;
-                        border-radius: 6px;
-                        font-size: 1rem;
-                    }
-                    .order-select {
-                        padding: 0.75rem;
-                        border: 2px solid #ddd;
-                        border-radius: 6px;
-                        font-size: 1rem;
-                        background-color: white;
-                    }
-                    .queue-status {
-                        margin-top: 2rem;
-                        padding: 1rem;
-                        background-color: #f8f9fa;
-                        border-radius: 6px;
-                    }
-                    .progress-container {
-                        margin-top: 1rem;
-                    }
-                    .progress-bar {
-                        height: 10px;
-                        background-color: #ddd;
-                        border-radius: 5px;
-                        overflow: hidden;
-                    }
-                    .progress-fill {
-                        height: 100%;
-                        background-color: var(--primary-color);
-                        width: 0%;
-                        transition: width 0.3s ease;
-                    }
-                    .login-btn {
-                        display: inline-block;
-                        background-color: var(--primary-color);
-                        color: black;
-                        padding: 12px 24px;
-                        text-decoration: none;
-                        border-radius: 6px;
-                        font-weight: bold;
-                        transition: all 0.3s ease;
-                    }
-                    .login-btn:hover {
-                        background-color: var(--secondary-color);
-                        color: white;
-                        transform: translateY(-2px);
-                    }
-                    .rate-limit-info {
-                        margin-top: 1rem;
-                        font-size: 0.9rem;
-                        color: #666;
-                    }
-                    .video-grid {
-                        display: grid;
-                        grid-template-columns: repeat(auto-fill, minmax(200px, 1fr));
-                        gap: 1rem;
-                        margin-top: 2rem;
-                    }
-                    .video-card {
-                        background: white;
-                        border-radius: 8px;
-                        overflow: hidden;
-                        box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-                        position: relative;
-                    }
-                    .video-thumbnail {
-                        width: 100%;
-                        aspect-ratio: 9/16;
-                        object-fit: cover;
-                    }
-                    .video-info {
-                        padding: 0.5rem;
-                    }
-                    .video-title {
-                        font-size: 0.9rem;
-                        margin: 0;
-                        overflow: hidden;
-                        text-overflow: ellipsis;
-                        white-space: nowrap;
-                    }
-                    .video-stats {
-                        font-size: 0.8rem;
-                        color: #666;
-                        margin-top: 0.25rem;
-                    }
-                    .video-select {
-                        position: absolute;
-                        top: 0.5rem;
-                        right: 0.5rem;
-                        width: 1.2rem;
-                        height: 1.2rem;
-                    }
-                    .filters {
-                        display: flex;
-                        gap: 1rem;
-                        margin: 1rem 0;
-                        flex-wrap: wrap;
-                    }
-                    .filter-select {
-                        padding: 0.5rem;
-                        border: 1px solid #ddd;
-                        border-radius: 4px;
-                        background: white;
-                    }
-                    .selected-count {
-                        position: fixed;
-                        bottom: 1rem;
-                        right: 1rem;
-                        background: var(--primary-color);
-                        color: black;
-                        padding: 0.5rem 1rem;
-                        border-radius: 2rem;
-                        box-shadow: 0 2px 4px rgba(0,0,0,0.2);
-                    }
-                    .hashtag-filter {
-                        flex: 1;
-                        min-width: 200px;
-                    }
-                </style>
-                <script>
-                    let selectedVideos = new Set();
-
-                    function updateSelectedCount() {
-                        const counter = document.getElementById('selected-count');
-                        if (!counter) return;
-
-                        counter.textContent = `${selectedVideos.size}/5 Selected`;
-
-                        // Disable checkboxes if limit reached
-                        const checkboxes = document.querySelectorAll('.video-select');
-                        checkboxes.forEach(cb => {
-                            if (!cb.checked && selectedVideos.size >= 5) {
-                                cb.disabled = true;
-                            } else {
-                                cb.disabled = false;
-                            }
-                        });
-                    }
-
-                    function loadVideos(cursor = 0) {
-                        const sortType = document.getElementById('sort-type')?.value || 'latest';
-                        const viewRange = document.getElementById('view-range')?.value || 5;
-                        const hashtag = document.getElementById('hashtag-filter')?.value || '';
-
-                        fetch(`/videos?cursor=${cursor}&sort_type=${sortType}&max_count=${viewRange}&hashtag=${hashtag}`, {
-                            credentials: 'include'  // Include session cookies
-                        })
-                        .then(response => {
-                            if (response.status === 401) {
-                                window.location.reload();  // Reload if unauthorized
-                                return;
-                            }
-                            return response.json();
-                        })
-                        .then(data => {
-                            if (!data) return;
-
-                            const grid = document.getElementById('video-grid');
-                            if (!grid) return;
-
-                            grid.innerHTML = data.videos.map(video => `
-                                <div class="video-card">
-                                    <img src="${video.cover_url}" class="video-thumbnail" alt="${video.title}">
-                                    <input type="checkbox" class="video-select" 
-                                           onchange="toggleVideo('${video.id}', this)"
-                                           ${selectedVideos.has(video.id) ? 'checked' : ''}>
-                                    <div class="video-info">
-                                        <p class="video-title">${video.title}</p>
-                                        <p class="video-stats">
-                                            👍 ${video.stats.likes} • 👀 ${video.stats.views}
-                                        </p>
-                                    </div>
-                                </div>
-                            `).join('');
-
-                            // Update load more button
-                            const loadMoreBtn = document.getElementById('load-more');
-                            if (loadMoreBtn) {
-                                loadMoreBtn.style.display = data.has_more ? 'block' : 'none';
-                                loadMoreBtn.onclick = () => loadVideos(data.cursor);
-                            }
-                        });
-                    }
-
-                    // Only initialize the video loading if user is authenticated
-                    if ({{ is_authenticated|tojson }}) {
-                        document.addEventListener('DOMContentLoaded', () => {
-                            loadVideos();
-                            updateSelectedCount();
-                        });
-                    }
-                </script>
-            </head>
-            <body>
-                <div class="container">
-                    <div class="header">
-                        <h1>TikTok Video Downloader</h1>
-                        {% if not is_authenticated %}
-                            <p>Please authenticate with TikTok to start downloading videos</p>
-                            <a href="{{ auth_url }}" class="login-btn">Login with TikTok</a>
-                        {% else %}
-                            <p>Select videos from your profile to download</p>
-
-                            <div class="filters">
-                                <select id="sort-type" class="filter-select" onchange="loadVideos()">
-                                    <option value="latest">Latest First</option>
-                                    <option value="oldest">Oldest First</option>
-                                    <option value="most_liked">Most Liked</option>
-                                    <option value="most_viewed">Most Viewed</option>
-                                </select>
-
-                                <select id="view-range" class="filter-select" onchange="loadVideos()">
-                                    <option value="5">Show 5</option>
-                                    <option value="10">Show 10</option>
-                                    <option value="20">Show 20</option>
-                                    <option value="30">Show 30</option>
-                                    <option value="40">Show 40</option>
-                                </select>
-
-                                <input type="text" id="hashtag-filter" 
-                                       class="filter-select hashtag-filter" 
-                                       placeholder="Filter by hashtag"
-                                       onchange="loadVideos()">
-                            </div>
-
-                            <div id="video-grid" class="video-grid">
-                                <!-- Videos will be loaded here -->
-                            </div>
-
-                            <button id="load-more" class="login-btn" style="display: none; margin: 2rem auto;">
-                                Load More
-                            </button>
-
-                            <div class="queue-status">
-                                <h3>Download Status</h3>
-                                <div id="queue-status">Queue: 0/5 videos</div>
-                                <div class="progress-container">
-                                    <div class="progress-bar">
-                                        <div id="current-progress" class="progress-fill"></div>
-                                    </div>
-                                </div>
-                            </div>
-
-                            <button onclick="downloadSelected()" class="login-btn" style="margin-top: 1rem;">
-                                Download Selected Videos
-                            </button>
-
-                            <div id="selected-count" class="selected-count">0/5 Selected</div>
-                        {% endif %}
-                    </div>
-                </div>
-            </body>
-            </html>
-        """, auth_url=auth_url, is_authenticated=is_authenticated)
+        is_authenticated = services.token_store.has(session.get('account_id'))
+        auth_url = None if is_authenticated else services.auth.get_auth_url()
+
+        return await render_template('index.html', auth_url=auth_url, is_authenticated=is_authenticated,
+                                     max_videos=MAX_VIDEOS_PER_REQUEST)
     except Exception as e:
-        app.logger.error(f"Error rendering index page: {str(e)}")
+        logger.exception("Error rendering index page")
         return f"An error occurred: {str(e)}", 500
 
-@app.route('/videos')
-def get_videos():
-    # Check session for access token
-    access_token = session.get('access_token')
+def _page_response(page):
+    """A /videos page with its ETag, 304 when the client already has it, gzipped when accepted"""
+    headers = {
+        'ETag': f'"{page.etag}"',
+        'Cache-Control': 'private, no-cache',
+        'Vary': 'Accept-Encoding, Cookie'
+    }
+    if page.etag in request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    body, encoding = page.negotiate(request.headers.get('Accept-Encoding', ''))
+    if encoding:
+        headers['Content-Encoding'] = encoding
+    return Response(body, mimetype='application/json', headers=headers)
+
+def _remember_covers(videos, account_id):
+    for video in videos:
+        services.cover_cache.remember(video.id, video.cover_url, account_id)
+
+
+async def _fetch_filtered_videos(downloader, index, query, offset, max_count, sort_type):
+    """Grow the hashtag index until the requested filtered page is full or the account is exhausted"""
+    fetches = 0
+    while index.has_more and fetches < MAX_INDEX_FETCHES:
+        if len(index.match(query)) >= offset + max_count:
+            break
+        page = await downloader.get_user_videos(
+            max_count=INDEX_PAGE_SIZE,
+            cursor=index.upstream_cursor,
+            sort_type=sort_type
+        )
+        if not page['videos']:
+            # get_user_videos reports upstream errors as an empty page, so don't mark the index exhausted
+            break
+        index.add_page(page)
+        fetches += 1
+    metrics.CACHE_REQUESTS.inc(cache='hashtag_index', result='hit' if fetches == 0 else 'miss')
+    return index.page(query, offset, max_count)
+
+@web.route('/videos')
+async def get_videos():
+    # Check session for a stored account token
+    account_id = session.get('account_id')
+    access_token = await services.token_store.get_access_token(account_id) if account_id else None
     if not access_token:
         return jsonify({"error": "Authentication required"}), 401
 
     cursor = request.args.get('cursor', 0, type=int)
     sort_type = request.args.get('sort_type', 'latest')
     max_count = request.args.get('max_count', 30, type=int)
-    hashtag = request.args.get('hashtag', '')
+    query = parse_tag_query(request.args.get('hashtag', ''), request.args.get('tag_mode', 'any'))
 
     try:
-        downloader = TikTokDownloader(access_token=access_token)
-        videos = asyncio.run(downloader.get_user_videos(
-            max_count=max_count,
-            cursor=cursor,
-            sort_type=sort_type
-        ))
+        from downloader import TikTokDownloader
+        downloader = TikTokDownloader(
+            access_token=access_token,
+            session=services.http_session,
+            token_provider=services.token_store.provider(account_id)
+        )
+        index = services.hashtag_indexes.get(account_id, sort_type)
+
+        if query:
+            # Filtered queries page through the index; the cursor is an offset into the matches
+            async with index.lock:
+                videos, next_cursor, has_more = await _fetch_filtered_videos(
+                    downloader, index, query, cursor, max_count, sort_type
+                )
+            _remember_covers(videos, account_id)
+            return _page_response(VideoPage({"videos": videos, "cursor": next_cursor, "has_more": has_more}))
+
+        def fetch_page(page_cursor):
+            return lambda: downloader.get_user_videos(max_count=max_count, cursor=page_cursor, sort_type=sort_type)
+
+        page = await services.video_pages.fetch((account_id, sort_type, cursor, max_count), fetch_page(cursor))
+        videos = page.payload
+        _remember_covers(videos['videos'], account_id)
+
+        # Feed sequential pages into the index so later filtered queries start warm
+        async with index.lock:
+            if videos['videos'] and cursor == index.upstream_cursor and index.has_more:
+                index.add_page(videos)
+
+        # "Load More" asks for the next page next, have it cached by then
+        if videos['videos'] and videos['has_more']:
+            next_key = (account_id, sort_type, videos['cursor'], max_count)
+            services.video_pages.prefetch(next_key, fetch_page(videos['cursor']))
+
+        return _page_response(page)
+    except Exception:
+        logger.exception("Error fetching videos")
+        return jsonify({"error": "Failed to fetch videos"}), 500
 
-        # Filter by hashtag if provided
-        if hashtag:
-            videos['videos'] = [
-                video for video in videos['videos']
-                if hashtag.lower() in [tag.lower() for tag in video.get('hashtags', [])]
-            ]
+@web.route('/export/metadata')
+async def export_metadata():
+    """
+    Stream the metadata of every video on the account as NDJSON or CSV. Rows go out as each
+    upstream page arrives, with the next page already being fetched, so a large account
+    never sits in memory.
+    """
+    account_id = session.get('account_id')
+    access_token = await services.token_store.get_access_token(account_id) if account_id else None
+    if not access_token:
+        return jsonify({"error": "Authentication required"}), 401
+    fmt = request.args.get('format', 'ndjson').lower()
+    if fmt not in metadata_export.FORMATS:
+        return jsonify({"error": f"format must be one of {', '.join(sorted(metadata_export.FORMATS))}"}), 400
+
+    from downloader import TikTokDownloader
+    downloader = TikTokDownloader(
+        access_token=access_token,
+        session=services.http_session,
+        token_provider=services.token_store.provider(account_id)
+    )
+    chunks = metadata_export.stream_export(downloader, fmt, request.args.get('sort_type', 'latest'))
+
+    async def body():
+        try:
+            async for chunk in chunks:
+                yield chunk
+        except Exception as e:
+            # The status line is long gone; NDJSON readers get a final error record, CSV just ends early
+            logger.exception("Metadata export for %s stopped early", account_id)
+            if fmt == 'ndjson':
+                yield fast_json.dumps({'error': 'Export incomplete', 'message': str(e)}) + b'\n'
+
+    headers = {
+        'Content-Disposition': f'attachment; filename="tiktok_videos.{fmt}"',
+        'Cache-Control': 'no-store'
+    }
+    response = Response(body(), mimetype=metadata_export.FORMATS[fmt], headers=headers)
+    response.timeout = None
+    return response
+
+@web.route('/cover/<video_id>')
+async def get_cover(video_id):
+    # Covers come from users' own libraries, some of them private, and the cache is shared
+    account_id = session.get('account_id')
+    if not services.token_store.has(account_id):
+        return jsonify({'error': 'Authentication required'}), 401
+    if not services.cover_cache.owns(video_id, account_id):
+        return jsonify({"error": "Cover not found"}), 404
+
+    for _ in range(2):
+        entry = await services.cover_cache.get(video_id, services.http_session)
+        if entry is None:
+            return jsonify({"error": "Cover not found"}), 404
+
+        headers = {
+            'Cache-Control': f'private, max-age={COVER_MAX_AGE}',
+            'ETag': f'"{entry.etag}"'
+        }
+        if entry.etag in request.if_none_match:
+            return Response(status=304, headers=headers)
+
+        try:
+            body = await asyncio.to_thread(entry.read)
+        except FileNotFoundError:
+            # Evicted while being read, the next get() fetches it again
+            continue
+        return Response(body, mimetype=entry.content_type, headers=headers)
+    return jsonify({"error": "Cover not found"}), 404
+
+@web.route('/media/<video_id>')
+async def stream_media(video_id):
+    """
+    Serve a downloaded video. One that isn't in the store yet is downloaded and streamed
+    to the client as the CDN bytes arrive; other requests for it read the same growing file.
+    """
+    account_id = session.get('account_id')
+    if not services.token_store.has(account_id):
+        return jsonify({'error': 'Authentication required'}), 401
+    if not video_id.isdigit():
+        return jsonify({'error': 'Invalid video id'}), 400
 
-        return jsonify(videos)
+    try:
+        if not await _owns_video(account_id, video_id):
+            return jsonify({'error': 'Video not found'}), 404
     except Exception as e:
-        app.logger.error(f"Error fetching videos: {str(e)}")
-        return jsonify({"error": "Failed to fetch videos"}), 500
+        logger.warning("Could not look up video %s: %s", video_id, e)
+        return jsonify({'error': 'Video lookup failed'}), 502
+
+    storage = services.storage
+    stream = services.media_streams.get(video_id)
+    filename = _media_path(video_id)
+    if stream is None and os.path.exists(filename):
+        # Held until the body is sent so eviction can't remove the file mid-response
+        storage.touch(filename)
+        storage.acquire(filename)
+        try:
+            response = await send_file(filename, mimetype='video/mp4', conditional=True)
+        except Exception:
+            storage.release(filename)
+            raise
+        response.response = HeldFileBody(response.response, storage, filename)
+        # A large file to a slow client outlasts RESPONSE_TIMEOUT, which Quart ends silently
+        response.timeout = None
+        return response
+    if stream is None:
+        # Counts against the same hourly cap and worker throughput as a queued download
+        current_time = datetime.now()
+        limited = _hourly_limit(account_id, 1, current_time)
+        if limited is not None:
+            return limited
+        download_queue = services.download_queue
+        try:
+            services.admission.admit(download_queue.qsize(), 1, download_queue.user_depth(account_id),
+                                     download_queue.active_users())
+        except Rejected as e:
+            metrics.ADMISSIONS.inc(result='backlogged')
+            return jsonify({
+                'error': 'Queue is full',
+                'message': f'{e}, please try again in {_minutes(e.retry_after)}'
+            }), 429, {'Retry-After': str(e.retry_after)}
+        if not await storage.make_room():
+            return jsonify({'error': 'Storage full', 'message': 'Please try again in a few minutes'}), 503, {'Retry-After': '60'}
+        services.user_downloads[account_id].append(current_time)
+        stream = start_download(video_id, account_id, JobTrace(video_id), verified=True)
+
+    try:
+        await stream.wait_started()
+    except RuntimeError as e:
+        return jsonify({'error': 'Download failed', 'message': str(e)}), 502
+
+    # A stream that breaks off midway ends short of Content-Length, so clients can tell
+    headers = {'Content-Length': str(stream.total_size)} if stream.total_size is not None else {}
+    response = Response(stream.read(), mimetype='video/mp4', headers=headers)
+    response.timeout = None
+    return response
+
+@web.route('/media/<video_id>/pin', methods=['POST', 'DELETE'])
+async def pin_media(video_id):
+    """Pin a downloaded video so quota eviction keeps it, or unpin it"""
+    account_id = session.get('account_id')
+    if not services.token_store.has(account_id):
+        return jsonify({'error': 'Authentication required'}), 401
+    if not video_id.isdigit():
+        return jsonify({'error': 'Invalid video id'}), 400
+    try:
+        if not await _owns_video(account_id, video_id):
+            return jsonify({'error': 'Video not downloaded'}), 404
+    except Exception as e:
+        logger.warning("Could not look up video %s: %s", video_id, e)
+        return jsonify({'error': 'Video lookup failed'}), 502
+    pinned = request.method == 'POST'
+    if not services.storage.pin(f'tiktok_{video_id}.mp4', pinned):
+        return jsonify({'error': 'Video not downloaded'}), 404
+    return jsonify({'video_id': video_id, 'pinned': pinned})
+
+def _minutes(seconds):
+    minutes = max(1, math.ceil(seconds / 60))
+    return f"{minutes} minute{'s' if minutes != 1 else ''}"
+
+def _hourly_limit(account_id, count, current_time):
+    """429 response when `count` more downloads would take the account over DOWNLOADS_PER_HOUR, else None"""
+    # Keep only downloads from last hour, oldest first
+    download_times = [t for t in services.user_downloads.get(account_id, []) if current_time - t < timedelta(hours=1)]
+    services.user_downloads[account_id] = download_times
+    excess = len(download_times) + count - DOWNLOADS_PER_HOUR
+    if excess <= 0:
+        return None
+    # Room opens up as the oldest downloads in the window age out; a batch bigger than the
+    # whole cap is told when the window starts emptying rather than after its newest entry
+    if not download_times:
+        frees_at = current_time
+    elif excess <= len(download_times):
+        frees_at = download_times[excess - 1]
+    else:
+        frees_at = download_times[0]
+    retry_after = frees_at + timedelta(hours=1) - current_time
+    metrics.ADMISSIONS.inc(result='rate_limited')
+    return jsonify({
+        'error': 'Rate limit exceeded',
+        'message': f'Please try again in {_minutes(retry_after.total_seconds())}'
+    }), 429, {'Retry-After': str(max(1, math.ceil(retry_after.total_seconds())))}
 
-@app.route('/download', methods=['POST'])
-def queue_download():
+@web.route('/download', methods=['POST'])
+async def queue_download():
     try:
-        data = request.get_json()
+        account_id = session.get('account_id')
+
+        if not services.token_store.has(account_id):
+            return jsonify({'error': 'Authentication required'}), 401
+
+        data = await request.get_json(silent=True)
+        if not isinstance(data, dict):
+            return jsonify({'error': 'Invalid request body'}), 400
         video_ids = data.get('video_ids', [])
-        user_id = request.remote_addr
 
         if not video_ids:
             return jsonify({'error': 'No videos selected'}), 400
 
-        if len(video_ids) > 5:
-            return jsonify({'error': 'Maximum 5 videos can be selected'}), 400
+        # Only ids from the user's own library; the downloader would fetch anything given as a URL
+        if not isinstance(video_ids, list) or not all(isinstance(v, str) and v.isdigit() for v in video_ids):
+            return jsonify({'error': 'Invalid video id'}), 400
+
+        if len(video_ids) > MAX_VIDEOS_PER_REQUEST:
+            return jsonify({'error': f'Maximum {MAX_VIDEOS_PER_REQUEST} videos can be selected'}), 400
+
+        # Small selections from the page are interactive; big ones and syncs that ask for it are bulk
+        bulk = data.get('priority') == 'bulk' or len(video_ids) > INTERACTIVE_MAX_VIDEOS
+        priority = 'bulk' if bulk else 'interactive'
 
         # Check rate limit
         current_time = datetime.now()
-        if user_id in user_downloads:
-            download_times = user_downloads[user_id]
-            # Keep only downloads from last hour
-            download_times = [t for t in download_times if current_time - t < timedelta(hours=1)]
-            if len(download_times) >= 5:
-                remaining_time = (download_times[0] + timedelta(hours=1) - current_time)
-                return jsonify({
-                    'error': 'Rate limit exceeded',
-                    'message': f'Please try again in {int(remaining_time.total_seconds() / 60)} minutes'
-                }), 429
-            user_downloads[user_id] = download_times
-        else:
-            user_downloads[user_id] = []
-
-        # Add to queue if not full
-        if download_queue.qsize() + len(video_ids) <= 5:
-            for video_id in video_ids:
-                download_queue.put((user_id, video_id))
-                user_downloads[user_id].append(current_time)
+        limited = _hourly_limit(account_id, len(video_ids), current_time)
+        if limited is not None:
+            return limited
+
+        # Add to the account's sub-queue if it has room and the workers can get through
+        # the batch within the admission window, all videos or none
+        download_queue = services.download_queue
+        admission = services.admission
+        user_queued = download_queue.user_depth(account_id)
+        try:
+            download_queue.check(account_id, len(video_ids))
+            estimate = admission.admit(download_queue.qsize(), len(video_ids), user_queued,
+                                       download_queue.active_users())
+        except SchedulerFull as e:
+            if e.user_limited:
+                excess = user_queued + len(video_ids) - download_queue.per_user_capacity
+                retry_after = admission.drain_time(excess, download_queue.active_users())
+            else:
+                retry_after = admission.drain_time(download_queue.qsize() + len(video_ids) - download_queue.capacity)
+            metrics.ADMISSIONS.inc(result='queue_full')
             return jsonify({
-                'message': 'Videos added to queue',
-                'queue_position': download_queue.qsize()
-            })
-        else:
+                'error': 'Queue is full',
+                'message': f'{e}, please try again in {_minutes(retry_after)}'
+            }), 429, {'Retry-After': str(max(1, math.ceil(retry_after)))}
+        except Rejected as e:
+            metrics.ADMISSIONS.inc(result='backlogged')
             return jsonify({
                 'error': 'Queue is full',
-                'message': 'Please try again in a few minutes'
-            }), 429
-    except Exception as e:
-        app.logger.error(f"Download queue error: {str(e)}")
+                'message': f'{e}, please try again in {_minutes(e.retry_after)}'
+            }), 429, {'Retry-After': str(e.retry_after)}
+
+        for video_id in video_ids:
+            trace = JobTrace(video_id)
+            services.download_status.set(account_id, video_id, {'status': 'queued', 'progress': 0, 'trace': trace})
+            download_queue.put_nowait(account_id, (video_id, account_id, trace, priority), priority)
+            services.user_downloads[account_id].append(current_time)
+        _update_queue_depth()
+        metrics.ADMISSIONS.inc(result='accepted')
+        return jsonify({
+            'message': 'Videos added to queue',
+            'priority': priority,
+            'queue_position': download_queue.user_depth(account_id),
+            'queue_size': download_queue.qsize(),
+            **estimate.to_dict()
+        }), 202
+    except Exception:
+        logger.exception("Download queue error")
         return jsonify({'error': 'Internal server error'}), 500
 
-@app.route('/status')
-def get_status():
+@web.route('/status')
+async def get_status():
+    account_id = session.get('account_id')
+    if not services.token_store.has(account_id):
+        return jsonify({'error': 'Authentication required'}), 401
+
+    # Only the account's own downloads, each with its per-phase timing breakdown
+    # (queue, resolve, scrape, probe, transfer, disk, ...)
+    statuses = services.download_status.for_account(account_id)
+    downloads = {
+        video_id: {**status, 'trace': status['trace'].to_dict()} if 'trace' in status else status
+        for video_id, status in statuses.items()
+    }
     return jsonify({
-        'queue_size': download_queue.qsize(),
+        'queue_size': services.download_queue.qsize(),
         'current_download': next(
             ({"status": status['status'], "progress": status['progress']}
-             for status in download_status.values()
+             for status in statuses.values()
              if status['status'] in ['downloading', 'completed']),
             None
         ),
-        'downloads': download_status
+        'downloads': downloads,
+        'storage': services.storage.stats(),
+        'admission': services.admission.stats()
     })
 
+@web.route('/metrics')
+async def get_metrics():
+    _update_queue_depth()
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
 
 if __name__ == '__main__':
+    app = create_app()
     # Get port from environment or use 8080 as default (changed from 3000)
     port = int(os.environ.get('PORT', 8080))
 
     # Use production configuration when deployed
     if os.getenv('REPLIT_DEPLOYMENT') == '1':
-        app.run(host='0.0.0.0', port=port, debug=False)
+        from hypercorn.asyncio import serve
+        from hypercorn.config import Config
+
+        config = Config()
+        config.bind = [f"0.0.0.0:{port}"]
+        asyncio.run(serve(app, config))
     else:
-        app.run(host='0.0.0.0', port=port, debug=True)
\ No newline at end of file
+        app.run(host='0.0.0.0', port=port, debug=True)
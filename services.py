@@ -0,0 +1,143 @@
+"""
+Server subsystems, built on first use.
+
+Importing the server used to construct TikTokAuth, the token store, the storage index and
+the caches, and to pull in aiohttp and rich, before the app could even be created. Services
+holds them as cached properties instead: each one is imported and constructed the first time
+a request or the serving startup touches it. The serving startup calls warm_up() before
+the first connection is accepted, so requests never pay for it and scripts that only
+need the app (or a test client) never build what they don't use.
+"""
+import asyncio
+import os
+import time
+from functools import cached_property
+
+from log import get_logger
+
+logger = get_logger('services')
+
+# The subsystems warm_up() builds, cheapest first
+WARM_UP = ('download_queue', 'download_status', 'admission', 'page_rate_limiter', 'media_streams', 'hashtag_indexes', 'video_pages',
+           'cover_cache', 'storage', 'auth', 'token_store')
+
+
+class Services:
+    """Lazily constructed state of one app, shared by its routes and background tasks"""
+
+    def __init__(self):
+        self.http_session = None    # Created on the serving event loop by open_session()
+        self.background_tasks = []
+        self.user_downloads = {}    # Recent download times per account, for the hourly cap
+
+    @cached_property
+    def auth(self):
+        from auth import TikTokAuth
+        return TikTokAuth()
+
+    @cached_property
+    def token_store(self):
+        from token_store import TokenStore
+        return TokenStore(self.auth)
+
+    @cached_property
+    def download_queue(self):
+        # Users get a fair share of the workers rather than a small global cap, see scheduler.py
+        from scheduler import FairScheduler
+        return FairScheduler(
+            capacity=int(os.getenv('DOWNLOAD_QUEUE_CAPACITY', 1000)),
+            per_user_capacity=int(os.getenv('DOWNLOAD_QUEUE_PER_USER', 200))
+        )
+
+    @cached_property
+    def download_status(self):
+        # What /status reports for each account's downloads
+        from download_status import DownloadStatusTable
+        return DownloadStatusTable(keep_finished=int(os.getenv('DOWNLOAD_STATUS_KEEP', 50)))
+
+    @cached_property
+    def admission(self):
+        # Download workers and how long a batch may take to get through them
+        from admission import AdmissionController
+        return AdmissionController(
+            workers=int(os.getenv('DOWNLOAD_WORKERS', 2)),
+            max_wait=float(os.getenv('DOWNLOAD_MAX_WAIT', 900))
+        )
+
+    @cached_property
+    def page_rate_limiter(self):
+        # One spacing of TikTok page scrapes for every download the app runs
+        from downloader import RateLimiter
+        return RateLimiter()
+
+    @cached_property
+    def media_streams(self):
+        # Downloads in progress, joinable by /media requests while they are being written
+        from media_stream import MediaStreams
+        return MediaStreams()
+
+    @cached_property
+    def storage(self):
+        # Byte quota for finished videos, least recently used ones are evicted
+        from storage import StorageManager
+        return StorageManager(
+            directory='downloads',
+            quota_bytes=int(os.getenv('STORAGE_QUOTA_MB', 5120)) * 1024 * 1024,
+            min_headroom=int(os.getenv('STORAGE_MIN_HEADROOM_MB', 200)) * 1024 * 1024
+        )
+
+    @cached_property
+    def hashtag_indexes(self):
+        # Per-account hashtag indexes for filtered browsing
+        from hashtag_index import HashtagIndexRegistry
+        return HashtagIndexRegistry()
+
+    @cached_property
+    def video_pages(self):
+        # Recently served and prefetched /videos pages
+        from video_pages import VideoPageCache
+        return VideoPageCache(ttl=float(os.getenv('VIDEO_PAGE_CACHE_TTL', 60)))
+
+    @cached_property
+    def cover_cache(self):
+        # Local cache for cover thumbnails, signed CDN URLs expire
+        from cover_cache import CoverCache
+        return CoverCache(
+            directory=os.getenv('COVER_CACHE_DIR', 'cache/covers'),
+            max_bytes=int(os.getenv('COVER_CACHE_MAX_MB', 200)) * 1024 * 1024
+        )
+
+    def built(self, name: str) -> bool:
+        """Whether a subsystem has been constructed yet"""
+        return name in self.__dict__
+
+    def open_session(self, connection_limit: int):
+        """Shared upstream HTTP session, created on the serving event loop"""
+        import aiohttp
+        from downloader import TikTokDownloader
+        self.http_session = aiohttp.ClientSession(
+            headers=TikTokDownloader.mobile_headers,
+            connector=aiohttp.TCPConnector(limit=connection_limit)
+        )
+        return self.http_session
+
+    def warm_up(self):
+        """Build every subsystem that hasn't been built yet"""
+        started = time.monotonic()
+        for name in WARM_UP:
+            getattr(self, name)
+        logger.debug("Services warmed up in %.3fs", time.monotonic() - started)
+
+    async def close(self):
+        for task in self.background_tasks:
+            task.cancel()
+        self.background_tasks.clear()
+        if self.built('media_streams'):
+            self.media_streams.cancel_all()
+        if self.built('video_pages'):
+            self.video_pages.cancel_all()
+        if self.built('storage'):
+            await asyncio.to_thread(self.storage.save)
+        if self.http_session:
+            await self.http_session.close()
+            self.http_session = None
@@ -0,0 +1,72 @@
+let selectedVideos = new Set();
+const maxVideos = parseInt(document.body?.dataset.maxVideos, 10) || 5;  // MAX_VIDEOS_PER_REQUEST
+
+function updateSelectedCount() {
+    const counter = document.getElementById('selected-count');
+    if (!counter) return;
+
+    counter.textContent = `${selectedVideos.size}/${maxVideos} Selected`;
+
+    // Disable checkboxes if limit reached
+    const checkboxes = document.querySelectorAll('.video-select');
+    checkboxes.forEach(cb => {
+        if (!cb.checked && selectedVideos.size >= maxVideos) {
+            cb.disabled = true;
+        } else {
+            cb.disabled = false;
+        }
+    });
+}
+
+function loadVideos(cursor = 0) {
+    const sortType = document.getElementById('sort-type')?.value || 'latest';
+    const viewRange = document.getElementById('view-range')?.value || 5;
+    const hashtag = document.getElementById('hashtag-filter')?.value || '';
+
+    fetch(`/videos?cursor=${cursor}&sort_type=${sortType}&max_count=${viewRange}&hashtag=${encodeURIComponent(hashtag)}`, {
+        credentials: 'include'  // Include session cookies
+    })
+    .then(response => {
+        if (response.status === 401) {
+            window.location.reload();  // Reload if unauthorized
+            return;
+        }
+        return response.json();
+    })
+    .then(data => {
+        if (!data) return;
+
+        const grid = document.getElementById('video-grid');
+        if (!grid) return;
+
+        grid.innerHTML = data.videos.map(video => `
+            <div class="video-card">
+                <img src="/cover/${video.id}" class="video-thumbnail" alt="${video.title}" loading="lazy">
+                <input type="checkbox" class="video-select" 
+                       onchange="toggleVideo('${video.id}', this)"
+                       ${selectedVideos.has(video.id) ? 'checked' : ''}>
+                <div class="video-info">
+                    <p class="video-title">${video.title}</p>
+                    <p class="video-stats">
+                        👍 ${video.stats.likes} • 👀 ${video.stats.views}
+                    </p>
+                </div>
+            </div>
+        `).join('');
+
+        // Update load more button
+        const loadMoreBtn = document.getElementById('load-more');
+        if (loadMoreBtn) {
+            loadMoreBtn.style.display = data.has_more ? 'block' : 'none';
+            loadMoreBtn.onclick = () => loadVideos(data.cursor);
+        }
+    });
+}
+
+// Only initialize the video loading if user is authenticated
+document.addEventListener('DOMContentLoaded', () => {
+    if (document.body.dataset.authenticated === 'true') {
+        loadVideos();
+        updateSelectedCount();
+    }
+});
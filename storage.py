@@ -0,0 +1,275 @@
+import asyncio
+import json
+import os
+import shutil
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Set
+
+from manifest import MANIFEST_NAME, Manifest
+from metrics import STORAGE_BYTES, STORAGE_EVICTIONS
+from log import get_logger
+
+logger = get_logger('storage')
+
+INDEX_NAME = '.storage_index.json'
+
+
+class StoredFile:
+    """A finished download tracked by StorageManager, with the accounts it was downloaded for"""
+
+    __slots__ = ('size', 'last_access', 'pinned', 'owners')
+
+    def __init__(self, size: int, last_access: float, pinned: bool = False, owners: Iterable[str] = ()):
+        self.size = size
+        self.last_access = last_access
+        self.pinned = pinned
+        self.owners: Set[str] = set(owners)
+
+
+class StorageManager:
+    """
+    Keeps the downloads directory under a byte quota by evicting the least recently used
+    finished videos. Sizes and access times live in an in-memory index, saved next to the
+    files and rebuilt from the manifest, so the directory is never walked. Pinned files and
+    files being served are never evicted. headroom() tells the download workers how much
+    can still be written before the quota or the disk runs out.
+    """
+
+    def __init__(self, directory: str = "downloads", quota_bytes: int = 5 * 1024 ** 3,
+                 min_headroom: int = 200 * 1024 ** 2, low_water: float = 0.9, check_interval: float = 60):
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        self.min_headroom = min_headroom    # Workers hold off on new jobs below this
+        self.low_water = low_water          # Eviction frees space down to this share of the quota
+        self.check_interval = check_interval
+        self.used_bytes = 0
+        self._files: "OrderedDict[str, StoredFile]" = OrderedDict()
+        self._in_use: Dict[str, int] = {}
+        self._dirty = False
+        self._wake = asyncio.Event()
+        self._space_freed = asyncio.Event()
+        os.makedirs(self.directory, exist_ok=True)
+        self._load()
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, INDEX_NAME)
+
+    def _load(self):
+        """Load the saved index, then add files the manifest recorded after it was saved"""
+        saved_at = 0.0
+        try:
+            with open(self.index_path) as f:
+                saved = json.load(f)
+            saved_at = saved.get('saved_at', 0.0)
+            entries = sorted(saved.get('files', {}).items(), key=lambda item: item[1]['last_access'])
+            for name, entry in entries:
+                self._files[name] = StoredFile(entry['size'], entry['last_access'], entry.get('pinned', False),
+                                               entry.get('owners', ()))
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning("Storage index unreadable, rebuilding from the manifest: %s", e)
+            self._files.clear()
+            saved_at = 0.0
+
+        for entry in Manifest(os.path.join(self.directory, MANIFEST_NAME)).entries():
+            if entry.get('ts', 0) > saved_at and 'file' in entry:
+                self._files.pop(entry['file'], None)
+                self._files[entry['file']] = StoredFile(entry.get('size', 0), entry.get('ts', 0))
+                self._dirty = True
+
+        # One stat per known file drops ones removed behind our back
+        for name in list(self._files):
+            if not os.path.exists(os.path.join(self.directory, name)):
+                del self._files[name]
+                self._dirty = True
+        self.used_bytes = sum(entry.size for entry in self._files.values())
+        STORAGE_BYTES.set(self.used_bytes)
+
+    def save(self):
+        if not self._dirty:
+            return
+        data = {
+            'saved_at': time.time(),
+            'files': {
+                name: {'size': entry.size, 'last_access': entry.last_access, 'pinned': entry.pinned,
+                       'owners': sorted(entry.owners)}
+                for name, entry in self._files.items()
+            }
+        }
+        with open(self.index_path + '.tmp', 'w') as f:
+            json.dump(data, f)
+        os.replace(self.index_path + '.tmp', self.index_path)
+        self._dirty = False
+
+    # Index updates
+
+    def add(self, path: str, size: int, owner: Optional[str] = None):
+        """Track a finished download, made for the `owner` account"""
+        name = os.path.basename(path)
+        previous = self._files.pop(name, None)
+        if previous is not None:
+            self.used_bytes -= previous.size
+        entry = self._files[name] = StoredFile(size, time.time(), previous.pinned if previous else False,
+                                               previous.owners if previous else ())
+        if owner:
+            entry.owners.add(owner)
+        self.used_bytes += size
+        self._dirty = True
+        STORAGE_BYTES.set(self.used_bytes)
+        if self.headroom() < self.min_headroom:
+            self._wake.set()
+
+    def touch(self, path: str):
+        """Mark a file as just used, moving it to the back of the eviction order"""
+        name = os.path.basename(path)
+        entry = self._files.get(name)
+        if entry is not None:
+            entry.last_access = time.time()
+            self._files.move_to_end(name)
+            self._dirty = True
+
+    def owns(self, path: str, account: Optional[str]) -> bool:
+        """Whether the file was downloaded for, or checked to belong to, the account"""
+        entry = self._files.get(os.path.basename(path))
+        return entry is not None and account in entry.owners
+
+    def add_owner(self, path: str, account: str):
+        entry = self._files.get(os.path.basename(path))
+        if entry is not None and account not in entry.owners:
+            entry.owners.add(account)
+            self._dirty = True
+
+    def pin(self, path: str, pinned: bool = True) -> bool:
+        entry = self._files.get(os.path.basename(path))
+        if entry is None:
+            return False
+        entry.pinned = pinned
+        self._dirty = True
+        return True
+
+    def acquire(self, path: str):
+        """Protect a file from eviction while it is being served, undone by release()"""
+        name = os.path.basename(path)
+        self._in_use[name] = self._in_use.get(name, 0) + 1
+
+    def release(self, path: str):
+        name = os.path.basename(path)
+        count = self._in_use.get(name, 0) - 1
+        if count > 0:
+            self._in_use[name] = count
+        else:
+            self._in_use.pop(name, None)
+
+    # Space accounting
+
+    def headroom(self) -> int:
+        """Bytes that can still be written before hitting the quota or filling the disk"""
+        try:
+            disk_free = shutil.disk_usage(self.directory).free
+        except OSError:
+            disk_free = 0
+        return min(self.quota_bytes - self.used_bytes, disk_free - self.min_headroom)
+
+    async def make_room(self) -> bool:
+        """Evict now if headroom is short, True if there is room for another download"""
+        if self.headroom() < self.min_headroom:
+            await self.evict()
+        return self.headroom() >= self.min_headroom
+
+    async def wait_for_headroom(self):
+        """Hold off until there is room for another download, evicting if that helps"""
+        while self.headroom() < self.min_headroom:
+            self._wake.set()
+            self._space_freed.clear()
+            try:
+                await asyncio.wait_for(self._space_freed.wait(), timeout=self.check_interval)
+            except asyncio.TimeoutError:
+                logger.warning("Downloads paused: %d bytes of headroom left", self.headroom())
+
+    async def evict(self) -> int:
+        """Remove least recently used files until usage is below the low-water mark"""
+        target = int(self.quota_bytes * self.low_water)
+        if self.headroom() < self.min_headroom:
+            # Short of room for one more download, by the quota or on the disk; free at least that much
+            target = min(target, self.used_bytes - (self.min_headroom - self.headroom()))
+        freed = 0
+        for name in list(self._files):
+            if self.used_bytes <= target:
+                break
+            entry = self._files.get(name)
+            if entry is None or entry.pinned or name in self._in_use:
+                continue
+            try:
+                await asyncio.to_thread(os.remove, os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning("Could not evict %s: %s", name, e)
+                continue
+            # The file may have been re-added or claimed while the remove ran
+            if self._files.get(name) is entry:
+                del self._files[name]
+                self.used_bytes -= entry.size
+                freed += entry.size
+                self._dirty = True
+                STORAGE_EVICTIONS.inc()
+        if freed:
+            logger.info("Evicted %d bytes, %d of %d bytes used", freed, self.used_bytes, self.quota_bytes)
+        STORAGE_BYTES.set(self.used_bytes)
+        if freed:
+            self._space_freed.set()
+        return freed
+
+    async def run_evictor(self):
+        """Background task: evict when over quota or short on disk, and save the index"""
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.check_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                if not await self.make_room():
+                    logger.warning("Storage is short on space and nothing more can be evicted")
+                self._space_freed.set()
+                await asyncio.to_thread(self.save)
+            except Exception:
+                logger.exception("Storage eviction failed")
+
+    def stats(self) -> Dict:
+        return {
+            'used_bytes': self.used_bytes,
+            'quota_bytes': self.quota_bytes,
+            'headroom_bytes': self.headroom(),
+            'files': len(self._files),
+            'pinned': sum(1 for entry in self._files.values() if entry.pinned),
+            'in_use': len(self._in_use)
+        }
+
+
+class HeldFileBody:
+    """Response body wrapper that keeps a file marked in use until the body has been sent"""
+
+    def __init__(self, body, storage: StorageManager, path: str):
+        self.body = body
+        self.storage = storage
+        self.path = path
+
+    async def __aenter__(self) -> "HeldFileBody":
+        await self.body.__aenter__()
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, tb):
+        try:
+            await self.body.__aexit__(exc_type, exc_value, tb)
+        finally:
+            self.storage.release(self.path)
+
+    def __aiter__(self) -> "HeldFileBody":
+        return self
+
+    async def __anext__(self) -> bytes:
+        return await self.body.__anext__()
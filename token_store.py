@@ -0,0 +1,129 @@
+import asyncio
+import functools
+import secrets
+import time
+from typing import Awaitable, Callable, Dict, Optional
+
+from auth import TikTokAuth
+from log import get_logger
+
+logger = get_logger('token_store')
+
+TokenProvider = Callable[..., Awaitable[Optional[str]]]
+
+
+class TokenRecord:
+    """OAuth tokens for one TikTok account"""
+
+    def __init__(self, account_id: str, access_token: str, refresh_token: Optional[str],
+                 expires_at: float, refresh_expires_at: Optional[float] = None):
+        self.account_id = account_id
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.expires_at = expires_at
+        self.refresh_expires_at = refresh_expires_at
+
+    @classmethod
+    def from_token_data(cls, account_id: str, token_data: Dict) -> "TokenRecord":
+        now = time.time()
+        refresh_expires_in = token_data.get('refresh_expires_in')
+        return cls(
+            account_id,
+            token_data['access_token'],
+            token_data.get('refresh_token'),
+            now + token_data.get('expires_in', 3600),
+            now + refresh_expires_in if refresh_expires_in else None
+        )
+
+    def expires_within(self, seconds: float) -> bool:
+        return time.time() + seconds >= self.expires_at
+
+    @property
+    def can_refresh(self) -> bool:
+        if not self.refresh_token:
+            return False
+        return self.refresh_expires_at is None or time.time() < self.refresh_expires_at
+
+
+class TokenStore:
+    """
+    Keeps access and refresh tokens per account and renews them before they expire.
+    Concurrent refreshes for the same account share a single call to the token endpoint.
+    """
+
+    def __init__(self, auth: TikTokAuth, refresh_margin: float = 300, check_interval: float = 60):
+        self.auth = auth
+        self.refresh_margin = refresh_margin
+        self.check_interval = check_interval
+        self._tokens: Dict[str, TokenRecord] = {}
+        self._refreshing: Dict[str, asyncio.Future] = {}
+
+    def save(self, token_data: Dict, account_id: Optional[str] = None) -> str:
+        """Store a token response and return the account id it is keyed by"""
+        account_id = account_id or token_data.get('open_id') or secrets.token_urlsafe(16)
+        self._tokens[account_id] = TokenRecord.from_token_data(account_id, token_data)
+        return account_id
+
+    def remove(self, account_id: str):
+        self._tokens.pop(account_id, None)
+
+    def has(self, account_id: Optional[str]) -> bool:
+        record = self._tokens.get(account_id) if account_id else None
+        return record is not None and (not record.expires_within(0) or record.can_refresh)
+
+    async def get_access_token(self, account_id: str, force_refresh: bool = False) -> Optional[str]:
+        """Return a valid access token, refreshing it first if it is about to expire"""
+        record = self._tokens.get(account_id)
+        if record is None:
+            return None
+
+        if force_refresh or record.expires_within(self.refresh_margin):
+            refreshed = await self.refresh(account_id)
+            if refreshed is not None:
+                return refreshed.access_token
+            if record.expires_within(0):
+                return None
+        return record.access_token
+
+    def provider(self, account_id: str) -> TokenProvider:
+        """Token callback for TikTokDownloader, called with force_refresh=True after a 401"""
+        return functools.partial(self.get_access_token, account_id)
+
+    async def refresh(self, account_id: str) -> Optional[TokenRecord]:
+        """Refresh an account's token, joining a refresh that is already in flight"""
+        future = self._refreshing.get(account_id)
+        if future is None:
+            future = asyncio.ensure_future(self._refresh(account_id))
+            self._refreshing[account_id] = future
+            future.add_done_callback(lambda _: self._refreshing.pop(account_id, None))
+        return await asyncio.shield(future)
+
+    async def _refresh(self, account_id: str) -> Optional[TokenRecord]:
+        record = self._tokens.get(account_id)
+        if record is None or not record.can_refresh:
+            return None
+
+        token_data = await self.auth.refresh_access_token(record.refresh_token)
+        if not token_data or 'access_token' not in token_data:
+            logger.warning("Could not refresh token", extra={'account_id': account_id})
+            return None
+
+        # TikTok may rotate the refresh token, keep the old one if it doesn't
+        token_data.setdefault('refresh_token', record.refresh_token)
+        updated = TokenRecord.from_token_data(account_id, token_data)
+        if not token_data.get('refresh_expires_in'):
+            updated.refresh_expires_at = record.refresh_expires_at
+        self._tokens[account_id] = updated
+        return updated
+
+    async def run_refresher(self):
+        """Background loop that renews tokens before they expire"""
+        while True:
+            await asyncio.sleep(self.check_interval)
+            for account_id, record in list(self._tokens.items()):
+                if not record.expires_within(self.refresh_margin):
+                    continue
+                if record.can_refresh:
+                    await self.refresh(account_id)
+                elif record.expires_within(0):
+                    self.remove(account_id)
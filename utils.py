@@ -1,8 +1,20 @@
 import re
 from typing import List, Tuple
-from rich.console import Console
+from log import get_logger
 
-console = Console()
+logger = get_logger('utils')
+
+TIKTOK_URL_PATTERNS = [re.compile(pattern) for pattern in (
+    r'https?://(?:www\.)?tiktok\.com/@[\w.-]+/video/\d+',
+    r'https?://(?:www\.)?tiktok\.com/v/\d+',
+    r'https?://(?:www\.)?tiktok\.com/t/[\w-]+',
+    r'https?://(?:vm|vt)\.tiktok\.com/[\w-]+',
+    r'https?://(?:www\.)?tiktok\.com/[^\s/]+/video/\d+',
+    r'https?://m\.tiktok\.com/v/\d+'
+)]
+
+def is_valid_tiktok_url(url: str) -> bool:
+    return any(pattern.match(url) for pattern in TIKTOK_URL_PATTERNS)
 
 def validate_urls(urls: List[str]) -> List[str]:
     """
@@ -10,28 +22,25 @@ def validate_urls(urls: List[str]) -> List[str]:
     Returns a list of valid URLs
     """
     valid_urls = []
-    tiktok_patterns = [
-        r'https?://(?:www\.)?tiktok\.com/@[\w.-]+/video/\d+',
-        r'https?://(?:www\.)?tiktok\.com/v/\d+',
-        r'https?://(?:www\.)?tiktok\.com/t/[\w-]+',
-        r'https?://(?:vm|vt)\.tiktok\.com/[\w-]+',
-        r'https?://(?:www\.)?tiktok\.com/[^\s/]+/video/\d+',
-        r'https?://m\.tiktok\.com/v/\d+'
-    ]
+    invalid = 0
 
     for url in urls:
         try:
             url = url.strip()
-            is_valid = any(re.match(pattern, url) for pattern in tiktok_patterns)
+            is_valid = is_valid_tiktok_url(url)
             if is_valid:
                 valid_urls.append(url)
             else:
-                console.print(f"[yellow]Warning: Invalid TikTok URL format: {url}[/yellow]")
+                invalid += 1
+                logger.debug("Invalid TikTok URL format: %s", url)
         except Exception as e:
-            console.print(f"[red]Error validating URL {url}: {str(e)}[/red]")
+            invalid += 1
+            logger.debug("Error validating URL %s: %s", url, e)
             continue
 
+    if invalid:
+        logger.warning("Skipped %d invalid TikTok URLs", invalid)
     if not valid_urls:
-        console.print("[red]No valid TikTok URLs found.[/red]")
+        logger.error("No valid TikTok URLs found")
 
     return valid_urls
\ No newline at end of file
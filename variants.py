@@ -0,0 +1,154 @@
+"""
+Video variant selection.
+
+TikTok pages embed the item JSON (SIGI_STATE or __UNIVERSAL_DATA_FOR_REHYDRATION__) with a
+bitrateInfo list: one entry per encode with its bitrate, resolution, byte size and play URLs.
+extract_variants() reads that list; a VariantPolicy orders the variants so the cheapest one
+that meets the requested quality is tried first.
+"""
+import os
+import re
+from typing import Any, Iterator, List, Optional
+
+import fast_json
+
+EMBEDDED_JSON = re.compile(
+    r'<script[^>]+id="(?:SIGI_STATE|__UNIVERSAL_DATA_FOR_REHYDRATION__)"[^>]*>(.*?)</script>', re.S
+)
+POLICY_MODES = ('max', 'bitrate', 'size')
+_UNITS = {'': 1, 'k': 1000, 'm': 1000 ** 2, 'g': 1000 ** 3}
+
+
+class Variant:
+    """One encode of a video"""
+
+    __slots__ = ('url', 'bitrate', 'width', 'height', 'size', 'codec', 'name')
+
+    def __init__(self, url: str, bitrate: Optional[int] = None, width: Optional[int] = None,
+                 height: Optional[int] = None, size: Optional[int] = None, codec: str = "", name: str = ""):
+        self.url = url
+        self.bitrate = bitrate
+        self.width = width
+        self.height = height
+        self.size = size
+        self.codec = codec
+        self.name = name
+
+    def __repr__(self) -> str:
+        return f"Variant({self.name or self.height}, bitrate={self.bitrate}, size={self.size})"
+
+
+def _int(value: Any) -> Optional[int]:
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _video_objects(node: Any) -> Iterator[dict]:
+    """Every dict in the page JSON that carries a bitrateInfo list"""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if isinstance(node, dict):
+            if isinstance(node.get('bitrateInfo'), list):
+                yield node
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            stack.extend(node)
+
+
+def _absolute(url: str) -> str:
+    return 'https:' + url if url.startswith('//') else url
+
+
+def extract_variants(content: str) -> List[Variant]:
+    """Variants listed in the page's embedded JSON, empty when there are none"""
+    variants: List[Variant] = []
+    seen = set()
+    for match in EMBEDDED_JSON.finditer(content):
+        try:
+            state = fast_json.loads(match.group(1))
+        except ValueError:
+            continue
+        for video in _video_objects(state):
+            duration = _int(video.get('duration'))
+            for info in video['bitrateInfo']:
+                if not isinstance(info, dict):
+                    continue
+                play = info.get('PlayAddr') or {}
+                urls = play.get('UrlList') or []
+                if not urls or urls[0] in seen:
+                    continue
+                bitrate = _int(info.get('Bitrate'))
+                size = _int(play.get('DataSize'))
+                if size is None and bitrate and duration:
+                    size = bitrate * duration // 8
+                url = _absolute(urls[0])
+                seen.add(urls[0])
+                variants.append(Variant(
+                    url,
+                    bitrate=bitrate,
+                    width=_int(play.get('Width')),
+                    height=_int(play.get('Height')),
+                    size=size,
+                    codec=info.get('CodecType', ''),
+                    name=info.get('GearName', '')
+                ))
+    return variants
+
+
+def parse_amount(text: str) -> int:
+    """'800k' -> 800000, '25M' -> 25000000"""
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([kmg]?)\s*b?\s*', text.lower())
+    if not match:
+        raise ValueError(f"Not an amount: {text!r}")
+    return int(float(match.group(1)) * _UNITS[match.group(2)])
+
+
+class VariantPolicy:
+    """
+    Which variant to download:
+      max            highest resolution and bitrate
+      bitrate:800k   cheapest variant at or above the bitrate, else the best one below it
+      size:25M       best variant whose size fits the cap, else the smallest one
+    """
+
+    def __init__(self, mode: str = 'max', limit: Optional[int] = None):
+        if mode not in POLICY_MODES:
+            raise ValueError(f"Unknown quality policy {mode!r}, expected one of {', '.join(POLICY_MODES)}")
+        if mode != 'max' and not limit:
+            raise ValueError(f"Quality policy {mode!r} needs a value, e.g. {mode}:{'800k' if mode == 'bitrate' else '25M'}")
+        self.mode = mode
+        self.limit = limit
+
+    @classmethod
+    def parse(cls, text: Optional[str]) -> "VariantPolicy":
+        mode, _, value = (text or 'max').strip().lower().partition(':')
+        return cls(mode, parse_amount(value) if value else None)
+
+    @classmethod
+    def from_env(cls) -> "VariantPolicy":
+        return cls.parse(os.getenv('VIDEO_QUALITY', 'max'))
+
+    def __str__(self) -> str:
+        return self.mode if self.mode == 'max' else f"{self.mode}:{self.limit}"
+
+    def order(self, variants: List[Variant]) -> List[Variant]:
+        """Variants in the order they should be tried"""
+        known = [variant for variant in variants if variant.bitrate]
+        unknown = [variant for variant in variants if not variant.bitrate]
+        best_first = sorted(known, key=lambda v: (v.height or 0, v.bitrate), reverse=True)
+
+        if self.mode == 'bitrate':
+            meets = sorted((v for v in known if v.bitrate >= self.limit), key=lambda v: v.bitrate)
+            below = [v for v in best_first if v.bitrate < self.limit]
+            ordered = meets + below
+        elif self.mode == 'size':
+            fits = [v for v in best_first if v.size is not None and v.size <= self.limit]
+            rest = sorted((v for v in known if v not in fits), key=lambda v: v.size if v.size is not None else float('inf'))
+            ordered = fits + rest
+        else:
+            ordered = best_first
+        # Unlabelled addresses (plain playAddr/downloadAddr) are the fallback
+        return ordered + unknown
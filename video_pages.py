@@ -0,0 +1,120 @@
+import asyncio
+import gzip
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+import fast_json
+from metrics import CACHE_REQUESTS
+from log import get_logger
+
+logger = get_logger('video_pages')
+
+# (account, sort type, cursor, page size)
+PageKey = Tuple[str, str, int, int]
+GZIP_MIN_BYTES = 1024
+
+
+class VideoPage:
+    """A /videos response encoded once, with its ETag and a gzip variant made on first use"""
+
+    __slots__ = ('payload', 'body', 'etag', 'fetched_at', '_gzip')
+
+    def __init__(self, payload: Dict[str, Any], fetched_at: Optional[float] = None):
+        self.payload = payload
+        self.body = fast_json.dumps(payload)
+        self.etag = hashlib.sha256(self.body).hexdigest()[:16]
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self._gzip = None
+
+    def negotiate(self, accept_encoding: str):
+        """Gzip the body if the client accepts it and it is worth it, returning (body, encoding)"""
+        accepted = {part.split(';')[0].strip() for part in (accept_encoding or '').split(',')}
+        if 'gzip' not in accepted or len(self.body) < GZIP_MIN_BYTES:
+            return self.body, None
+        if self._gzip is None:
+            self._gzip = gzip.compress(self.body, compresslevel=6, mtime=0)
+        return self._gzip, 'gzip'
+
+
+class VideoPageCache:
+    """
+    Recently fetched /videos pages per account, sort order, cursor and page size.
+    Serving a page prefetches the next one in the background, so "Load More" is
+    answered from memory. Pages expire after `ttl` so new uploads show up, and
+    concurrent requests for the same page share one upstream call.
+    """
+
+    def __init__(self, ttl: float = 60, max_entries: int = 2000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[PageKey, VideoPage]" = OrderedDict()
+        self._inflight: Dict[PageKey, asyncio.Future] = {}
+        self._prefetches: Set[asyncio.Task] = set()
+
+    def get(self, key: PageKey) -> Optional[VideoPage]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.fetched_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, key: PageKey, payload: Dict[str, Any]) -> VideoPage:
+        entry = VideoPage(payload)
+        # get_user_videos reports upstream errors as an empty page, which must not stick
+        if payload.get('videos'):
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    async def fetch(self, key: PageKey, fetcher: Callable[[], Awaitable[Dict[str, Any]]],
+                    result: str = 'miss') -> VideoPage:
+        """Cached page for `key`, or the page `fetcher()` returns"""
+        entry = self.get(key)
+        if entry is not None:
+            CACHE_REQUESTS.inc(cache='video_page', result='hit')
+            return entry
+
+        future = self._inflight.get(key)
+        if future is not None:
+            # A request or a prefetch is already fetching this page
+            CACHE_REQUESTS.inc(cache='video_page', result='shared')
+            entry = await asyncio.shield(future)
+            if entry is not None:
+                return entry
+            return await self.fetch(key, fetcher)
+
+        CACHE_REQUESTS.inc(cache='video_page', result=result)
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        try:
+            entry = self.put(key, await fetcher())
+            return entry
+        finally:
+            # Waiters get None when the fetch failed or was cancelled, and fetch on their own
+            future.set_result(entry)
+            del self._inflight[key]
+
+    def prefetch(self, key: PageKey, fetcher: Callable[[], Awaitable[Dict[str, Any]]]):
+        """Fetch a page in the background unless it is cached or already being fetched"""
+        if key in self._inflight or self.get(key) is not None:
+            return
+
+        async def run():
+            try:
+                await self.fetch(key, fetcher, result='prefetch')
+            except Exception as e:
+                logger.debug("Prefetch of %s failed: %s", key[1:], e)
+
+        task = asyncio.create_task(run())
+        self._prefetches.add(task)
+        task.add_done_callback(self._prefetches.discard)
+
+    def cancel_all(self):
+        for task in list(self._prefetches):
+            task.cancel()
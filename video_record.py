@@ -0,0 +1,64 @@
+import time
+from typing import Any, Dict, Tuple
+
+CREATE_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class VideoRecord:
+    """
+    One video from the user's library. Slotted and flat, with the raw epoch create time,
+    so large cached libraries stay small; the API shape is only built by to_dict().
+    """
+
+    __slots__ = ('id', 'title', 'cover_url', 'share_url', 'create_time', 'likes', 'views', 'shares', 'hashtags')
+
+    def __init__(self, id: str, title: str = "", cover_url: str = "", share_url: str = "", create_time: int = 0,
+                 likes: int = 0, views: int = 0, shares: int = 0, hashtags: Tuple[str, ...] = ()):
+        self.id = id
+        self.title = title
+        self.cover_url = cover_url
+        self.share_url = share_url
+        self.create_time = create_time
+        self.likes = likes
+        self.views = views
+        self.shares = shares
+        self.hashtags = hashtags
+
+    @classmethod
+    def from_api(cls, video: Dict[str, Any]) -> "VideoRecord":
+        """Build a record from a /video/list/ item"""
+        statistics = video.get("statistics") or {}
+        return cls(
+            video["id"],
+            video.get("title", ""),
+            video.get("cover_url", ""),
+            video.get("share_url", ""),
+            video.get("create_time", 0),
+            statistics.get("like_count", 0),
+            statistics.get("view_count", 0),
+            statistics.get("share_count", 0),
+            tuple(tag["name"] for tag in video.get("hashtags", ()))
+        )
+
+    @property
+    def created_at(self) -> str:
+        """Create time in local time, formatted on demand"""
+        return time.strftime(CREATE_TIME_FORMAT, time.localtime(self.create_time))
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "title": self.title,
+            "cover_url": self.cover_url,
+            "share_url": self.share_url,
+            "create_time": self.created_at,
+            "stats": {
+                "likes": self.likes,
+                "views": self.views,
+                "shares": self.shares
+            },
+            "hashtags": list(self.hashtags)
+        }
+
+    def __repr__(self) -> str:
+        return f"VideoRecord({self.id!r}, {self.title!r})"